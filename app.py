@@ -1,15 +1,28 @@
+import os
 import streamlit as st
-import pandas as pd
-from streamlit_folium import st_folium
-from utils.data import calculate_trip
-from utils.charts import create_comparison_chart, create_efficiency_scatter
-from utils.chatbot import EcoAssistant
-from utils.map_viz import create_trip_map
+from utils.startup import start_background_warmup
+from utils.telemetry import TELEMETRY, start_metrics_server
+from utils.trip_cache import TRIP_CACHE, shared_calculate_trip, trip_key
+from utils.geocoding import GeocodeTimeout
+from utils.charts import create_comparison_chart, create_efficiency_scatter, create_uncertainty_chart
+from utils.chatbot import UNAVAILABLE, EcoAssistant
+from utils.prompting import ChatMemory, compact_results
+from utils.map_viz import create_trip_map, get_route
+from utils.road_matrix import road_estimates
+from utils.gazetteer import get_gazetteer
+from utils.itinerary import MAX_STOPS, plan_itinerary
+from utils.uncertainty import INTERACTIVE_DRAWS, trip_uncertainty
 from dotenv import load_dotenv
 
 # Chargement des variables d'environnement
 load_dotenv()
 
+# Pré-chargement optionnel des dépendances lourdes (ECOROUTE_WARMUP=1)
+start_background_warmup()
+
+# Export Prometheus sur un port dédié (ECOROUTE_METRICS_PORT), une fois par processus
+start_metrics_server()
+
 # Configuration de la page
 st.set_page_config(page_title="EcoRoute 🎄", layout="wide", page_icon="🎅")
 
@@ -60,135 +73,308 @@ with st.sidebar:
     st.info(f"Actif : **{'Llama 3' if use_groq else 'Gemini 2.5'}**")
 
 # --- Inputs ---
+def _pick_suggestion(key):
+    """Recopie la suggestion choisie dans le champ texte."""
+    choice = st.session_state.get(f"{key}_sugg")
+    if choice:
+        st.session_state[key] = choice.rsplit(" (", 1)[0]
+
+def city_input(label, default, key):
+    """Champ ville avec autocomplétion hors-ligne (si le répertoire des communes est présent)."""
+    value = st.text_input(label, default, key=key)
+    gazetteer = get_gazetteer()
+    if gazetteer and value and not gazetteer.lookup(value):
+        suggestions = gazetteer.suggest(value, limit=5)
+        if suggestions:
+            st.pills("Suggestions", [p.label for p in suggestions], key=f"{key}_sugg",
+                     on_change=_pick_suggestion, args=(key,), label_visibility="collapsed")
+        else:
+            st.caption("🔎 Ville inconnue localement, recherche en ligne au calcul.")
+    return value
+
 col1, col2, col3 = st.columns([2, 2, 1])
 with col1:
-    start = st.text_input("📍 Départ", "Paris")
+    start = city_input("📍 Départ", "Paris", key="start_city")
 with col2:
-    end = st.text_input("📍 Arrivée", "Brest")
+    end = city_input("📍 Arrivée", "Brest", key="end_city")
 with col3:
     st.write(""); st.write("") 
     calc_btn = st.button("Calculer 🔍", type="primary", use_container_width=True)
 
 # --- Session State ---
-if "trip_result" not in st.session_state:
-    st.session_state.trip_result = None
-    st.session_state.coords = None
+# La session ne garde que la clé du trajet : le résultat vit dans le cache partagé entre sessions
+if "trip_key" not in st.session_state:
+    st.session_state.trip_key = None
 
 if calc_btn and start and end:
     with st.spinner("Calcul des itinéraires, prix et CO2..."):
-        df, dist, cs, ce = calculate_trip(start, end)
-        if df is not None:
-            st.session_state.trip_result = df
-            st.session_state.trip_dist = dist
-            st.session_state.coords = (cs, ce)
-            st.session_state.messages = [] 
+        try:
+            result, *_ = shared_calculate_trip(start, end, key=trip_key(start, end))
+        except GeocodeTimeout: # Ni trouvée ni introuvable : la recherche continue en arrière-plan
+            st.warning("⏳ Géocodage trop lent (service de cartographie saturé). Réessayez dans quelques secondes.")
         else:
-            st.error("Ville introuvable. Essayez avec des grandes villes.")
+            if result is not None:
+                # Clé de la version des facteurs réellement utilisée (rafraîchissement pendant le calcul)
+                st.session_state.trip_key = trip_key(start, end, result.factor_version)
+                st.session_state.trip_names = (start, end)
+                st.session_state.chat_memory = ChatMemory()
+            else:
+                st.error("Ville introuvable. Essayez avec des grandes villes.")
 
 # --- Affichage Résultats ---
-if st.session_state.trip_result is not None:
-    df = st.session_state.trip_result
-    dist = st.session_state.trip_dist
-    coords = st.session_state.coords
-    
+# Chaque onglet est un fragment : une interaction (chat, choix du tracé) ne relance que son onglet.
+# Graphiques, cartes et analyse sont mis en cache sur l'empreinte du trajet.
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_charts(fingerprint, _result):
+    """Figures du comparateur pour ce trajet (`_result` non haché : l'empreinte sert de clé)."""
+    df = _result.to_frame()
+    return create_comparison_chart(df), create_efficiency_scatter(df)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_uncertainty(fingerprint, draws, _result):
+    """Percentiles Monte Carlo et graphique des fourchettes pour ce trajet (tirages reproductibles)."""
+    df = trip_uncertainty(_result, draws=draws)
+    return df, create_uncertainty_chart(df)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def cached_trip_map(fingerprint, start_name, end_name, mode, _coords):
+    """Carte Folium pour ce trajet et ce mode (copie par appel : une session ne modifie pas celle des autres)."""
+    return create_trip_map(_coords[0], _coords[1], start_name, end_name, selected_mode=mode)
+
+@st.fragment
+def comparator_tab(result, dist):
+    # --- KPI ---
+    best_co2 = result.best_co2
+    best_price = result.best_price
+
+    k1, k2, k3 = st.columns(3)
+    k1.metric("Distance", f"{dist:.0f} km")
+    k2.metric("Meilleur Prix", f"{best_price.mode}", f"{best_price.price_avg} €")
+    k3.metric("Meilleur CO2", f"{best_co2.mode}", f"{best_co2.co2_kg} kg")
+    st.caption(f"Facteurs d'émission : version `{result.factor_version}`")
+
+    st.divider()
+
+    # --- Détail Prix ---
+    st.subheader("💰 Détail des Fourchettes de Prix")
+    for row in result.rows():
+        label = f"**{row.mode}** — {row.price_avg:.0f}€ en moyenne"
+        with st.expander(label):
+            c1, c2, c3, c4 = st.columns(4)
+            c1.metric("💵 Prix Min", f"{row.price_min:.2f}€")
+            c2.metric("💰 Prix Moyen", f"{row.price_avg:.2f}€")
+            c3.metric("💸 Prix Max", f"{row.price_max:.2f}€")
+            c4.metric("🌱 CO2", f"{row.co2_kg} kg", delta_color="inverse")
+            if row.price_type == "voiture":
+                st.caption(f"⛽ Carburant : {row.fuel_cost:.2f}€ · 🛣️ Péage : {row.toll_cost:.2f}€")
+
+    # --- Scénarios (Monte Carlo) ---
+    if st.toggle("🎲 Mode incertitude : scénarios Monte Carlo",
+                 help="Carburant, consommation, covoiturage, péages, date de réservation et détours tirés au hasard"):
+        draws = st.select_slider("Scénarios", [1000, 2000, INTERACTIVE_DRAWS, 10000], value=INTERACTIVE_DRAWS)
+        df_mc, fig_mc = cached_uncertainty(result.fingerprint, draws, result)
+        st.caption("Prix et CO2 sur la même base que le tableau (voiture entière, billet par personne) : "
+                   "P5 / médiane / P95 sur les scénarios, et probabilité d'être le mode payant le moins cher. "
+                   "Dernière colonne : prix médian par voyageur, voiture partagée entre ses occupants.")
+        st.dataframe(df_mc, hide_index=True, use_container_width=True,
+                     column_config={"P(moins cher)": st.column_config.ProgressColumn(format="percent", min_value=0, max_value=1)})
+        st.plotly_chart(fig_mc, use_container_width=True)
+
+    st.divider()
+    st.subheader("📈 Comparaison Visuelle")
+    comparison, scatter = cached_charts(result.fingerprint, result)
+    st.plotly_chart(comparison, use_container_width=True)
+    st.plotly_chart(scatter, use_container_width=True)
+
+@st.fragment
+def analysis_tab(result, start, end):
+    # Analyse générée une fois par trajet, puis relue depuis la session
+    fingerprint = result.fingerprint
+    saved = st.session_state.get("analysis")
+    if saved and saved[0] == fingerprint:
+        st.markdown(saved[1])
+        return
+    bot = EcoAssistant()
+    # Affichage au fil de la génération (instantané si la réponse est en cache)
+    text = st.write_stream(bot.analyze_trip_stream(start, end, result))
+    if UNAVAILABLE not in text: # Échec : on retentera au prochain affichage
+        st.session_state.analysis = (fingerprint, text)
+
+@st.fragment
+def chat_tab(result, start, end):
+    st.write("Discutez avec EcoBot :")
+    # Mémoire bornée : derniers échanges affichés, les plus anciens résumés
+    if "chat_memory" not in st.session_state: st.session_state.chat_memory = ChatMemory()
+    memory = st.session_state.chat_memory
+    if memory.folded: st.caption(f"💭 {memory.folded} messages plus anciens résumés pour EcoBot")
+    for m in memory.history(): st.chat_message(m["role"]).write(m["content"])
+
+    if p := st.chat_input("Votre question..."):
+        st.chat_message("user").write(p)
+        bot = EcoAssistant()
+        ctx = f"Trajet {start}-{end}. Best CO2: {result.best_co2.mode}.\n{compact_results(result)}"
+        r = st.chat_message("assistant").write_stream(bot.chat_stream(p, ctx, use_groq, memory=memory))
+        memory.add("user", p)
+        memory.add("assistant", r)
+
+@st.fragment
+def map_tab(result, dist, start, end, coords):
+    st.subheader(f"🗺️ Itinéraire : {start} ➝ {end}")
+
+    # 1. Sélecteur de mode
+    options_carte = ["Route", "Train", "Avion"]
+    mode_choisi = st.selectbox("Afficher le tracé pour :", options_carte, index=0)
+
+    # 2. Création des colonnes (Carte à gauche, Infos à droite)
+    col_map, col_info = st.columns([2, 1])
+
+    with col_map:
+        from streamlit_folium import st_folium # Import paresseux : seulement si la carte est affichée
+        # Affichage de la Carte (construite une fois par trajet et par mode)
+        map_obj = cached_trip_map(result.fingerprint, start, end, mode_choisi, coords)
+        # On adapte la largeur à la colonne
+        st_folium(map_obj, height=500, use_container_width=True)
+
+    with col_info:
+        st.markdown(f"### ℹ️ Infos : {mode_choisi}")
+        if mode_choisi == "Route":
+            # Distance / durée réelles OSRM (déjà en cache après le tracé)
+            route = get_route(coords[0], coords[1], profile="driving")
+            if route and route["distance_km"]:
+                h, mn = divmod(int(route["duration_min"] or 0), 60)
+                st.caption(f"🛣️ Itinéraire OSRM : {route['distance_km']:.0f} km, {h} h {mn:02d}")
+            else:
+                # OSRM indisponible : estimation de la matrice des hubs, si elle existe
+                km, minutes = road_estimates([coords[0]], [coords[1]], [dist])
+                if minutes[0] == minutes[0]: # Durée connue (pas NaN)
+                    h, mn = divmod(int(minutes[0]), 60)
+                    st.caption(f"🛣️ Estimation (matrice routière) : {km[0]:.0f} km, {h} h {mn:02d}")
+
+        # 3. Logique de filtrage selon votre demande
+        target_keywords = []
+
+        if mode_choisi == "Route":
+            # Voiture (Thermique/Élec), Autocar, Vélo
+            target_keywords = ["Voiture", "Autocar", "Vélo"]
+        elif mode_choisi == "Train":
+            # Tous les trains (TGV, Intercités, TER...)
+            target_keywords = ["Train"]
+        elif mode_choisi == "Avion":
+            # Seulement l'avion
+            target_keywords = ["Avion"]
+
+        # 4. Boucle d'affichage des cartes d'info
+        # On ne garde que les modes dont le nom contient un des mots-clés (ex: "Voiture" est dans "Voiture (Thermique)")
+        count = 0
+        for row in result.rows(tuple(target_keywords)):
+            count += 1
+            # Création d'une petite carte visuelle (Container)
+            with st.container(border=True):
+                st.markdown(f"**{row.mode}**")
+
+                ci1, ci2 = st.columns(2)
+                ci1.metric("Prix Moy.", f"{row.price_avg:.0f} €")
+                ci2.metric("CO2", f"{row.co2_kg} kg")
+
+                # Petite barre de progression visuelle pour le CO2 (base 200kg)
+                st.progress(min(row.co2_kg / 200, 1.0))
+
+        if count == 0:
+            st.info("Aucune donnée disponible pour ce mode.")
+
+result = None
+if st.session_state.trip_key is not None:
+    trip_start, trip_end = st.session_state.trip_names # Villes du dernier calcul (pas la saisie en cours)
+    # TripResult partagé (lecture seule) ; recalculé seulement s'il a été évincé du cache
+    try:
+        result, dist, *coords = shared_calculate_trip(trip_start, trip_end, key=st.session_state.trip_key)
+    except GeocodeTimeout:
+        result = None
+    coords = tuple(coords) if result is not None else None
+    if result is not None: # Recalculé après éviction : peut-être avec des facteurs plus récents
+        st.session_state.trip_key = trip_key(trip_start, trip_end, result.factor_version)
+    else:
+        st.session_state.trip_key = None
+        st.error("Trajet indisponible, relancez le calcul.")
+
+if result is not None:
     # Onglets
     t1, t2, t3, t4 = st.tabs(["📊 Comparateur", "🤖 Analyse IA", "💬 Chat", "🗺️ Carte"])
     
     with t1:
-        # --- KPI ---
-        best_co2 = df.sort_values("CO2 (kg)").iloc[0]
-        best_price = df.sort_values("Prix Moyen (€)").iloc[0]
-        
-        k1, k2, k3 = st.columns(3)
-        k1.metric("Distance", f"{dist:.0f} km")
-        k2.metric("Meilleur Prix", f"{best_price['Mode']}", f"{best_price['Prix Moyen (€)']} €")
-        k3.metric("Meilleur CO2", f"{best_co2['Mode']}", f"{best_co2['CO2 (kg)']} kg")
-        
-        st.divider()
-
-        # --- Détail Prix ---
-        st.subheader("💰 Détail des Fourchettes de Prix")
-        for _, row in df.iterrows():
-            label = f"**{row['Mode']}** — {row['Prix Moyen (€)']:.0f}€ en moyenne"
-            with st.expander(label):
-                c1, c2, c3, c4 = st.columns(4)
-                c1.metric("💵 Prix Min", f"{row['Prix Min (€)']:.2f}€")
-                c2.metric("💰 Prix Moyen", f"{row['Prix Moyen (€)']:.2f}€")
-                c3.metric("💸 Prix Max", f"{row['Prix Max (€)']:.2f}€")
-                c4.metric("🌱 CO2", f"{row['CO2 (kg)']} kg", delta_color="inverse")
-
-        st.divider()
-        st.subheader("📈 Comparaison Visuelle")
-        st.plotly_chart(create_comparison_chart(df), use_container_width=True)
-        st.plotly_chart(create_efficiency_scatter(df), use_container_width=True)
+        comparator_tab(result, dist)
 
     with t2:
-        bot = EcoAssistant()
-        st.markdown(bot.analyze_trip(start, end, df))
+        analysis_tab(result, trip_start, trip_end)
         
     with t3:
-        st.write("Discutez avec EcoBot :")
-        if "messages" not in st.session_state: st.session_state.messages = []
-        for m in st.session_state.messages: st.chat_message(m["role"]).write(m["content"])
-        
-        if p := st.chat_input("Votre question..."):
-            st.session_state.messages.append({"role": "user", "content": p})
-            st.chat_message("user").write(p)
-            bot = EcoAssistant()
-            ctx = f"Trajet {start}-{end}. Best CO2: {best_co2['Mode']}."
-            r = bot.chat(p, ctx, use_groq)
-            st.session_state.messages.append({"role": "assistant", "content": r})
-            st.chat_message("assistant").write(r)
+        chat_tab(result, trip_start, trip_end)
 
     with t4:
-        st.subheader(f"🗺️ Itinéraire : {start} ➝ {end}")
-        
-        # 1. Sélecteur de mode
-        options_carte = ["Route", "Train", "Avion"]
-        mode_choisi = st.selectbox("Afficher le tracé pour :", options_carte, index=0)
-        
-        # 2. Création des colonnes (Carte à gauche, Infos à droite)
-        col_map, col_info = st.columns([2, 1])
-        
-        with col_map:
-            # Affichage de la Carte
-            map_obj = create_trip_map(coords[0], coords[1], start, end, selected_mode=mode_choisi)
-            # On adapte la largeur à la colonne
-            st_folium(map_obj, height=500, use_container_width=True)
-            
-        with col_info:
-            st.markdown(f"### ℹ️ Infos : {mode_choisi}")
-            
-            # 3. Logique de filtrage selon votre demande
-            target_keywords = []
-            
-            if mode_choisi == "Route":
-                # Voiture (Thermique/Élec), Autocar, Vélo
-                target_keywords = ["Voiture", "Autocar", "Vélo"]
-            elif mode_choisi == "Train":
-                # Tous les trains (TGV, Intercités, TER...)
-                target_keywords = ["Train"]
-            elif mode_choisi == "Avion":
-                # Seulement l'avion
-                target_keywords = ["Avion"]
-            
-            # 4. Boucle d'affichage des cartes d'info
-            # On parcourt le dataframe et on affiche si le mode correspond aux mots-clés
-            count = 0
-            for _, row in df.iterrows():
-                # On vérifie si le nom du mode contient un des mots-clés (ex: "Voiture" est dans "Voiture (Thermique)")
-                if any(keyword in row['Mode'] for keyword in target_keywords):
-                    count += 1
-                    # Création d'une petite carte visuelle (Container)
-                    with st.container(border=True):
-                        st.markdown(f"**{row['Mode']}**")
-                        
-                        ci1, ci2 = st.columns(2)
-                        ci1.metric("Prix Moy.", f"{row['Prix Moyen (€)']:.0f} €")
-                        ci2.metric("CO2", f"{row['CO2 (kg)']} kg")
-                        
-                        # Petite barre de progression visuelle pour le CO2 (base 200kg)
-                        st.progress(min(row['CO2 (kg)'] / 200, 1.0))
-
-            if count == 0:
-                st.info("Aucune donnée disponible pour ce mode.")
\ No newline at end of file
+        map_tab(result, dist, trip_start, trip_end, coords)
+
+# --- Itinéraire multi-étapes ---
+@st.fragment
+def itinerary_section():
+    with st.expander("🧭 Itinéraire multi-étapes (tournée, vacances…)"):
+        stops_text = st.text_area("Étapes (une ville par ligne, dans l'ordre de départ)", "Paris\nLyon\nMarseille\nBordeaux")
+        o1, o2, o3 = st.columns(3)
+        objective = o1.radio("Critère", ["co2", "price"], horizontal=True,
+                             format_func=lambda o: "🌱 CO2" if o == "co2" else "💰 Prix")
+        optimize = o2.checkbox("Optimiser l'ordre des étapes")
+        keep_end = o3.checkbox("Garder la dernière étape en arrivée", value=True, disabled=not optimize)
+        if st.button("Planifier 🧭"):
+            try:
+                with st.spinner("Calcul des tronçons..."):
+                    itinerary, missing = plan_itinerary(stops_text.splitlines(), objective=objective,
+                                                        optimize=optimize, keep_end=keep_end)
+            except ValueError as e: # Trop d'étapes : rien n'est ignoré en silence
+                st.error(f"{e}. Retirez des étapes (maximum {MAX_STOPS}).")
+            else:
+                st.session_state.itinerary = itinerary
+                if missing: st.warning(f"Étapes introuvables ignorées : {', '.join(missing)}")
+                if itinerary is None: st.error("Il faut au moins deux étapes trouvées.")
+
+        itinerary = st.session_state.get("itinerary")
+        if itinerary is None: return
+        st.markdown(" ➝ ".join(f"**{s}**" for s in itinerary.stops))
+        # Mode par tronçon : changer un mode ne recalcule rien (tronçons en cache)
+        for i, (a, b, leg) in enumerate(zip(itinerary.stops, itinerary.stops[1:], itinerary.legs)):
+            modes = list(leg.modes)
+            l1, l2 = st.columns([2, 3])
+            l1.markdown(f"{i + 1}. {a} ➝ {b}")
+            choice = l2.selectbox("Mode", modes, index=modes.index(itinerary.modes[i].mode),
+                                  key=f"leg_mode_{id(itinerary)}_{i}", label_visibility="collapsed")
+            itinerary.set_mode(i, choice)
+            m = itinerary.modes[i]
+            l2.caption(f"{m.distance_km:.0f} km · {m.co2_kg} kg CO2 · {m.price_avg:.0f} €")
+        t1, t2, t3 = st.columns(3)
+        t1.metric("Distance totale", f"{itinerary.total_km:.0f} km")
+        t2.metric("CO2 total", f"{itinerary.total_co2} kg")
+        t3.metric("Prix total", f"{itinerary.total_price:.0f} €")
+
+itinerary_section()
+
+# --- Panneau de debug (?debug=1 ou ECOROUTE_DEBUG=1) : où part le temps d'un clic ---
+if st.query_params.get("debug") == "1" or os.environ.get("ECOROUTE_DEBUG") == "1":
+    with st.sidebar:
+        st.divider()
+        st.header("🐞 Debug")
+        st.caption("Latences par étape (ms, fenêtre glissante)")
+        st.dataframe(TELEMETRY.stage_summary(), hide_index=True, use_container_width=True)
+        st.caption("Caches")
+        st.dataframe(TELEMETRY.cache_summary(), hide_index=True, use_container_width=True)
+        st.caption("Cache des trajets (partagé entre sessions)")
+        st.json(TRIP_CACHE.stats(), expanded=False)
+        traces = TELEMETRY.recent_traces()
+        if traces:
+            st.caption("Dernières traces")
+            for trace in traces[:5]:
+                root = trace[0]
+                with st.expander(f"{root['stage']} — {root['ms']} ms" + (" ❌" if root["error"] else "")):
+                    st.code("\n".join(
+                        f"{'  ' * s['depth']}{s['stage']:<24} {s['ms']:>9} ms" + (f"  {s['error']}" if s["error"] else "")
+                        for s in trace), language=None)
+        st.download_button("📥 Métriques (Prometheus)", TELEMETRY.prometheus_text(),
+                           file_name="ecoroute_metrics.txt", mime="text/plain")
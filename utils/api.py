@@ -0,0 +1,205 @@
+"""
+utils/api.py
+Service HTTP JSON (asynchrone) exposant le calculateur EcoRoute aux outils internes.
+Les fonctions de utils.data / utils.pricing / utils.map_viz (bloquantes) tournent dans un
+pool de threads partagé ; caches (géocodage, itinéraires, facteurs) et limiteur Nominatim
+sont communs à toutes les requêtes du processus.
+
+Usage : python -m utils.api --port 8080
+    POST /trip    {"start": "Paris", "end": "Brest"}
+    POST /trips   {"origins": [...], "destinations": [...], "pairwise": false, "draws": 0}
+    POST /itinerary {"stops": ["Paris", "Lyon", "Marseille"], "objective": "co2", "optimize": false}
+    GET  /factors
+    GET  /route?start=48.85,2.35&end=48.39,-4.49&profile=driving&zoom=6
+    GET  /health (dont les statistiques du cache partagé des trajets)
+    GET  /metrics (format texte Prometheus)
+"""
+import argparse
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+MAX_BATCH_PAIRS = 100_000
+MAX_SCENARIO_SAMPLES = 20_000_000 # Paires × tirages Monte Carlo par requête
+POOL_KEY = web.AppKey("pool", ThreadPoolExecutor)
+_dumps = functools.partial(json.dumps, ensure_ascii=False)
+
+async def _run(request, func, *args, **kwargs):
+    """Exécute une fonction bloquante dans le pool du service."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(request.app[POOL_KEY], functools.partial(func, *args, **kwargs))
+
+def _json(data, status=200):
+    return web.json_response(data, status=status, dumps=_dumps)
+
+def _bad_request(message):
+    return _json({"error": message}, status=400)
+
+async def _json_body(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text='{"error": "JSON invalide"}', content_type="application/json")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text='{"error": "Objet JSON attendu"}', content_type="application/json")
+    return body
+
+def _valid_city(p):
+    """Chaîne non vide (nom de ville, mot-clé de mode)."""
+    return isinstance(p, str) and bool(p.strip())
+
+def _valid_coords(lat, lon):
+    # Comparaisons fausses pour NaN et hors bornes pour ±inf (ex : 1e400 en JSON)
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+def _valid_place(p):
+    """Nom de ville (str) ou coordonnées [lat, lon] finies et dans les bornes."""
+    if isinstance(p, str): return _valid_city(p)
+    return (isinstance(p, list) and len(p) == 2
+            and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in p)
+            and _valid_coords(*p))
+
+def _parse_point(value):
+    lat, lon = (float(x) for x in value.split(","))
+    if not _valid_coords(lat, lon): raise ValueError(value)
+    return (lat, lon)
+
+async def health(request):
+    from utils.trip_cache import TRIP_CACHE
+    return _json({"status": "ok", "trip_cache": TRIP_CACHE.stats()})
+
+async def metrics(request):
+    from utils.telemetry import prometheus_text
+    return web.Response(body=prometheus_text().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def trip(request):
+    from utils.geocoding import GeocodeTimeout
+    from utils.trip_cache import shared_calculate_trip
+    body = await _json_body(request)
+    start, end = body.get("start"), body.get("end")
+    if not _valid_city(start) or not _valid_city(end):
+        return _bad_request("Champs 'start' et 'end' requis (noms de villes)")
+    try:
+        result, *_ = await _run(request, shared_calculate_trip, start, end)
+    except GeocodeTimeout as e:
+        return _json({"error": str(e)}, status=504)
+    if result is None:
+        return _json({"error": "Ville introuvable"}, status=404)
+    return _json(result.to_dict())
+
+async def trips(request):
+    from utils.data import calculate_trips
+    body = await _json_body(request)
+    origins, destinations = body.get("origins"), body.get("destinations")
+    pairwise = bool(body.get("pairwise", False))
+    if not isinstance(origins, list) or not isinstance(destinations, list):
+        return _bad_request("Listes 'origins' et 'destinations' requises")
+    if not all(_valid_place(p) for p in origins + destinations):
+        return _bad_request("Chaque étape doit être un nom de ville ou des coordonnées [lat, lon]")
+    n_pairs = len(origins) if pairwise else len(origins) * len(destinations)
+    if n_pairs > MAX_BATCH_PAIRS:
+        return _bad_request(f"Trop de paires ({n_pairs} > {MAX_BATCH_PAIRS}) : utilisez python -m utils.batch")
+    draws = body.get("draws") or None
+    if draws is not None and (not isinstance(draws, int) or isinstance(draws, bool) or draws < 0):
+        return _bad_request("'draws' : entier positif")
+    if draws and n_pairs * draws > MAX_SCENARIO_SAMPLES:
+        return _bad_request(f"Trop de scénarios ({n_pairs} × {draws}) : utilisez python -m utils.batch --draws")
+    # Coordonnées acceptées sous forme [lat, lon]
+    origins = [tuple(p) if isinstance(p, list) else p for p in origins]
+    destinations = [tuple(p) if isinstance(p, list) else p for p in destinations]
+    try:
+        df = await _run(request, calculate_trips, origins, destinations, pairwise=pairwise, draws=draws)
+    except ValueError as e:
+        return _bad_request(str(e))
+    df["Type Prix"] = df["Type Prix"].astype(str)
+    return _json({
+        "factor_version": df.attrs.get("factor_version"),
+        "rows": df.to_dict(orient="records"),
+    })
+
+async def itinerary(request):
+    from utils.itinerary import MAX_STOPS, plan_itinerary
+    body = await _json_body(request)
+    stops = body.get("stops")
+    if not isinstance(stops, list) or not all(isinstance(s, str) for s in stops):
+        return _bad_request("Liste 'stops' (noms de villes) requise")
+    if len(stops) > MAX_STOPS:
+        return _bad_request(f"Trop d'étapes ({len(stops)} > {MAX_STOPS})")
+    keywords = body.get("modes")
+    if keywords is not None and not (isinstance(keywords, list) and all(_valid_city(k) for k in keywords)):
+        return _bad_request("'modes' : liste de noms de modes (ex : [\"Train\"])")
+    try:
+        result, missing = await _run(request, plan_itinerary, stops, objective=body.get("objective", "co2"),
+                                     keywords=tuple(k.strip() for k in keywords) if keywords else None,
+                                     optimize=bool(body.get("optimize", False)),
+                                     keep_end=bool(body.get("keep_end", True)))
+    except ValueError as e:
+        return _bad_request(str(e))
+    if result is None:
+        return _json({"error": "Moins de deux étapes trouvées", "missing": missing}, status=404)
+    return _json({**result.to_dict(), "missing": missing})
+
+async def factors(request):
+    from utils.factors import FACTOR_STORE
+    snap = FACTOR_STORE.snapshot()
+    return _json(snap._asdict())
+
+async def route(request):
+    import polyline
+    from utils.map_viz import get_route, tolerance_for_zoom
+    try:
+        start = _parse_point(request.query["start"])
+        end = _parse_point(request.query["end"])
+        zoom = int(request.query.get("zoom", 0)) or None
+    except (KeyError, ValueError):
+        return _bad_request("Paramètres 'start' et 'end' attendus au format lat,lon")
+    profile = request.query.get("profile", "driving")
+    if profile not in ("driving", "cycling"):
+        return _bad_request("profile : 'driving' ou 'cycling'")
+    data = await _run(request, get_route, start, end, profile)
+    if not data:
+        return _json({"error": "Itinéraire indisponible"}, status=502)
+    tolerance = tolerance_for_zoom(zoom) if zoom else 0.0
+    geometry = data["levels"][str(tolerance)]
+    return _json({
+        "distance_km": data["distance_km"],
+        "duration_min": data["duration_min"],
+        "tolerance": tolerance,
+        "polyline": geometry,
+        "points": len(polyline.decode(geometry)),
+    })
+
+def create_app(max_workers: int = 16) -> web.Application:
+    app = web.Application(client_max_size=8 * 1024 * 1024)
+    app[POOL_KEY] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api")
+
+    async def _close_pool(app):
+        app[POOL_KEY].shutdown(wait=False, cancel_futures=True)
+
+    app.on_cleanup.append(_close_pool)
+    app.add_routes([
+        web.get("/health", health),
+        web.get("/metrics", metrics),
+        web.post("/trip", trip),
+        web.post("/trips", trips),
+        web.post("/itinerary", itinerary),
+        web.get("/factors", factors),
+        web.get("/route", route),
+    ])
+    return app
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoRoute — API HTTP JSON")
+    parser.add_argument("--host", default=os.environ.get("ECOROUTE_API_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("ECOROUTE_API_PORT", 8080)))
+    parser.add_argument("--workers", type=int, default=16, help="Threads pour les calculs bloquants")
+    args = parser.parse_args(argv)
+    web.run_app(create_app(args.workers), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""
+utils/batch.py
+Mode batch (sans Streamlit) : calcule CO2 et prix pour des listes de trajets CSV.
+- Lecture du CSV par blocs, résultats écrits bloc par bloc (Parquet ou CSV).
+- Géocodage en parallèle (pool de threads + limiteur Nominatim partagé),
+  calcul des blocs dans un pool de processus.
+- Point de reprise : une exécution interrompue reprend au premier bloc non terminé.
+  Un bloc dont le géocodage a subi une erreur réseau n'est pas marqué terminé : il est recalculé à la reprise.
+- Même moteur que l'interface : utils.data.calculate_trips / utils.pricing.
+
+Usage :
+    python -m utils.batch trajets.csv -o audit/ --format parquet --workers 4
+    python -m utils.batch trajets.csv -o audit/ --draws 2000   (+ percentiles Monte Carlo)
+Colonnes attendues : départ / arrivée (ou depart, arrivee, origin, destination...).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+START_COLUMNS = ("Départ", "départ", "depart", "start", "origin", "origine", "from")
+END_COLUMNS = ("Arrivée", "arrivée", "arrivee", "end", "destination", "to")
+CHECKPOINT_FILE = "_checkpoint.json"
+TEXT_COLUMNS = ("Départ", "Arrivée", "Mode", "Version Facteurs")
+
+def _find_column(columns, aliases, what):
+    for name in aliases:
+        if name in columns: return name
+    raise ValueError(f"Colonne {what} introuvable (attendu : {', '.join(aliases)})")
+
+def _load_checkpoint(out_dir: Path, input_path: Path, chunksize: int, draws: int = 0) -> Dict:
+    path = out_dir / CHECKPOINT_FILE
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            ckpt = json.load(f)
+        if ckpt.get("input") != str(input_path) or ckpt.get("chunksize") != chunksize or ckpt.get("draws", 0) != draws:
+            raise ValueError(f"{path} correspond à une autre exécution (fichier, --chunksize ou --draws différent)")
+        return ckpt
+    # done : bloc -> [trajets calculés, trajets du bloc]
+    return {"input": str(input_path), "chunksize": chunksize, "draws": draws, "done": {}}
+
+def _save_checkpoint(out_dir: Path, ckpt: Dict):
+    tmp = out_dir / (CHECKPOINT_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(ckpt, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, out_dir / CHECKPOINT_FILE)
+
+def _part_path(out_dir: Path, idx: int, fmt: str) -> Path:
+    return out_dir / f"part-{idx:05d}.{fmt}"
+
+def compute_chunk(idx: int, first_row: int, starts: List[str], ends: List[str],
+                  c_starts: List, c_ends: List, out_dir: str, fmt: str, draws: int = 0) -> int:
+    """Calcule un bloc de trajets déjà géocodés et écrit son fichier partiel (exécuté dans un worker)."""
+    import numpy as np
+    from utils.data import calculate_trips
+    df = calculate_trips(c_starts, c_ends, pairwise=True, draws=draws or None)
+    # calculate_trips ignore les paires non géocodées : on garde la correspondance avec les lignes d'entrée
+    kept = [i for i, (a, b) in enumerate(zip(c_starts, c_ends)) if a and b]
+    n_modes = len(df) // len(kept) if kept else 0
+    rows = [first_row + i for i in kept for _ in range(n_modes)]
+    df.insert(0, "Ligne", np.asarray(rows, dtype=np.int64))
+    df["Départ"] = [starts[i] for i in kept for _ in range(n_modes)]
+    df["Arrivée"] = [ends[i] for i in kept for _ in range(n_modes)]
+    df["Version Facteurs"] = df.attrs["factor_version"]
+    # Types explicites : un bloc sans trajet a le même schéma que les autres (fusion Parquet)
+    df = df.astype({c: "string" for c in TEXT_COLUMNS})
+
+    path = _part_path(Path(out_dir), idx, fmt)
+    tmp = path.with_name(path.name + ".tmp")
+    if fmt == "parquet":
+        df.to_parquet(tmp, index=False)
+    else:
+        df.to_csv(tmp, index=False)
+    os.replace(tmp, path) # Un fichier partiel n'existe que complet
+    return len(kept)
+
+def merge_parts(out_dir: Path, fmt: str, target: Path):
+    """Concatène les fichiers partiels en un seul fichier, sans tout charger en mémoire."""
+    parts = sorted(out_dir.glob(f"part-*.{fmt}"))
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = None
+        for part in parts:
+            table = pq.read_table(part)
+            if writer is None:
+                writer = pq.ParquetWriter(target, table.schema)
+            writer.write_table(table.cast(writer.schema))
+        if writer: writer.close()
+    else:
+        with open(target, "w", encoding="utf-8", newline="") as out:
+            for n, part in enumerate(parts):
+                with open(part, encoding="utf-8") as f:
+                    header = f.readline()
+                    if n == 0: out.write(header)
+                    for line in f: out.write(line)
+
+def run_batch(input_path, out_dir, fmt: str = "parquet", chunksize: int = 5000,
+              workers: int = 2, merge: bool = True, geocode_deadline: Optional[float] = None, draws: int = 0) -> Dict:
+    import pandas as pd
+    from utils.geocoding import get_geocoding_service
+
+    input_path, out_dir = Path(input_path), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    ckpt = _load_checkpoint(out_dir, input_path, chunksize, draws)
+    service = get_geocoding_service()
+    t0 = time.perf_counter()
+    retry_total = 0 # Trajets non géocodés à cause d'une erreur réseau
+
+    # "spawn" : le pool de géocodage et le limiteur ont déjà des threads actifs, un fork les copierait figés
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = {}
+        reader = pd.read_csv(input_path, chunksize=chunksize, dtype=str, keep_default_na=False)
+        for idx, chunk in enumerate(reader):
+            first_row = idx * chunksize
+            if str(idx) in ckpt["done"] and _part_path(out_dir, idx, fmt).exists():
+                continue # Déjà traité lors d'une exécution précédente
+            start_col = _find_column(chunk.columns, START_COLUMNS, "de départ")
+            end_col = _find_column(chunk.columns, END_COLUMNS, "d'arrivée")
+            starts = chunk[start_col].str.strip().tolist()
+            ends = chunk[end_col].str.strip().tolist()
+
+            # Géocodage dans ce processus : le limiteur Nominatim reste unique
+            failed = set()
+            coords = service.resolve_many(starts + ends, deadline=geocode_deadline, failed=failed)
+            c_starts = [coords[s] for s in starts]
+            c_ends = [coords[e] for e in ends]
+            retry = sum(s in failed or e in failed for s, e in zip(starts, ends))
+
+            fut = pool.submit(compute_chunk, idx, first_row, starts, ends, c_starts, c_ends, str(out_dir), fmt, draws)
+            pending[fut] = (idx, len(starts), retry)
+            # On borne le nombre de blocs en vol (mémoire) et on enregistre la progression au fil de l'eau
+            while len(pending) > workers * 2:
+                retry_total += _collect(pending, ckpt, out_dir)
+        while pending:
+            retry_total += _collect(pending, ckpt, out_dir)
+
+    target = None
+    if merge:
+        target = out_dir.with_suffix(f".{fmt}") if out_dir.suffix != f".{fmt}" else out_dir / f"resultats.{fmt}"
+        merge_parts(out_dir, fmt, target)
+    return {
+        "trips": sum(kept for kept, _ in ckpt["done"].values()),
+        "unresolved": sum(size - kept for kept, size in ckpt["done"].values()),
+        "chunks": len(ckpt["done"]),
+        "retry": retry_total,
+        "seconds": round(time.perf_counter() - t0, 1),
+        "output": str(target or out_dir),
+    }
+
+def _collect(pending, ckpt, out_dir) -> int:
+    """Attend au moins un bloc terminé et enregistre la progression ; renvoie le nombre de trajets à reprendre."""
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    retry_total = 0
+    for fut in done:
+        idx, size, retry = pending.pop(fut)
+        kept = fut.result()
+        if retry:
+            # Erreurs réseau : fichier partiel écrit, mais bloc recalculé à la prochaine exécution
+            retry_total += retry
+            print(f"⚠️ Bloc {idx} : {kept}/{size} trajets, {retry} à reprendre (erreur réseau)")
+            continue
+        ckpt["done"][str(idx)] = [kept, size]
+        print(f"✅ Bloc {idx} : {kept}/{size} trajets")
+    _save_checkpoint(out_dir, ckpt)
+    return retry_total
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoRoute — calcul batch CO2 & prix de listes de trajets")
+    parser.add_argument("input", help="CSV des trajets (colonnes départ / arrivée)")
+    parser.add_argument("-o", "--output", required=True, help="Dossier de sortie (fichiers partiels + reprise)")
+    parser.add_argument("--format", choices=("parquet", "csv"), default="parquet")
+    parser.add_argument("--chunksize", type=int, default=5000, help="Trajets par bloc")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--no-merge", action="store_true", help="Ne pas fusionner les fichiers partiels")
+    parser.add_argument("--draws", type=int, default=0, help="Scénarios Monte Carlo par trajet (0 = sans percentiles)")
+    args = parser.parse_args(argv)
+
+    summary = run_batch(args.input, args.output, fmt=args.format, chunksize=args.chunksize,
+                        workers=args.workers, merge=not args.no_merge, draws=args.draws)
+    print(f"🏁 {summary['trips']} trajets calculés ({summary['unresolved']} introuvables) "
+          f"en {summary['seconds']} s -> {summary['output']}")
+    if summary["retry"]:
+        print(f"⚠️ {summary['retry']} trajets non géocodés (erreur réseau) : relancez la même commande pour les reprendre")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
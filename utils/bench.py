@@ -0,0 +1,208 @@
+"""
+utils/bench.py
+Banc de performance hors-ligne : les services tiers sont remplacés par les bouchons de
+utils/stub_servers.py (latence et erreurs configurables), le reste du code est le vrai.
+- Scénarios : calculate_trip, create_trip_map (+ rendu HTML), graphiques Plotly (+ JSON),
+  EcoAssistant (analyse en streaming), scénarios Monte Carlo d'un trajet.
+- Concurrence croissante (pool de threads, comme les sessions Streamlit d'un worker).
+- Débit, latences p50 / p99, erreurs, mémoire maximale ; enregistrement d'une référence
+  et comparaison des exécutions suivantes.
+
+Usage :
+    python -m utils.bench --concurrency 1,4,16 --ops 40 --save-baseline bench_baseline.json
+    python -m utils.bench --compare bench_baseline.json --tolerance 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from utils.stub_servers import StubServers, add_stub_arguments, build_configs
+
+SCENARIOS = ("trip", "map", "charts", "assistant", "uncertainty")
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if len(values) else None
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss : kilo-octets sous Linux, octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def make_scenarios(distinct: int, seed: int = 0) -> Dict[str, Callable[[int], None]]:
+    """Opérations élémentaires de chaque scénario (importées après la redirection vers les bouchons)."""
+    from utils.charts import create_comparison_chart, create_efficiency_scatter
+    from utils.chatbot import EcoAssistant
+    from utils.data import calculate_trip
+    from utils.map_viz import create_trip_map
+    from utils.uncertainty import INTERACTIVE_DRAWS, trip_uncertainty
+
+    rng = np.random.default_rng(seed)
+    # Noms inconnus du répertoire local : chaque nouvelle ville passe par le bouchon Nominatim
+    cities = [f"Bench-Ville-{seed}-{i}" for i in range(distinct)]
+    pairs = [(cities[a], cities[b]) for a, b in rng.integers(0, distinct, size=(4096, 2)) if a != b]
+    points = rng.uniform((43.0, -1.5), (50.0, 7.0), size=(1024, 2, 2))
+    reference, *_ = calculate_trip(*pairs[0])
+    frame = reference.to_frame()
+    run_id = time.time_ns()
+
+    def trip(i):
+        result, *_ = calculate_trip(*pairs[i % len(pairs)])
+        if result is None: raise RuntimeError("trajet non calculé")
+
+    def trip_map(i):
+        a, b = points[i % len(points)]
+        m = create_trip_map(tuple(a), tuple(b), "A", "B", selected_mode=("Route", "Train", "Avion")[i % 3])
+        m.get_root().render() # Ce que fait st_folium à chaque affichage
+
+    def charts(i):
+        for fig in (create_comparison_chart(frame), create_efficiency_scatter(frame)):
+            fig.to_json() # Sérialisation envoyée au navigateur par st.plotly_chart
+
+    def assistant(i):
+        # Villes uniques par opération : le cache des réponses LLM n'intervient pas
+        text = "".join(EcoAssistant().analyze_trip_stream(f"Départ-{run_id}-{i}", f"Arrivée-{i}", reference))
+        if text.startswith("❌"): raise RuntimeError(text[:120])
+
+    def uncertainty(i):
+        trip_uncertainty(reference, draws=INTERACTIVE_DRAWS) # Ce que fait le mode incertitude de l'interface
+
+    return {"trip": trip, "map": trip_map, "charts": charts, "assistant": assistant, "uncertainty": uncertainty}
+
+def run_level(op: Callable[[int], None], concurrency: int, ops: int, offset: int, trace_memory: bool) -> dict:
+    """Exécute `ops` opérations avec `concurrency` threads ; mesures agrégées."""
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    def timed(i):
+        t0 = time.perf_counter()
+        try:
+            op(offset + i)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return
+        latencies.append(time.perf_counter() - t0)
+
+    if trace_memory: tracemalloc.start()
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(ops)))
+    wall = time.perf_counter() - t0
+    peak_alloc = tracemalloc.get_traced_memory()[1] / 1024 / 1024 if trace_memory else None
+    if trace_memory: tracemalloc.stop()
+    return {
+        "concurrency": concurrency,
+        "ops": ops,
+        "errors": len(errors),
+        "throughput_ops_s": round(len(latencies) / wall, 2) if wall else None,
+        "p50_ms": round(_percentile(latencies, 50), 2) if latencies else None,
+        "p99_ms": round(_percentile(latencies, 99), 2) if latencies else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "peak_alloc_mb": round(peak_alloc, 1) if peak_alloc is not None else None,
+        "first_error": errors[0] if errors else None,
+    }
+
+def compare(current: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Régressions (débit en baisse ou p99 en hausse au-delà de `tolerance`), avec une ligne par mesure."""
+    regressions = []
+    print(f"\n{'mesure':<16} {'débit réf.':>10} {'débit':>10} {'p99 réf.':>10} {'p99':>10}")
+    for key, cur in current["results"].items():
+        base = baseline.get("results", {}).get(key)
+        if not base or not cur["throughput_ops_s"] or not base["throughput_ops_s"]: continue
+        d_tp = cur["throughput_ops_s"] / base["throughput_ops_s"] - 1
+        d_p99 = cur["p99_ms"] / base["p99_ms"] - 1 if base["p99_ms"] else 0.0
+        flag = ""
+        if d_tp < -tolerance or d_p99 > tolerance:
+            flag = "  ❌"
+            regressions.append(key)
+        print(f"{key:<16} {base['throughput_ops_s']:>10} {cur['throughput_ops_s']:>10} "
+              f"{base['p99_ms']:>10} {cur['p99_ms']:>10}  ({d_tp:+.0%} débit, {d_p99:+.0%} p99){flag}")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="EcoRoute — banc de performance hors-ligne")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Parmi : {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Niveaux de concurrence (threads)")
+    parser.add_argument("--ops", type=int, default=40, help="Opérations par niveau (au moins la concurrence)")
+    parser.add_argument("--warmup", type=int, default=2, help="Opérations de chauffe non mesurées par scénario")
+    parser.add_argument("--distinct", type=int, default=200, help="Nombre de villes distinctes (taux de hit des caches)")
+    parser.add_argument("--trace-memory", action="store_true", help="Pic d'allocations Python (tracemalloc, plus lent)")
+    parser.add_argument("--keep-cache", action="store_true", help="Garder ECOROUTE_CACHE_DIR au lieu d'un dossier temporaire")
+    parser.add_argument("-o", "--out", help="Écrit les résultats (JSON)")
+    parser.add_argument("--save-baseline", help="Enregistre les résultats comme référence (JSON)")
+    parser.add_argument("--compare", help="Compare à une référence enregistrée")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Écart toléré avant de signaler une régression")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+    scenarios = [s for s in args.scenarios.split(",") if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown: parser.error(f"Scénarios inconnus : {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    servers = StubServers(build_configs(args.latency, args.jitter, args.fail, args.token_ms, args.tokens)).start()
+    # Redirection vers les bouchons : avant tout import des modules EcoRoute concernés
+    os.environ.update(servers.env())
+    os.environ["ECOROUTE_NOMINATIM_RPS"] = "1000"
+    tmp_cache = None
+    if not args.keep_cache:
+        tmp_cache = os.environ["ECOROUTE_CACHE_DIR"] = tempfile.mkdtemp(prefix="ecoroute-bench-")
+    loaded = [m for m in sys.modules if m.startswith("utils.") and m not in ("utils.bench", "utils.stub_servers")]
+    if loaded: print(f"⚠️ Modules déjà importés, URLs peut-être non redirigées : {', '.join(loaded)}")
+
+    ops_by_name = make_scenarios(args.distinct)
+    report = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "save_baseline", "compare")},
+        },
+        "results": {},
+    }
+    offset = 0
+    print(f"{'mesure':<16} {'ops/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'erreurs':>8} {'RSS Mo':>8}")
+    try:
+        for name in scenarios:
+            op = ops_by_name[name]
+            for i in range(args.warmup): op(offset + i)
+            offset += args.warmup
+            for c in levels:
+                ops = max(args.ops, c)
+                res = run_level(op, c, ops, offset, args.trace_memory)
+                offset += ops
+                key = f"{name}@{c}"
+                report["results"][key] = res
+                print(f"{key:<16} {res['throughput_ops_s'] or 0:>8} {res['p50_ms'] or 0:>9} "
+                      f"{res['p99_ms'] or 0:>9} {res['errors']:>8} {res['peak_rss_mb']:>8}"
+                      + (f"  ({res['first_error'][:60]})" if res["first_error"] else ""))
+    finally:
+        report["stubs"] = servers.stats()
+        servers.stop()
+        if tmp_cache: shutil.rmtree(tmp_cache, ignore_errors=True)
+
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 Résultats écrits dans {path}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"❌ Régressions : {', '.join(regressions)}")
+            return 1
+        print("✅ Pas de régression au-delà de la tolérance")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
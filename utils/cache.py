@@ -0,0 +1,114 @@
+"""
+utils/cache.py
+Cache clé/valeur persistant (SQLite), partagé entre sessions Streamlit et redémarrages.
+- Valeurs sérialisées en JSON, TTL par entrée (ex : résultats négatifs courts).
+- Taille bornée avec éviction LRU.
+- Compteurs hits / misses (aussi exportés via utils/telemetry.py).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from utils import telemetry
+
+# Dossier des caches (surchargeable pour les déploiements)
+CACHE_DIR = Path(os.environ.get("ECOROUTE_CACHE_DIR", Path(__file__).resolve().parent.parent / ".cache"))
+
+# Sentinelle : distingue "absent" d'une valeur None mise en cache
+MISSING = object()
+
+# On ne réécrit la date d'accès (LRU) qu'au-delà de ce délai, pour garder les lectures rapides
+_TOUCH_INTERVAL = 60
+
+class DiskCache:
+    def __init__(self, name: str, max_entries: int = 10_000, default_ttl: Optional[float] = None):
+        self.name = name
+        self.path = CACHE_DIR / f"{name}.sqlite"
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self) -> sqlite3.Connection:
+        # Ouverture paresseuse : importer le module ne touche pas au disque
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON entries(accessed)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str, default: Any = MISSING) -> Any:
+        """Valeur en cache, ou `default` si absente / expirée."""
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute("SELECT value, expires, accessed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                telemetry.cache_result(self.name, False)
+                return default
+            if now - row[2] > _TOUCH_INTERVAL:
+                db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                db.commit()
+            self.hits += 1
+        telemetry.cache_result(self.name, True)
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        """Enregistre `value` (JSON) ; `ttl` en secondes, None = durée par défaut."""
+        ttl = self.default_ttl if ttl is None else ttl
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            self._evict(db, now)
+            db.commit()
+
+    def _evict(self, db: sqlite3.Connection, now: float):
+        """Supprime les entrées expirées puis les moins récemment utilisées au-delà de la borne."""
+        db.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires < ?", (now,))
+        (count,) = db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed LIMIT ?)",
+                (excess,),
+            )
+
+    def clear(self):
+        with self._lock:
+            self._db().execute("DELETE FROM entries")
+            self._db().commit()
+            self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self),
+            "max_entries": self.max_entries,
+        }
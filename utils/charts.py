@@ -1,13 +1,18 @@
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
+from utils import telemetry
 
+# Plotly est importé dans chaque fonction : chargé seulement à l'affichage du premier graphique
+
+@telemetry.traced("chart.comparison")
 def create_comparison_chart(df):
     """1. Comparateur visuel des modes (Bar Chart)."""
+    import plotly.express as px
     # On travaille sur une copie pour ne pas impacter le dataframe original
     df_chart = df.copy()
     
     # Code couleur : Vert pour peu polluant, Rouge pour très polluant
-    df_chart['Color'] = df_chart['CO2 (kg)'].apply(lambda x: 'red' if x > 50 else ('orange' if x > 10 else 'green'))
+    co2 = df_chart['CO2 (kg)'].to_numpy()
+    df_chart['Color'] = np.where(co2 > 50, 'red', np.where(co2 > 10, 'orange', 'green'))
     
     fig = px.bar(
         df_chart.sort_values("CO2 (kg)"), 
@@ -20,8 +25,10 @@ def create_comparison_chart(df):
     )
     return fig
 
+@telemetry.traced("chart.gauge")
 def create_impact_gauge(co2_value):
     """2. Jauge d'impact pour le mode choisi (Gauge Chart)."""
+    import plotly.graph_objects as go
     fig = go.Figure(go.Indicator(
         mode = "gauge+number",
         value = co2_value,
@@ -37,8 +44,10 @@ def create_impact_gauge(co2_value):
     ))
     return fig
 
+@telemetry.traced("chart.scatter")
 def create_efficiency_scatter(df):
     """3. Nuage de points : Distance vs Emission (Scatter)."""
+    import plotly.express as px
     df_chart = df.copy()
     
     # --- CORRECTION ET ADAPTATION ---
@@ -58,4 +67,24 @@ def create_efficiency_scatter(df):
         hover_data=['Facteur (kgCO2/km)'], # On affiche quand même la vraie donnée au survol
         title="Efficacité Énergétique (Taille = Facteur Pollution)"
     )
-    return fig
\ No newline at end of file
+    return fig
+
+@telemetry.traced("chart.uncertainty")
+def create_uncertainty_chart(df):
+    """4. Fourchettes Monte Carlo : prix médian, barres d'erreur P5 - P95."""
+    import plotly.graph_objects as go
+    df_chart = df[df['Prix P95 (€)'] > 0].sort_values("Prix Médian (€)")
+    median = df_chart['Prix Médian (€)'].to_numpy()
+    fig = go.Figure(go.Bar(
+        x=df_chart['Mode'],
+        y=median,
+        error_y=dict(type="data", symmetric=False,
+                     array=df_chart['Prix P95 (€)'].to_numpy() - median,
+                     arrayminus=median - df_chart['Prix P5 (€)'].to_numpy()),
+        text=[f"{p:.0%}" for p in df_chart['P(moins cher)']],
+        hovertemplate="%{x}<br>Médiane : %{y:.0f} €<br>P(moins cher) : %{text}<extra></extra>",
+        marker_color="#165B33",
+    ))
+    fig.update_layout(title="Prix : médiane et fourchette 90 % (texte : probabilité d'être le moins cher)",
+                      yaxis_title="€")
+    return fig
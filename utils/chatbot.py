@@ -1,7 +1,13 @@
-from litellm import completion
 import os
-import streamlit as st
-import random
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from utils import telemetry
+from utils.cache import DiskCache, MISSING
+from utils.llm_scheduler import AllProvidersFailed, ProviderScheduler
+from utils.prompting import budget_for, compact_results, fit_messages, truncate_to_tokens
 
 # ---------------------------------------------------------
 # 🛑 MODE TEST : Mettez True pour économiser vos tokens !
@@ -9,6 +15,127 @@ import random
 MOCK_MODE = False
 # ---------------------------------------------------------
 
+# Début du message renvoyé quand toute la chaîne de modèles a échoué
+UNAVAILABLE = "❌ Service indisponible"
+
+# --- CACHE DES RÉPONSES LLM ---
+class LLMResponseCache:
+    """
+    Cache à deux niveaux (mémoire LRU + disque SQLite) des réponses LLM.
+    Clé : (modèle, hash du prompt normalisé). Partagé par tous les utilisateurs du processus.
+    """
+    def __init__(self, max_memory=256, max_disk=2000, ttl=3600*24):
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self._memory = OrderedDict() # clé -> (expiration, réponse)
+        self._disk = DiskCache("llm_responses", max_entries=max_disk, default_ttl=ttl)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, messages):
+        # Normalisation : espaces/indentation du prompt sans effet sur la clé
+        normalized = [{"role": m["role"], "content": " ".join(str(m["content"]).split())} for m in messages]
+        digest = hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode()).hexdigest()
+        return f"{model}:{digest}"
+
+    def get(self, model, messages):
+        """Réponse en cache pour ce modèle et ce prompt, sinon None."""
+        key = self.make_key(model, messages)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                telemetry.cache_result("llm_memory", True)
+                return entry[1]
+            self._memory.pop(key, None)
+        telemetry.cache_result("llm_memory", False)
+        value = self._disk.get(key)
+        with self._lock:
+            if value is MISSING:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, value, now)
+        return value
+
+    def set(self, model, messages, response):
+        key = self.make_key(model, messages)
+        with self._lock:
+            self._remember(key, response, time.time())
+        self._disk.set(key, response)
+
+    def _remember(self, key, value, now):
+        self._memory[key] = (now + self.ttl, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory:
+            self._memory.popitem(last=False)
+
+    def stats(self):
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / total, 3) if total else 0.0,
+            "memory_size": len(self._memory),
+            "disk_size": len(self._disk),
+        }
+
+RESPONSE_CACHE = LLMResponseCache()
+
+# --- MESURES DU STREAMING ---
+class StreamStats:
+    """Time-to-first-token et débit (tokens/s) des derniers appels, par modèle."""
+    def __init__(self, window=100):
+        self.window = window
+        self._samples = {} # modèle -> liste de (ttft, tokens/s)
+        self._lock = threading.Lock()
+
+    def record(self, model, ttft, n_tokens, elapsed):
+        # Un morceau de flux ≈ un token pour les fournisseurs LiteLLM
+        rate = n_tokens / elapsed if elapsed > 0 else 0.0
+        with self._lock:
+            samples = self._samples.setdefault(model, [])
+            samples.append((ttft or 0.0, rate))
+            del samples[:-self.window]
+
+    def summary(self):
+        with self._lock:
+            return {
+                model: {
+                    "calls": len(samples),
+                    "ttft_avg_s": round(sum(t for t, _ in samples) / len(samples), 3),
+                    "tokens_per_s_avg": round(sum(r for _, r in samples) / len(samples), 1),
+                }
+                for model, samples in self._samples.items() if samples
+            }
+
+STREAM_STATS = StreamStats()
+
+# --- ORDONNANCEUR DES FOURNISSEURS ---
+# Serveur compatible OpenAI à utiliser pour tous les modèles (proxy interne, bouchon des benchmarks)
+LLM_API_BASE = os.environ.get("ECOROUTE_LLM_API_BASE")
+
+def completion(**kwargs):
+    """litellm.completion, importé au premier appel (litellm ajoute plusieurs secondes au démarrage)."""
+    from litellm import completion as litellm_completion
+    if LLM_API_BASE:
+        kwargs = {**kwargs, "model": f"openai/{kwargs['model']}", "api_base": LLM_API_BASE,
+                  "api_key": os.environ.get("ECOROUTE_LLM_API_KEY", "local")}
+    return litellm_completion(**kwargs)
+
+def _litellm_complete(model, messages):
+    response = completion(model=model, messages=messages)
+    return response.choices[0].message.content
+
+# Partagé : latences et disjoncteurs valent pour toutes les sessions
+SCHEDULER = ProviderScheduler(_litellm_complete)
+
 class EcoAssistant:
     def __init__(self):
         # 📋 LISTE DE PRIORITÉ DES MODÈLES (Mise à jour 12/2025)
@@ -19,6 +146,7 @@ class EcoAssistant:
         ]
 
     # 👇 C'EST ICI QUE SE TROUVAIT L'ERREUR (Il manquait custom_priority=None)
+    @telemetry.traced("llm")
     def _call_llm_with_fallback(self, messages, custom_priority=None):
         """
         Tente d'appeler les modèles en cascade.
@@ -40,40 +168,87 @@ class EcoAssistant:
         # On utilise la liste personnalisée si fournie, sinon celle par défaut
         priority_list = custom_priority if custom_priority else self.models_priority
         
+        # Réponse déjà connue pour le modèle demandé (le premier de la liste)
+        cached = RESPONSE_CACHE.get(priority_list[0], messages)
+        if cached is not None:
+            return cached
+
+        try:
+            # Hedging + disjoncteurs : voir utils/llm_scheduler.py
+            model, content = SCHEDULER.run(priority_list, messages)
+        except AllProvidersFailed as e:
+            telemetry.record_error("llm", e)
+            return f"{UNAVAILABLE}. Tous les modèles ont échoué.\nDétails : {'; '.join(e.errors)}"
+        # Seule une réponse du modèle demandé est mise en cache : un repli dégradé ne doit pas lui survivre
+        if model == priority_list[0]:
+            RESPONSE_CACHE.set(model, messages, content)
+        return content
+
+    def _stream_llm_with_fallback(self, messages, custom_priority=None):
+        """
+        Variante streaming de _call_llm_with_fallback : générateur de morceaux de texte.
+        Si un fournisseur échoue en cours de route, on enchaîne sur le suivant
+        (un séparateur signale la reprise). TTFT et tokens/s sont relevés par modèle.
+        """
+        if MOCK_MODE:
+            yield self._call_llm_with_fallback(messages, custom_priority)
+            return
+
+        priority_list = custom_priority if custom_priority else self.models_priority
+        cached = RESPONSE_CACHE.get(priority_list[0], messages)
+        if cached is not None:
+            yield cached
+            return
+
         errors = []
-        
-        for model in priority_list:
+        # Les fournisseurs au disjoncteur ouvert sont sautés ; l'essai semi-ouvert n'est réservé qu'au moment de l'appel
+        for model in SCHEDULER.available(priority_list):
+            if not SCHEDULER.acquire(model, priority_list): continue
+            breaker = SCHEDULER.breaker(model)
+            parts = []
+            t0 = time.perf_counter()
+            ttft = None
             try:
-                # Appel via LiteLLM
-                response = completion(
-                    model=model,
-                    messages=messages
-                )
-                return response.choices[0].message.content
-                
+                for chunk in completion(model=model, messages=messages, stream=True):
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta: continue
+                    if ttft is None: ttft = time.perf_counter() - t0
+                    parts.append(delta)
+                    yield delta
             except Exception as e:
                 error_msg = f"⚠️ Échec sur {model} : {str(e)}"
-                print(error_msg)
+                telemetry.record_error("llm.stream", e)
                 errors.append(error_msg)
+                breaker.record_failure()
+                if parts: yield "\n\n---\n*⚠️ Réponse interrompue, reprise avec un autre modèle…*\n\n"
                 continue
-        
-        return f"❌ Service indisponible. Tous les modèles ont échoué.\nDétails : {'; '.join(errors)}"
+            if not parts:
+                errors.append(f"⚠️ Réponse vide sur {model}")
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            elapsed = time.perf_counter() - t0
+            STREAM_STATS.record(model, ttft, len(parts), elapsed)
+            SCHEDULER.latency.record(model, elapsed) # Même p95 que les appels bloquants (délai de hedging)
+            # Générateur : pas de span (il vivrait entre deux yields), mesures directes
+            telemetry.observe("llm.stream", elapsed)
+            if ttft is not None: telemetry.observe("llm.stream_ttft", ttft)
+            if model == priority_list[0] and not errors: # Réponse complète du modèle demandé uniquement
+                RESPONSE_CACHE.set(model, messages, "".join(parts))
+            return
 
-    def analyze_trip(self, start, end, df_results):
-        """Analyse du trajet (Force Gemini en premier car meilleur en raisonnement)."""
-        
-        # En mode MOCK, on renvoie une fausse analyse statique
-        if MOCK_MODE:
-            return (
-                "### 🌱 Analyse Rapide (Simulation)\n"
-                f"Pour aller de **{start}** à **{end}** :\n\n"
-                "- 🚄 **Le Train** est le grand gagnant (rapide et propre).\n"
-                "- 🚗 **La Voiture** émet beaucoup plus, surtout si vous êtes seul.\n"
-                "- ✈️ **L'Avion** est à éviter pour cette distance.\n\n"
-                "> *Note : Désactivez MOCK_MODE dans le code pour avoir la vraie analyse IA.*"
-            )
-        
-        data_context = df_results.to_string()
+        yield f"{UNAVAILABLE}. Tous les modèles ont échoué.\nDétails : {'; '.join(errors)}"
+
+    # Ordre Gemini d'abord (analyse, et chat quand Groq n'est pas choisi)
+    GEMINI_FIRST = [
+        "gemini/gemini-2.5-flash-lite",
+        "groq/llama-3.1-8b-instant",
+        "huggingface/HuggingFaceH4/zephyr-7b-beta"
+    ]
+
+    def _analysis_messages(self, start, end, df_results):
+        # Tableau compact (mode|km|CO2|prix) borné au budget du modèle le plus contraint
+        data_context = truncate_to_tokens(compact_results(df_results), budget_for(self.GEMINI_FIRST) // 2)
         
         prompt = f"""
         Tu es un expert en mobilité écologique. Analyse ce trajet : {start} -> {end}.
@@ -85,31 +260,55 @@ class EcoAssistant:
         2. Donne une équivalence concrète pour le CO2 économisé par le train (ex: nombre de repas végétariens, jours de chauffage...).
         3. Sois encourageant et pédagogique.
         """
-        messages = [{"role": "user", "content": prompt}]
-        
-        # Ordre spécifique pour l'analyse : Gemini d'abord
-        analysis_priority = [
-            "gemini/gemini-2.5-flash-lite",
-            "groq/llama-3.1-8b-instant",
-            "huggingface/HuggingFaceH4/zephyr-7b-beta"
-        ]
-        return self._call_llm_with_fallback(messages, custom_priority=analysis_priority)
+        return [{"role": "user", "content": prompt}]
 
-    def chat(self, user_question, context_str="", use_groq=True):
-        """Chatbot interactif."""
-        messages = [
-            {"role": "system", "content": f"Tu es EcoBot, un assistant spécialisé dans l'impact carbone des transports. Contexte actuel : {context_str}"},
-            {"role": "user", "content": user_question}
-        ]
+    @staticmethod
+    def _mock_analysis(start, end):
+        return (
+            "### 🌱 Analyse Rapide (Simulation)\n"
+            f"Pour aller de **{start}** à **{end}** :\n\n"
+            "- 🚄 **Le Train** est le grand gagnant (rapide et propre).\n"
+            "- 🚗 **La Voiture** émet beaucoup plus, surtout si vous êtes seul.\n"
+            "- ✈️ **L'Avion** est à éviter pour cette distance.\n\n"
+            "> *Note : Désactivez MOCK_MODE dans le code pour avoir la vraie analyse IA.*"
+        )
+
+    def analyze_trip(self, start, end, df_results):
+        """Analyse du trajet (Force Gemini en premier car meilleur en raisonnement)."""
+        
+        # En mode MOCK, on renvoie une fausse analyse statique
+        if MOCK_MODE:
+            return self._mock_analysis(start, end)
         
-        if use_groq:
-            # Ordre standard : Groq -> Gemini -> HF
-            return self._call_llm_with_fallback(messages)
-        else:
-            # Ordre inversé : Gemini -> Groq -> HF
-            gemini_first = [
-                "gemini/gemini-2.5-flash-lite",
-                "groq/llama-3.1-8b-instant",
-                "huggingface/HuggingFaceH4/zephyr-7b-beta"
-            ]
-            return self._call_llm_with_fallback(messages, custom_priority=gemini_first)
\ No newline at end of file
+        messages = self._analysis_messages(start, end, df_results)
+        return self._call_llm_with_fallback(messages, custom_priority=self.GEMINI_FIRST)
+
+    def analyze_trip_stream(self, start, end, df_results):
+        """Comme analyze_trip, mais renvoie un générateur (pour st.write_stream)."""
+        if MOCK_MODE:
+            yield self._mock_analysis(start, end)
+            return
+        messages = self._analysis_messages(start, end, df_results)
+        yield from self._stream_llm_with_fallback(messages, custom_priority=self.GEMINI_FIRST)
+
+    def _chat_request(self, user_question, context_str, use_groq, memory=None):
+        # Groq -> Gemini -> HF, ou ordre inversé Gemini -> Groq -> HF
+        priority = None if use_groq else self.GEMINI_FIRST
+        system = f"Tu es EcoBot, un assistant spécialisé dans l'impact carbone des transports. Contexte actuel : {context_str}"
+        history = []
+        if memory is not None:
+            # Historique borné : derniers échanges + résumé des plus anciens (utils/prompting.py)
+            system += memory.system_suffix()
+            history = memory.history()
+        budget = budget_for(priority or self.models_priority)
+        return fit_messages(system, history, user_question, budget), priority
+
+    def chat(self, user_question, context_str="", use_groq=True, memory=None):
+        """Chatbot interactif (memory : ChatMemory optionnelle, mise à jour par l'appelant)."""
+        messages, priority = self._chat_request(user_question, context_str, use_groq, memory)
+        return self._call_llm_with_fallback(messages, custom_priority=priority)
+
+    def chat_stream(self, user_question, context_str="", use_groq=True, memory=None):
+        """Chatbot interactif, réponse en streaming."""
+        messages, priority = self._chat_request(user_question, context_str, use_groq, memory)
+        yield from self._stream_llm_with_fallback(messages, custom_priority=priority)
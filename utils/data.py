@@ -1,94 +1,232 @@
-import pandas as pd
+import os
+import numpy as np
 import requests
-import streamlit as st
-from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
-import time
-from utils.pricing import PriceCalculator
-
-# --- CONFIG API ADEME & CO2 ---
-DEFAULT_EMISSION_FACTORS = {
-    "Voiture (Thermique)": 0.192, "Voiture (Électrique)": 0.020,
-    "Avion (Court courrier)": 0.230, "Train (TGV)": 0.0024,
-    "Train (Intercités)": 0.0052, "Autocar": 0.030, "Vélo / Marche": 0.0
-}
-API_MAPPING = {
-    4: "Voiture (Thermique)", 5: "Voiture (Électrique)",
-    2: "Train (TGV)", 3: "Train (Intercités)",
-    1: "Avion (Court courrier)", 8: "Autocar"
-}
-
-@st.cache_data(ttl=3600*24)
+from utils import http_client, telemetry
+from utils.pricing import BASIS_RAIL, KIND_LABELS, compute_prices, round_exact, tariffs_for
+from utils.results import FRAME_COLUMNS, TripResult
+from utils.cache import DiskCache, MISSING
+from utils.factors import API_MAPPING, DEFAULT_EMISSION_FACTORS, FACTOR_STORE # Constantes réexportées
+from utils.text import normalize_city
+from utils.gazetteer import get_gazetteer
+from utils.geocoding import GEOCODE_DEADLINE, NOMINATIM_LIMITER, GeocodeTimeout, get_geocoding_service # GeocodeTimeout réexporté
+from utils.rail import get_rail_distances
+from utils.road_matrix import road_estimates
+
+# --- FACTEURS CO2 (voir utils/factors.py) ---
+@telemetry.traced("factors")
 def get_emission_factors():
-    """Récupère facteurs CO2 via API ADEME (Impact CO2)."""
-    factors = DEFAULT_EMISSION_FACTORS.copy()
-    try:
-        r = requests.get("https://impactco2.fr/api/v1/transport", params={"km": 1, "displayAll": 1}, timeout=5)
-        if r.status_code == 200:
-            for item in r.json().get('data', []):
-                if item.get('id') in API_MAPPING:
-                    factors[API_MAPPING[item.get('id')]] = float(item.get('value'))
-    except: pass
-    return factors
-
-def get_coordinates(city_name):
-    """Géocodage robuste."""
-    geolocator = Nominatim(user_agent="ecoroute_app_details_v3")
+    """Facteurs CO2 (ADEME Impact CO2) : dernières valeurs connues, rafraîchies en arrière-plan."""
+    return dict(FACTOR_STORE.snapshot().factors)
+
+def get_factor_version():
+    """Version des facteurs actuellement servis (ex : '20251224-1a2b3c4d' ou 'defaults')."""
+    return FACTOR_STORE.snapshot().version
+
+# --- GÉOCODAGE (cache disque partagé) ---
+GEOCODE_TTL = 3600*24*30       # Coordonnées d'une ville : stables
+GEOCODE_NEGATIVE_TTL = 3600    # "Introuvable" : on réessaiera dans 1 h
+GEOCODE_MAX_WAIT = 15          # Attente max d'un créneau Nominatim (s)
+GEOCODE_CACHE = DiskCache("geocode", max_entries=5000, default_ttl=GEOCODE_TTL)
+NOMINATIM_URL = os.environ.get("ECOROUTE_NOMINATIM_URL", "https://nominatim.openstreetmap.org")
+NOMINATIM_ATTEMPTS = 3         # Tentatives par recherche (erreur réseau / 5xx), chacune avec un jeton du limiteur
+http_client.disable_retries(NOMINATIM_URL) # Un retry automatique contournerait le limiteur (1 req/s)
+
+def _nominatim_search(query):
+    """Une recherche Nominatim ; chaque tentative attend son créneau du limiteur partagé."""
+    for attempt in range(NOMINATIM_ATTEMPTS):
+        if not NOMINATIM_LIMITER.acquire(timeout=GEOCODE_MAX_WAIT):
+            raise TimeoutError("File d'attente Nominatim saturée")
+        last = attempt == NOMINATIM_ATTEMPTS - 1
+        try:
+            # Session HTTP partagée (keep-alive), voir utils/http_client.py
+            r = http_client.get(f"{NOMINATIM_URL}/search", params={"q": query, "format": "json", "limit": 1}, timeout=10)
+        except (requests.ConnectionError, requests.Timeout):
+            if last: raise
+            continue
+        if r.status_code < 500 or last:
+            r.raise_for_status()
+            return r.json()
+
+@telemetry.traced("geocode.nominatim")
+def _geocode_nominatim(city_name):
+    """Requête Nominatim (avec puis sans suffixe France), au rythme du limiteur partagé."""
+    for query in (city_name + ", France", city_name):
+        results = _nominatim_search(query)
+        if results: return (float(results[0]["lat"]), float(results[0]["lon"]))
+    return None
+
+@telemetry.traced("geocode")
+def get_coordinates(city_name, strict=False):
+    """
+    Géocodage : répertoire local des communes, puis cache disque, puis Nominatim.
+    None = ville introuvable ; strict : les erreurs réseau (transitoires) sont relevées au lieu de valoir None.
+    """
+    key = normalize_city(city_name)
+    if not key: return None
+    gazetteer = get_gazetteer()
+    if gazetteer:
+        place = gazetteer.lookup(city_name)
+        telemetry.cache_result("gazetteer", place is not None)
+        if place: return place.coords
+    cached = GEOCODE_CACHE.get(key)
+    if cached is not MISSING:
+        return tuple(cached) if cached else None
     try:
-        loc = geolocator.geocode(city_name + ", France", timeout=10)
-        if loc: return (loc.latitude, loc.longitude)
-        time.sleep(1)
-        loc = geolocator.geocode(city_name, timeout=10)
-        return (loc.latitude, loc.longitude) if loc else None
-    except: return None
+        coords = _geocode_nominatim(city_name)
+    except Exception as e: # Erreur réseau : pas de mise en cache
+        telemetry.record_error("geocode.nominatim", e)
+        if strict: raise
+        return None
+    GEOCODE_CACHE.set(key, coords, ttl=None if coords else GEOCODE_NEGATIVE_TTL)
+    return coords
+
+# Facteurs de détour appliqués au vol d'oiseau
+ROAD_DETOUR = 1.2
+RAIL_DETOUR = 1.1
+EARTH_RADIUS_KM = 6371.0088
+
+def great_circle_km(origins, destinations):
+    """Matrice N×M des distances orthodromiques (km) entre deux listes de (lat, lon)."""
+    o = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    d = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    lat1, lon1 = o[:, 0, None], o[:, 1, None]
+    lat2, lon2 = d[None, :, 0], d[None, :, 1]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def great_circle_km_pairwise(origins, destinations):
+    """Distances orthodromiques (km) élément par élément : origins[i] -> destinations[i]."""
+    o = np.radians(np.asarray(origins, dtype=float).reshape(-1, 2))
+    d = np.radians(np.asarray(destinations, dtype=float).reshape(-1, 2))
+    a = (np.sin((d[:, 0] - o[:, 0]) / 2) ** 2
+         + np.cos(o[:, 0]) * np.cos(d[:, 0]) * np.sin((d[:, 1] - o[:, 1]) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def _resolve(places, deadline=None):
+    """Convertit une liste de villes ou de (lat, lon) en coordonnées (None si introuvable)."""
+    names = [p for p in places if isinstance(p, str)]
+    found = get_geocoding_service().resolve_many(names, deadline=deadline) if names else {}
+    return [found[p] if isinstance(p, str) else (tuple(p) if p is not None else None) for p in places]
 
+@telemetry.traced("calculate_trips")
+def calculate_trips(origins, destinations, deadline=None, pairwise=False, rail_km=None, draws=None):
+    """
+    Calcule Distance, CO2 et Prix pour toutes les paires origine × destination.
+    origins / destinations : noms de villes ou tuples (lat, lon).
+    deadline : budget (s) pour le géocodage concurrent, None = attendre toutes les villes.
+    pairwise : si True, paires (origins[i], destinations[i]) au lieu du produit N×M.
+    rail_km : distances ferrées réelles par paire (NaN = inconnue), dans l'ordre des paires
+    calculées ; à défaut, réseau ferré local s'il existe (utils/rail.py), sinon vol d'oiseau × RAIL_DETOUR.
+    draws : si indiqué, ajoute les percentiles Monte Carlo (utils/uncertainty.py) de chaque ligne.
+    Renvoie un tableau long : une ligne par (Départ, Arrivée, Mode).
+    Les paires dont une extrémité est introuvable sont ignorées.
+    """
+    import pandas as pd # Import paresseux : inutile tant qu'aucun trajet n'est calculé
+    c_all = _resolve(list(origins) + list(destinations), deadline=deadline)
+    c_orig, c_dest = c_all[:len(origins)], c_all[len(origins):]
+    if pairwise:
+        if len(c_orig) != len(c_dest):
+            raise ValueError("pairwise=True : origins et destinations doivent avoir la même longueur")
+        oi = di = [i for i, (a, b) in enumerate(zip(c_orig, c_dest)) if a and b]
+    else:
+        oi = [i for i, c in enumerate(c_orig) if c]
+        di = [j for j, c in enumerate(c_dest) if c]
+    snap = FACTOR_STORE.snapshot()
+    factors = snap.factors
+    modes = list(factors)
+    columns = ["Départ", "Arrivée", *FRAME_COLUMNS]
+    if not oi or not di:
+        # Mêmes colonnes et mêmes types qu'un tableau rempli (fichiers partiels du batch homogènes)
+        if draws:
+            from utils.uncertainty import UNCERTAINTY_COLUMNS
+            columns += UNCERTAINTY_COLUMNS
+        empty = pd.DataFrame({c: pd.Series(dtype=float) for c in columns})
+        empty[["Départ", "Arrivée", "Mode"]] = empty[["Départ", "Arrivée", "Mode"]].astype(object)
+        empty["Type Prix"] = pd.Categorical([], categories=sorted(set(KIND_LABELS.values())))
+        empty.attrs["factor_version"] = snap.version
+        return empty
+
+    # Distances par paire (P = N×M, ou N en mode pairwise), à plat
+    if pairwise:
+        o_pts, d_pts = np.array([c_orig[i] for i in oi]), np.array([c_dest[i] for i in oi])
+        d_bird = great_circle_km_pairwise(o_pts, d_pts)
+    else:
+        o_arr, d_arr = np.array([c_orig[i] for i in oi]), np.array([c_dest[j] for j in di])
+        d_bird = great_circle_km(o_arr, d_arr).ravel()
+        o_pts, d_pts = np.repeat(o_arr, len(di), axis=0), np.tile(d_arr, (len(oi), 1))
+    # Matrice routière des hubs si elle existe (utils/road_matrix.py), sinon vol d'oiseau × ROAD_DETOUR
+    d_road, _ = road_estimates(o_pts, d_pts, d_bird * ROAD_DETOUR)
+    d_rail = d_bird * RAIL_DETOUR
+    if rail_km is None:
+        # Même distance train que dans l'interface, en batch et via l'API (un parcours du graphe par départ distinct)
+        rail_km = get_rail_distances(o_pts, d_pts)
+    n_pairs, n_modes = d_bird.size, len(modes)
+    tariffs = tariffs_for(modes)
+
+    # Matrices (P, K) : une colonne par mode
+    f = np.array([factors[m] for m in modes], dtype=float)
+    is_plane = np.array(["Avion" in m for m in modes])
+    dist = np.where(is_plane[None, :], d_bird[:, None], d_road[:, None])
+    if rail_km is not None:
+        # Réseau ferré local (utils/rail.py) : distance réelle pour les modes au tarif rail
+        rail_km = np.asarray(rail_km, dtype=float).ravel()
+        known = ~np.isnan(rail_km)
+        d_rail = np.where(known, rail_km, d_rail)
+        is_rail = tariffs["basis"] == BASIS_RAIL
+        dist = np.where(known[:, None] & is_rail[None, :], d_rail[:, None], dist)
+    co2 = dist * f[None, :]
+
+    # Prix : toute la matrice en une passe sur la table des tarifs
+    by_basis = np.stack([d_bird, d_road, d_rail], axis=1) # (P, 3) : oiseau, route, rail
+    price = compute_prices(by_basis[:, tariffs["basis"]], tariffs)
+
+    # Libellés des paires, répétés pour chaque mode
+    start_names = [origins[i] if isinstance(origins[i], str) else str(c_orig[i]) for i in oi]
+    end_names = [destinations[j] if isinstance(destinations[j], str) else str(c_dest[j]) for j in di]
+    if pairwise:
+        pair_start, pair_end = np.array(start_names, dtype=object), np.array(end_names, dtype=object)
+    else:
+        pair_start = np.repeat(np.array(start_names, dtype=object), len(di))
+        pair_end = np.tile(np.array(end_names, dtype=object), len(oi))
+
+    price_types = pd.Categorical([KIND_LABELS[int(k)] for k in tariffs["kind"]])
+
+    df = pd.DataFrame({
+        "Départ": np.repeat(pair_start, n_modes),
+        "Arrivée": np.repeat(pair_end, n_modes),
+        "Mode": np.tile(np.array(modes, dtype=object), n_pairs),
+        "Distance (km)": round_exact(dist, 1).ravel(),
+        "CO2 (kg)": round_exact(co2, 2).ravel(),
+        "Facteur (kgCO2/km)": np.tile(round_exact(f, 4), n_pairs),
+        "Prix Moyen (€)": price["total"].ravel(),
+        "Prix Min (€)": price["min"].ravel(),
+        "Prix Max (€)": price["max"].ravel(),
+        # Détails aplatis en colonnes typées
+        "Carburant (€)": price["carburant"].ravel(),
+        "Péage (€)": price["peage"].ravel(),
+        "Type Prix": pd.Categorical.from_codes(np.tile(price_types.codes, n_pairs), price_types.categories),
+    }, columns=columns)
+    if draws:
+        from utils.uncertainty import simulate, uncertainty_columns
+        for col, values in uncertainty_columns(simulate(by_basis, dist, tariffs, f, modes, draws=draws)).items():
+            df[col] = values
+    df.attrs["factor_version"] = snap.version # Version des facteurs CO2 utilisée
+    return df
+
+@telemetry.traced("calculate_trip")
 def calculate_trip(start_city, end_city):
-    """Calcule tout : Distance, CO2, et Détails Prix."""
-    c_start = get_coordinates(start_city)
-    c_end = get_coordinates(end_city)
+    """
+    Calcule tout : Distance, CO2, et Détails Prix (une seule paire).
+    Renvoie (TripResult, distance route, coords départ, coords arrivée), ou quatre None si
+    une ville est introuvable. Lève GeocodeTimeout si le géocodage dépasse GEOCODE_DEADLINE.
+    """
+    # Départ et arrivée géocodés en parallèle, dans le budget de latence de l'UI
+    c_start, c_end = get_geocoding_service().resolve_pair(start_city, end_city, deadline=GEOCODE_DEADLINE)
     
     if not c_start or not c_end: return None, None, None, None
     
-    dist_bird = geodesic(c_start, c_end).km
-    dist_road = dist_bird * 1.2
-    
-    factors = get_emission_factors()
-    
-    # Calculateurs
-    pricer_road = PriceCalculator(dist_road)
-    pricer_bird = PriceCalculator(dist_bird * 1.1) # +10% détour train
-    
-    results = []
-    for mode, factor in factors.items():
-        d = dist_bird if "Avion" in mode else dist_road
-        co2 = d * factor
-        
-        # --- LOGIQUE DÉTAIL PRIX ---
-        details = {}
-        if "Voiture (Thermique)" in mode:
-            details = pricer_road.get_car_details("Essence")
-        elif "Voiture (Électrique)" in mode:
-            details = pricer_road.get_car_details("Électrique")
-        elif "Train" in mode:
-            details = pricer_bird.get_ticket_details(mode)
-        elif "Avion" in mode:
-            details = PriceCalculator(dist_bird).get_ticket_details(mode) # Avion direct
-        elif "Autocar" in mode:
-            details = pricer_road.get_ticket_details(mode)
-        else: # Vélo
-            details = {"type": "free", "total": 0, "min": 0, "max": 0}
-
-        results.append({
-            "Mode": mode,
-            "Distance (km)": round(d, 1),
-            "CO2 (kg)": round(co2, 2),
-            # 👇 C'EST CETTE LIGNE QUI MANQUAIT 👇
-            "Facteur (kgCO2/km)": round(factor, 4),
-            # 👆 FIN DE LA CORRECTION 👆
-            "Prix Moyen (€)": details.get("total", 0),
-            "Prix Min (€)": details.get("min", 0),
-            "Prix Max (€)": details.get("max", 0),
-            "Details": details
-        })
-        
-    return pd.DataFrame(results), dist_road, c_start, c_end
\ No newline at end of file
+    dist_road = float(road_estimates([c_start], [c_end], great_circle_km(c_start, c_end)[0] * ROAD_DETOUR)[0][0])
+    df = calculate_trips([c_start], [c_end]) # Distance ferrée du réseau local s'il existe
+    result = TripResult.from_frame(df, dist_road=dist_road, start_coords=c_start, end_coords=c_end,
+                                   factor_version=df.attrs["factor_version"])
+    return result, dist_road, c_start, c_end
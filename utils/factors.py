@@ -0,0 +1,135 @@
+"""
+utils/factors.py
+Facteurs d'émission CO2 (API ADEME Impact CO2) : "stale-while-revalidate".
+- Les dernières valeurs connues sont servies immédiatement.
+- Le rafraîchissement se fait dans un thread de fond, jamais dans le clic de l'utilisateur.
+- Des instantanés versionnés sont écrits sur disque : les workers démarrent à chaud, même hors-ligne.
+- Chaque résultat peut indiquer la version de facteurs utilisée.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, NamedTuple, Optional
+
+from utils import http_client, telemetry
+from utils.cache import CACHE_DIR
+
+# --- CONFIG API ADEME & CO2 ---
+DEFAULT_EMISSION_FACTORS = {
+    "Voiture (Thermique)": 0.192, "Voiture (Électrique)": 0.020,
+    "Avion (Court courrier)": 0.230, "Train (TGV)": 0.0024,
+    "Train (Intercités)": 0.0052, "Autocar": 0.030, "Vélo / Marche": 0.0
+}
+API_MAPPING = {
+    4: "Voiture (Thermique)", 5: "Voiture (Électrique)",
+    2: "Train (TGV)", 3: "Train (Intercités)",
+    1: "Avion (Court courrier)", 8: "Autocar"
+}
+DEFAULT_VERSION = "defaults"
+IMPACTCO2_URL = os.environ.get("ECOROUTE_IMPACTCO2_URL", "https://impactco2.fr")
+
+SNAPSHOT_DIR = CACHE_DIR / "factors"
+MAX_AGE = 3600*24          # Au-delà, on rafraîchit en arrière-plan
+RETRY_AFTER = 300          # Après un échec, nouvel essai dans 5 min
+KEEP_SNAPSHOTS = 5
+
+def fetch_ademe_factors() -> Dict[str, float]:
+    """Appel de l'API Impact CO2 ; lève une exception si la réponse est inexploitable."""
+    # Requête conditionnelle : un 304 renvoie le dernier corps reçu sans le retélécharger
+    body = http_client.get_json_conditional(f"{IMPACTCO2_URL}/api/v1/transport", params={"km": 1, "displayAll": 1})
+    factors = DEFAULT_EMISSION_FACTORS.copy()
+    found = 0
+    for item in body.get('data', []):
+        if item.get('id') in API_MAPPING:
+            factors[API_MAPPING[item.get('id')]] = float(item.get('value'))
+            found += 1
+    if not found:
+        raise ValueError("Aucun facteur reconnu dans la réponse ADEME")
+    return factors
+
+class FactorSnapshot(NamedTuple):
+    version: str
+    fetched_at: float
+    source: str
+    factors: Dict[str, float]
+
+def _version_for(factors: Dict[str, float], fetched_at: float) -> str:
+    digest = hashlib.sha256(json.dumps(factors, sort_keys=True).encode()).hexdigest()[:8]
+    return f"{datetime.fromtimestamp(fetched_at, timezone.utc):%Y%m%d}-{digest}"
+
+class FactorStore:
+    def __init__(self, fetch: Callable[[], Dict[str, float]] = fetch_ademe_factors,
+                 snapshot_dir: Path = SNAPSHOT_DIR, max_age: float = MAX_AGE):
+        self.fetch = fetch
+        self.snapshot_dir = Path(snapshot_dir)
+        self.max_age = max_age
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_attempt = 0.0
+        self._current = self._load_latest() or FactorSnapshot(DEFAULT_VERSION, 0.0, "défaut", DEFAULT_EMISSION_FACTORS.copy())
+
+    # --- Instantanés disque ---
+    def _load_latest(self) -> Optional[FactorSnapshot]:
+        if not self.snapshot_dir.exists(): return None
+        for path in sorted(self.snapshot_dir.glob("factors-*.json"), key=os.path.getmtime, reverse=True):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                return FactorSnapshot(data["version"], data["fetched_at"], data["source"], data["factors"])
+            except (OSError, ValueError, KeyError):
+                continue # Fichier corrompu : on essaie le précédent
+        return None
+
+    def _save(self, snap: FactorSnapshot):
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+        path = self.snapshot_dir / f"factors-{snap.version}.json"
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap._asdict(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path) # Écriture atomique : un autre worker ne lit jamais un fichier partiel
+        old = sorted(self.snapshot_dir.glob("factors-*.json"), key=os.path.getmtime, reverse=True)[KEEP_SNAPSHOTS:]
+        for p in old:
+            try: p.unlink()
+            except OSError: pass
+
+    # --- Lecture / rafraîchissement ---
+    def snapshot(self) -> FactorSnapshot:
+        """Valeurs courantes, sans jamais attendre le réseau ; déclenche un rafraîchissement si périmées."""
+        snap = self._current
+        if time.time() - snap.fetched_at > self.max_age:
+            self._refresh_in_background()
+        return snap
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or time.time() < self._next_attempt: return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="factors-refresh", daemon=True).start()
+
+    def refresh(self) -> FactorSnapshot:
+        """Récupère les facteurs (bloquant) ; en cas d'échec, les valeurs courantes sont conservées."""
+        try:
+            with telemetry.span("factors.fetch"):
+                factors = self.fetch()
+            now = time.time()
+            snap = FactorSnapshot(_version_for(factors, now), now, "ADEME Impact CO2", factors)
+            if snap.factors == self._current.factors and self._current.version != DEFAULT_VERSION:
+                snap = self._current._replace(fetched_at=now) # Valeurs inchangées : même version
+            self._save(snap)
+            self._current = snap
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            telemetry.record_error("factors.fetch", e)
+            self._next_attempt = time.time() + RETRY_AFTER
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self._current
+
+FACTOR_STORE = FactorStore()
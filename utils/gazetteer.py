@@ -0,0 +1,141 @@
+"""
+utils/gazetteer.py
+Répertoire hors-ligne des communes françaises (optionnel).
+- Chargé depuis un fichier CSV local (nom, code postal, lat/lon, population).
+- Index de préfixes compact (clés normalisées triées + recherche dichotomique).
+- Recherche insensible aux accents / majuscules / tirets.
+Si le fichier est absent, get_gazetteer() renvoie None et on retombe sur Nominatim.
+"""
+import csv
+import os
+import threading
+from bisect import bisect_left
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from utils import telemetry
+from utils.text import normalize_city
+
+# Ex : https://www.data.gouv.fr/fr/datasets/communes-et-villes-de-france-en-csv-excel-json-parquet-et-feather/
+COMMUNES_PATH = Path(os.environ.get("ECOROUTE_COMMUNES", Path(__file__).resolve().parent.parent / "data" / "communes.csv"))
+
+# Noms de colonnes acceptés (selon la source du fichier)
+COLUMN_ALIASES = {
+    "name": ("nom_standard", "nom_commune_complet", "nom_commune", "nom", "name"),
+    "postcode": ("code_postal", "codes_postaux", "postcode", "cp"),
+    "lat": ("latitude_centre", "latitude_mairie", "latitude", "lat"),
+    "lon": ("longitude_centre", "longitude_mairie", "longitude", "lon", "lng"),
+    "population": ("population", "pop"),
+}
+
+class Place(NamedTuple):
+    name: str
+    postcode: str
+    lat: float
+    lon: float
+    population: int
+
+    @property
+    def label(self) -> str:
+        return f"{self.name} ({self.postcode})" if self.postcode else self.name
+
+    @property
+    def coords(self) -> Tuple[float, float]:
+        return (self.lat, self.lon)
+
+class Gazetteer:
+    def __init__(self, names, postcodes, lat, lon, population):
+        self.names = list(names)
+        self.postcodes = list(postcodes)
+        self.lat = np.asarray(lat, dtype=np.float32)
+        self.lon = np.asarray(lon, dtype=np.float32)
+        self.population = np.asarray(population, dtype=np.int32)
+        # Index : clés normalisées triées -> position dans les tableaux
+        keys = [normalize_city(n) for n in self.names]
+        self._order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int32)
+        self._keys = [keys[i] for i in self._order]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_csv(cls, path) -> "Gazetteer":
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            sample = f.readline()
+            f.seek(0)
+            reader = csv.DictReader(f, delimiter=";" if sample.count(";") > sample.count(",") else ",")
+            columns = {}
+            for field, aliases in COLUMN_ALIASES.items():
+                columns[field] = next((a for a in aliases if a in reader.fieldnames), None)
+            if not (columns["name"] and columns["lat"] and columns["lon"]):
+                raise ValueError(f"Colonnes nom/latitude/longitude introuvables dans {path}")
+
+            names, postcodes, lat, lon, population = [], [], [], [], []
+            for row in reader:
+                try:
+                    la, lo = float(row[columns["lat"]]), float(row[columns["lon"]])
+                except (TypeError, ValueError):
+                    continue # Commune sans coordonnées
+                names.append(row[columns["name"]].strip())
+                postcodes.append((row.get(columns["postcode"]) or "").split(" ")[0] if columns["postcode"] else "")
+                lat.append(la)
+                lon.append(lo)
+                try:
+                    population.append(int(float(row.get(columns["population"]) or 0)) if columns["population"] else 0)
+                except ValueError:
+                    population.append(0)
+        return cls(names, postcodes, lat, lon, population)
+
+    def _place(self, i: int) -> Place:
+        return Place(self.names[i], self.postcodes[i], round(float(self.lat[i]), 5), round(float(self.lon[i]), 5),
+                     int(self.population[i]))
+
+    def _range(self, prefix: str) -> Tuple[int, int]:
+        """Intervalle [lo, hi) des clés commençant par `prefix`."""
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_left(self._keys, prefix + "\uffff", lo)
+        return lo, hi
+
+    def lookup(self, city_name: str) -> Optional[Place]:
+        """Correspondance exacte (normalisée) ; la commune la plus peuplée en cas d'homonymes."""
+        key = normalize_city(city_name)
+        if not key: return None
+        lo = bisect_left(self._keys, key)
+        hi = lo
+        while hi < len(self._keys) and self._keys[hi] == key:
+            hi += 1
+        if lo == hi: return None
+        idx = self._order[lo:hi]
+        return self._place(int(idx[np.argmax(self.population[idx])]))
+
+    def suggest(self, prefix: str, limit: int = 8) -> List[Place]:
+        """Autocomplétion : communes commençant par `prefix`, les plus peuplées d'abord."""
+        key = normalize_city(prefix)
+        if not key: return []
+        lo, hi = self._range(key)
+        if lo == hi: return []
+        idx = self._order[lo:hi]
+        if idx.size > limit:
+            idx = idx[np.argpartition(-self.population[idx], limit)[:limit]]
+        idx = idx[np.argsort(-self.population[idx], kind="stable")]
+        return [self._place(int(i)) for i in idx]
+
+_gazetteer = None
+_gazetteer_loaded = False
+_gazetteer_lock = threading.Lock()
+
+def get_gazetteer() -> Optional[Gazetteer]:
+    """Instance partagée (chargée une fois par processus), ou None si pas de fichier local."""
+    global _gazetteer, _gazetteer_loaded
+    if not _gazetteer_loaded:
+        with _gazetteer_lock:
+            if not _gazetteer_loaded:
+                if COMMUNES_PATH.exists():
+                    try:
+                        _gazetteer = Gazetteer.from_csv(COMMUNES_PATH)
+                    except Exception as e:
+                        telemetry.record_error("gazetteer.load", e) # Repli : géocodage Nominatim
+                _gazetteer_loaded = True
+    return _gazetteer
@@ -0,0 +1,121 @@
+"""
+utils/geocoding.py
+Géocodage concurrent des extrémités de trajets.
+- Limiteur "token bucket" partagé par tout le processus (politique Nominatim : 1 req/s).
+- Pool de threads : départ et arrivée (ou tout un lot de villes) résolus en parallèle.
+- Déduplication des recherches identiques en cours.
+- Échéance globale : l'UI obtient une réponse dans un budget de latence fixe.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, Optional, Tuple
+
+from utils.text import normalize_city
+
+# Budget de latence par défaut pour un clic "Calculer" (secondes)
+GEOCODE_DEADLINE = 8.0
+
+class TokenBucket:
+    """Limiteur de débit thread-safe : `rate` jetons/s, rafale max `capacity`."""
+    def __init__(self, rate: float = 1.0, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Attend un jeton ; False si `timeout` est dépassé avant d'en obtenir un."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_s = (1 - self._tokens) / self.rate
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: return False
+                wait_s = min(wait_s, remaining)
+            time.sleep(wait_s)
+
+# Partagé par toutes les sessions Streamlit du processus
+# Surchargeable pour une instance Nominatim locale (ou le bouchon des benchmarks)
+NOMINATIM_RPS = float(os.environ.get("ECOROUTE_NOMINATIM_RPS", 1.0))
+NOMINATIM_LIMITER = TokenBucket(rate=NOMINATIM_RPS, capacity=max(1.0, NOMINATIM_RPS))
+
+class GeocodeTimeout(TimeoutError):
+    """Recherche(s) non terminée(s) à l'échéance : ni trouvées, ni introuvables."""
+    def __init__(self, names):
+        self.names = list(names)
+        super().__init__(f"Géocodage trop lent : {', '.join(self.names)}")
+
+class GeocodingService:
+    def __init__(self, max_workers: int = 4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode")
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, city_name: str) -> Future:
+        """Lance (ou rejoint) la résolution de `city_name`."""
+        key = normalize_city(city_name)
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None: return fut
+            fut = self._pool.submit(self._resolve, city_name)
+            self._inflight[key] = fut
+        # Hors du verrou : si la recherche est déjà finie, le callback s'exécute immédiatement ici
+        fut.add_done_callback(lambda _f, k=key: self._forget(k))
+        return fut
+
+    def _forget(self, key: str):
+        with self._lock:
+            self._inflight.pop(key, None)
+
+    @staticmethod
+    def _resolve(city_name: str):
+        from utils.data import get_coordinates # Import local : utils.data dépend de ce module
+        return get_coordinates(city_name, strict=True) # Erreur réseau -> exception du Future, non mise en cache
+
+    def resolve_many(self, names: Iterable[str], deadline: Optional[float] = GEOCODE_DEADLINE,
+                     failed: Optional[set] = None) -> Dict[str, Optional[Tuple[float, float]]]:
+        """
+        Résout un lot de villes en parallèle.
+        Les villes non résolues à l'échéance valent None (la recherche continue en
+        arrière-plan et alimentera le cache pour le prochain clic).
+        failed : si fourni, reçoit les villes en échec transitoire (erreur réseau, échéance),
+        à distinguer des villes introuvables.
+        """
+        futures = {name: self.submit(name) for name in dict.fromkeys(names)}
+        wait(futures.values(), timeout=deadline)
+        if failed is not None:
+            failed.update(name for name, f in futures.items() if not f.done() or f.exception())
+        return {name: (f.result() if f.done() and not f.exception() else None) for name, f in futures.items()}
+
+    def resolve_pair(self, start: str, end: str, deadline: Optional[float] = GEOCODE_DEADLINE):
+        """
+        Coordonnées du départ et de l'arrivée (None = ville introuvable).
+        Lève GeocodeTimeout si une recherche n'est pas terminée à l'échéance.
+        """
+        futures = {name: self.submit(name) for name in dict.fromkeys([start, end])}
+        wait(futures.values(), timeout=deadline)
+        pending = [name for name, f in futures.items() if not f.done()]
+        if pending: raise GeocodeTimeout(pending)
+        coords = {name: (f.result() if not f.exception() else None) for name, f in futures.items()}
+        return coords[start], coords[end]
+
+_service = None
+_service_lock = threading.Lock()
+
+def get_geocoding_service() -> GeocodingService:
+    """Service partagé (un pool par processus)."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = GeocodingService()
+        return _service
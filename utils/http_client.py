@@ -0,0 +1,111 @@
+"""
+utils/http_client.py
+Couche HTTP partagée (ADEME Impact CO2, Nominatim, OSRM).
+- Une session "keep-alive" par hôte : plus de poignée de main TCP/TLS à chaque appel.
+- Nouvelles tentatives avec backoff sur erreurs 5xx / timeouts (sauf hôtes sous limiteur de débit).
+- Requêtes conditionnelles (ETag / If-Modified-Since) avec corps mémorisé sur disque.
+- Limite de requêtes simultanées par hôte.
+"""
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from utils.cache import DiskCache, MISSING
+
+USER_AGENT = "ecoroute_app_details_v3"
+DEFAULT_HOST_LIMIT = 8
+# Requêtes simultanées max par hôte (Nominatim : usage raisonnable exigé)
+HOST_LIMITS = {
+    "nominatim.openstreetmap.org": 2,
+    "router.project-osrm.org": 4,
+}
+POOL_SIZE = 16
+
+_sessions: Dict[str, requests.Session] = {}
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+# Hôtes dont chaque requête doit prendre un jeton de limiteur (Nominatim) : l'appelant gère les nouvelles tentatives
+_no_retry_hosts = set()
+_lock = threading.Lock()
+# Validateurs (ETag / Last-Modified) + dernier corps reçu, par URL complète
+VALIDATOR_CACHE = DiskCache("http_validators", max_entries=200)
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+def disable_retries(url: str):
+    """Pas de nouvelle tentative automatique vers l'hôte de `url` (requêtes soumises à un limiteur de débit)."""
+    host = _host(url)
+    with _lock:
+        _no_retry_hosts.add(host)
+        session = _sessions.pop(host, None) # Recréée sans retries au prochain appel
+    if session: session.close()
+
+def get_session(url: str) -> requests.Session:
+    """Session partagée pour l'hôte de `url` (pool de connexions + retries)."""
+    host = _host(url)
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            retry = 0 if host in _no_retry_hosts else Retry(
+                total=3, connect=3, read=2, backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504), allowed_methods=("GET", "HEAD"),
+                respect_retry_after_header=True,
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.headers["User-Agent"] = USER_AGENT
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[host] = session
+            _semaphores.setdefault(host, threading.BoundedSemaphore(HOST_LIMITS.get(host.split(":")[0], DEFAULT_HOST_LIMIT)))
+        return session
+
+@contextmanager
+def _host_slot(url: str):
+    get_session(url)
+    sem = _semaphores[_host(url)]
+    with sem:
+        yield
+
+def get(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 5, **kwargs) -> requests.Response:
+    """GET via la session partagée de l'hôte, dans la limite de concurrence de l'hôte."""
+    session = get_session(url)
+    with _host_slot(url):
+        return session.get(url, params=params, timeout=timeout, **kwargs)
+
+def get_json_conditional(url: str, params: Optional[Dict[str, Any]] = None, timeout: float = 5) -> Any:
+    """
+    GET JSON conditionnel : renvoie le corps mémorisé si le serveur répond 304 Not Modified.
+    Lève une exception requests en cas d'erreur HTTP.
+    """
+    key = requests.Request("GET", url, params=params).prepare().url
+    cached = VALIDATOR_CACHE.get(key)
+    headers = {}
+    if cached is not MISSING:
+        if cached.get("etag"): headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"): headers["If-Modified-Since"] = cached["last_modified"]
+    r = get(url, params=params, timeout=timeout, headers=headers)
+    if r.status_code == 304 and cached is not MISSING:
+        return cached["body"]
+    r.raise_for_status()
+    body = r.json()
+    if r.headers.get("ETag") or r.headers.get("Last-Modified"):
+        VALIDATOR_CACHE.set(key, {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "body": body,
+        })
+    return body
+
+def close_all():
+    """Ferme les sessions (fin de processus, tests)."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _semaphores.clear()
@@ -0,0 +1,194 @@
+"""
+utils/itinerary.py
+Itinéraires multi-étapes (A -> B -> C ...).
+- Cache des tronçons : chaque paire distincte n'est géocodée / calculée / routée qu'une fois,
+  tous itinéraires et sessions confondus.
+- Mode choisi tronçon par tronçon (meilleur CO2, meilleur prix, ou mode imposé).
+- Totaux CO2 / prix / distance.
+- Optimisation optionnelle de l'ordre des étapes (plus proche voisin + 2-opt) sur la matrice
+  des tronçons déjà en cache : aucun tronçon n'est recalculé.
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import telemetry
+from utils.geocoding import GEOCODE_DEADLINE, get_geocoding_service
+from utils.results import ModeResult, TripResult
+
+OBJECTIVES = {"co2": "co2_kg", "price": "price_avg"}
+MAX_STOPS = 12
+MAX_BIKE_KM = 30 # Au-delà, le vélo / la marche ne sont pas proposés par défaut
+
+class LegCache:
+    """Cache LRU mémoire des tronçons : (départ, arrivée, version des facteurs) -> TripResult."""
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._legs: "OrderedDict[str, TripResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(a, b, factor_version) -> str:
+        return f"{a[0]:.4f},{a[1]:.4f}>{b[0]:.4f},{b[1]:.4f}@{factor_version}"
+
+    def get(self, key) -> Optional[TripResult]:
+        with self._lock:
+            leg = self._legs.get(key)
+            if leg is not None: self._legs.move_to_end(key)
+        telemetry.cache_result("legs", leg is not None)
+        return leg
+
+    def set(self, key, leg: TripResult):
+        with self._lock:
+            self._legs[key] = leg
+            self._legs.move_to_end(key)
+            while len(self._legs) > self.max_entries:
+                self._legs.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._legs)
+
+LEG_CACHE = LegCache()
+
+def _compute_legs(pairs: List[Tuple[tuple, tuple]]) -> List[TripResult]:
+    """Calcule des tronçons en une passe vectorisée (calculate_trips, mode pairwise)."""
+    from utils.data import calculate_trips
+    df = calculate_trips([a for a, _ in pairs], [b for _, b in pairs], pairwise=True)
+    n_modes = len(df) // len(pairs)
+    return [TripResult.from_frame(df.iloc[k * n_modes:(k + 1) * n_modes], start_coords=a, end_coords=b,
+                                  factor_version=df.attrs["factor_version"])
+            for k, (a, b) in enumerate(pairs)]
+
+def get_legs(pairs: Sequence[Tuple[tuple, tuple]]) -> List[TripResult]:
+    """Tronçons pour ces paires de coordonnées : cache d'abord, les manquants en un seul calcul."""
+    from utils.data import get_factor_version
+    version = get_factor_version()
+    keys = [LEG_CACHE.key(a, b, version) for a, b in pairs]
+    legs = [LEG_CACHE.get(k) for k in keys]
+    missing = [i for i, leg in enumerate(legs) if leg is None]
+    if missing:
+        todo: Dict[str, int] = {}
+        for i in missing: todo.setdefault(keys[i], i) # Paires répétées : calculées une fois
+        computed = _compute_legs([pairs[i] for i in todo.values()])
+        for key, leg in zip(todo, computed):
+            LEG_CACHE.set(key, leg)
+        by_key = dict(zip(todo, computed))
+        legs = [leg if leg is not None else by_key[k] for leg, k in zip(legs, keys)]
+    return legs
+
+def choose_mode(leg: TripResult, objective: str = "co2", keywords: Optional[Tuple[str, ...]] = None) -> Optional[ModeResult]:
+    """
+    Meilleur mode du tronçon pour l'objectif, parmi ceux dont le nom contient un des `keywords`.
+    Sans `keywords`, le vélo n'est retenu que sur les tronçons courts (MAX_BIKE_KM).
+    """
+    attr = OBJECTIVES[objective]
+    candidates = [r for r in leg.rows(keywords)
+                  if keywords or "Vélo" not in r.mode or r.distance_km <= MAX_BIKE_KM]
+    return min(candidates, key=lambda r: getattr(r, attr)) if candidates else None
+
+# --- ORDRE DES ÉTAPES ---
+def _path_cost(cost, order) -> float:
+    return float(sum(cost[a, b] for a, b in zip(order, order[1:])))
+
+def optimize_order(cost: np.ndarray, keep_end: bool = True) -> List[int]:
+    """
+    Ordre de visite minimisant la somme des coûts : départ fixé (indice 0),
+    arrivée fixée (dernier indice) si `keep_end`. Plus proche voisin puis 2-opt.
+    """
+    n = len(cost)
+    if n - (2 if keep_end else 1) <= 1: return list(range(n)) # Au plus une étape libre
+    last = n - 1 if keep_end else None
+    free = set(range(1, n)) - {last}
+    order = [0]
+    while free:
+        nxt = min(free, key=lambda j: cost[order[-1], j])
+        order.append(nxt)
+        free.remove(nxt)
+    if keep_end: order.append(last)
+    # 2-opt : on inverse un segment tant que le coût baisse (coûts éventuellement asymétriques)
+    end = len(order) - (1 if keep_end else 0)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, end - 1):
+            for j in range(i + 1, end):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                if _path_cost(cost, candidate) < _path_cost(cost, order) - 1e-9:
+                    order, improved = candidate, True
+    return order
+
+class Itinerary:
+    """Suite de tronçons avec un mode choisi par tronçon."""
+    def __init__(self, stops: List[str], coords: List[tuple], legs: List[TripResult], objective: str = "co2",
+                 keywords: Optional[Tuple[str, ...]] = None):
+        self.stops = stops
+        self.coords = coords
+        self.legs = legs
+        self.objective = objective
+        self.modes = [choose_mode(leg, objective, keywords) or choose_mode(leg, objective) for leg in legs]
+
+    def set_mode(self, i: int, mode: str):
+        """Impose le mode du tronçon i (nom exact d'un mode du tronçon)."""
+        self.modes[i] = next(r for r in self.legs[i].rows() if r.mode == mode)
+
+    @property
+    def total_co2(self) -> float:
+        return round(sum(m.co2_kg for m in self.modes), 2)
+
+    @property
+    def total_price(self) -> float:
+        return round(sum(m.price_avg for m in self.modes), 2)
+
+    @property
+    def total_km(self) -> float:
+        return round(sum(m.distance_km for m in self.modes), 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "stops": self.stops,
+            "legs": [{"from": a, "to": b, **m._asdict()}
+                     for a, b, m in zip(self.stops, self.stops[1:], self.modes)],
+            "total_co2_kg": self.total_co2,
+            "total_price_eur": self.total_price,
+            "total_km": self.total_km,
+        }
+
+@telemetry.traced("itinerary")
+def plan_itinerary(stops: Sequence[str], objective: str = "co2", keywords: Optional[Tuple[str, ...]] = None,
+                   optimize: bool = False, keep_end: bool = True, deadline: float = GEOCODE_DEADLINE):
+    """
+    Itinéraire multi-étapes. Renvoie (Itinerary, [étapes introuvables]) ; Itinerary est None
+    s'il reste moins de deux étapes géocodées.
+    objective : "co2" ou "price" (choix du mode de chaque tronçon, et de l'ordre si `optimize`).
+    keywords : modes autorisés (ex : ("Train",)) ; à défaut sur un tronçon, tous les modes.
+    optimize : réordonne les étapes intermédiaires (départ fixe, arrivée fixe si `keep_end`).
+    Lève ValueError si l'objectif est inconnu ou s'il y a plus de MAX_STOPS étapes.
+    """
+    if objective not in OBJECTIVES: raise ValueError(f"objective : {', '.join(OBJECTIVES)}")
+    stops = [s.strip() for s in stops if s and s.strip()]
+    if len(stops) > MAX_STOPS: raise ValueError(f"Trop d'étapes ({len(stops)} > {MAX_STOPS})")
+    found = get_geocoding_service().resolve_many(list(dict.fromkeys(stops)), deadline=deadline)
+    missing = [s for s in stops if not found.get(s)]
+    stops = [s for s in stops if found.get(s)]
+    if len(stops) < 2: return None, missing
+    coords = [tuple(found[s]) for s in stops]
+
+    if optimize and len(stops) > 2:
+        # Matrice complète des tronçons (mise en cache : l'itinéraire final la réutilise)
+        n = len(stops)
+        pairs = [(coords[i], coords[j]) for i in range(n) for j in range(n) if i != j]
+        legs = iter(get_legs(pairs))
+        cost = np.zeros((n, n))
+        for i in range(n):
+            for j in range(n):
+                if i == j: continue
+                leg = next(legs)
+                best = choose_mode(leg, objective, keywords) or choose_mode(leg, objective)
+                cost[i, j] = getattr(best, OBJECTIVES[objective])
+        order = optimize_order(cost, keep_end=keep_end)
+        stops, coords = [stops[i] for i in order], [coords[i] for i in order]
+
+    legs = get_legs(list(zip(coords, coords[1:])))
+    return Itinerary(stops, coords, legs, objective, keywords), missing
@@ -0,0 +1,199 @@
+"""
+utils/llm_scheduler.py
+Ordonnanceur des fournisseurs LLM (chaîne de repli de l'EcoAssistant).
+- Latence mesurée par modèle (p95 glissant).
+- Requête "hedgée" : si le modèle principal dépasse son p95, on lance le suivant en parallèle.
+- La première réponse valide gagne, les autres sont annulées / ignorées.
+- Disjoncteur par fournisseur : après plusieurs erreurs, il est ignoré pendant un temps de repos.
+La fonction d'appel est injectée : on peut tester avec des fournisseurs factices locaux.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+class AllProvidersFailed(Exception):
+    """Aucun modèle de la chaîne n'a répondu."""
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors) or "aucun fournisseur disponible")
+        self.errors = errors
+
+class LatencyTracker:
+    def __init__(self, window: int = 50, min_samples: int = 5):
+        self.min_samples = min_samples
+        self._samples: Dict[str, deque] = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, model: str, q: float = 95) -> Optional[float]:
+        """Percentile des dernières latences, ou None si trop peu de mesures."""
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples: return None
+        return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
+
+class CircuitBreaker:
+    """
+    Fermé -> ouvert après `threshold` échecs consécutifs ; semi-ouvert après `cooldown` s.
+    En semi-ouvert, un seul appel d'essai passe jusqu'à son résultat (ou `cooldown` s sans nouvelles).
+    """
+    def __init__(self, threshold: int = 3, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def ready(self) -> bool:
+        """Un appel passerait-il ? Lecture seule : ne réserve pas l'essai semi-ouvert."""
+        state = self.state
+        if state != "half-open": return state == "closed"
+        with self._lock:
+            return self._probe_started is None or time.monotonic() - self._probe_started >= self.cooldown
+
+    def allow(self) -> bool:
+        """Autorise un appel ; en semi-ouvert, réserve l'unique essai (à appeler juste avant l'appel)."""
+        state = self.state
+        if state != "half-open": return state == "closed"
+        with self._lock:
+            now = time.monotonic()
+            if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                return False # Essai déjà en cours
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_started = None
+            # En semi-ouvert, un seul échec suffit à rouvrir
+            if self.failures >= self.threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+class ProviderScheduler:
+    def __init__(self, call: Callable[[str, list], str], default_hedge_delay: float = 4.0,
+                 min_hedge_delay: float = 0.5, max_parallel: int = 2,
+                 failure_threshold: int = 3, cooldown: float = 60.0, max_workers: int = 8):
+        self.call = call
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_parallel = max_parallel
+        self.latency = LatencyTracker()
+        self._breaker_args = (failure_threshold, cooldown)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        with self._lock:
+            if model not in self._breakers:
+                self._breakers[model] = CircuitBreaker(*self._breaker_args)
+            return self._breakers[model]
+
+    def available(self, models: Sequence[str]) -> List[str]:
+        """Modèles dont le disjoncteur laisse passer un appel (tous, si aucun). Ne réserve rien."""
+        ready = [m for m in models if self.breaker(m).ready()]
+        return ready or list(models)
+
+    def acquire(self, model: str, models: Sequence[str]) -> bool:
+        """
+        À appeler juste avant d'interroger `model` : réserve l'essai semi-ouvert s'il y a lieu.
+        Si aucun modèle de la chaîne `models` n'est disponible, on tente quand même (comme available()).
+        """
+        return self.breaker(model).allow() or not any(self.breaker(m).ready() for m in models)
+
+    def hedge_delay(self, model: str) -> float:
+        p95 = self.latency.percentile(model, 95)
+        return max(self.min_hedge_delay, p95 if p95 is not None else self.default_hedge_delay)
+
+    def _timed_call(self, model: str, messages: list) -> str:
+        t0 = time.perf_counter()
+        try:
+            content = self.call(model, messages)
+            if not content: raise ValueError("réponse vide")
+        except Exception:
+            self.breaker(model).record_failure()
+            raise
+        self.latency.record(model, time.perf_counter() - t0)
+        self.breaker(model).record_success()
+        return content
+
+    def run(self, models: Sequence[str], messages: list, timeout: Optional[float] = None) -> Tuple[str, str]:
+        """
+        Interroge la chaîne `models` ; renvoie (modèle, réponse) du premier succès.
+        Lève AllProvidersFailed si tous échouent (ou si `timeout` est dépassé).
+        """
+        candidates = self.available(models)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        pending = {}
+        errors = []
+        next_idx = 0
+        current = None # Dernier modèle lancé (délai de hedging)
+
+        def launch():
+            """Lance le prochain candidat dont le disjoncteur accepte l'appel."""
+            nonlocal next_idx, current
+            while next_idx < len(candidates):
+                model = candidates[next_idx]
+                next_idx += 1
+                if self.acquire(model, models):
+                    pending[self._pool.submit(self._timed_call, model, messages)] = current = model
+                    return
+
+        launch()
+        while pending:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                errors.append("délai global dépassé")
+                break
+            can_hedge = next_idx < len(candidates) and len(pending) < self.max_parallel
+            wait_s = self.hedge_delay(current) if can_hedge else None
+            if remaining is not None:
+                wait_s = remaining if wait_s is None else min(wait_s, remaining)
+            done, _ = wait(pending, timeout=wait_s, return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge: launch() # Le modèle en cours dépasse son p95 : requête de couverture
+                continue
+            for fut in done:
+                model = pending.pop(fut)
+                try:
+                    content = fut.result()
+                except Exception as e:
+                    errors.append(f"⚠️ Échec sur {model} : {e}")
+                    continue
+                for other in pending: other.cancel() # Le premier succès gagne
+                return model, content
+            if not pending and next_idx < len(candidates):
+                launch()
+        for other in pending: other.cancel()
+        raise AllProvidersFailed(errors)
+
+    def status(self) -> Dict[str, dict]:
+        """État des fournisseurs (disjoncteur, p50/p95) pour le débogage."""
+        with self._lock:
+            models = list(self._breakers)
+        return {
+            m: {
+                "breaker": self.breaker(m).state,
+                "p50_s": self.latency.percentile(m, 50),
+                "p95_s": self.latency.percentile(m, 95),
+            }
+            for m in models
+        }
@@ -1,35 +1,120 @@
-import folium
-import requests
+import os
+import numpy as np
+import polyline
+from utils import http_client, telemetry
+from utils.cache import DiskCache, MISSING
 
-def get_route_osrm(start_coords, end_coords, profile="driving"):
+OSRM_URL = os.environ.get("ECOROUTE_OSRM_URL", "http://router.project-osrm.org")
+
+# --- CACHE DES ITINÉRAIRES OSRM ---
+# Clé : (extrémités arrondies à ~100 m, profil). Géométries stockées en polylines encodées.
+ROUTE_CACHE = DiskCache("routes", max_entries=2000, default_ttl=3600*24*7)
+ROUTE_KEY_DECIMALS = 3
+# Tolérances Douglas–Peucker précalculées (en degrés, 0 = tracé complet)
+SIMPLIFY_TOLERANCES = (0.0, 0.0005, 0.002, 0.01)
+
+def simplify_route(points, tolerance):
+    """Douglas–Peucker (itératif) sur un array (N, 2) de (lat, lon)."""
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    if tolerance <= 0 or n < 3: return points
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2: continue
+        a, b = points[i], points[j]
+        seg = points[i + 1:j] - a
+        ab = b - a
+        norm = np.hypot(*ab)
+        if norm == 0:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        else:
+            dist = np.abs(seg[:, 0] * ab[1] - seg[:, 1] * ab[0]) / norm
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return points[keep]
+
+def _route_key(start_coords, end_coords, profile):
+    r = ROUTE_KEY_DECIMALS
+    return (f"{profile}:{round(start_coords[0], r)},{round(start_coords[1], r)}"
+            f";{round(end_coords[0], r)},{round(end_coords[1], r)}")
+
+@telemetry.traced("route")
+def get_route(start_coords, end_coords, profile="driving"):
     """
-    Récupère le tracé via OSRM.
-    profile : 'driving' (voiture) ou 'cycling' (vélo)
+    Itinéraire OSRM mis en cache :
+    {"levels": {tolérance: polyline encodée}, "distance_km": float, "duration_min": float}
+    ou None si OSRM ne répond pas.
     """
+    key = _route_key(start_coords, end_coords, profile)
+    cached = ROUTE_CACHE.get(key)
+    if cached is not MISSING: return cached
+
     # OSRM attend : lon,lat;lon,lat
     start_str = f"{start_coords[1]},{start_coords[0]}"
     end_str = f"{end_coords[1]},{end_coords[0]}"
-    
-    url = f"http://router.project-osrm.org/route/v1/{profile}/{start_str};{end_str}?overview=full&geometries=geojson"
-    
+    url = f"{OSRM_URL}/route/v1/{profile}/{start_str};{end_str}?overview=full&geometries=polyline"
     try:
-        r = requests.get(url, timeout=5)
-        if r.status_code == 200:
-            data = r.json()
-            geometry = data['routes'][0]['geometry']['coordinates']
-            # Conversion [lon, lat] -> [lat, lon] pour Folium
-            route_coords = [(point[1], point[0]) for point in geometry]
-            return route_coords
-    except:
+        with telemetry.span("route.osrm"):
+            r = http_client.get(url, timeout=5)
+            r.raise_for_status()
+            data = r.json()['routes'][0]
+    except Exception as e:
+        telemetry.record_error("route.osrm", e)
         return None
 
-def create_trip_map(start_coords, end_coords, start_name, end_name, selected_mode="Route"):
-    """Génère une carte adaptée au mode de transport choisi (Route/Train/Avion)."""
+    # Polyline OSRM : déjà en (lat, lon)
+    points = np.array(polyline.decode(data['geometry']), dtype=float)
+    route = {
+        "levels": {str(tol): polyline.encode([tuple(p) for p in simplify_route(points, tol)], 5)
+                   for tol in SIMPLIFY_TOLERANCES},
+        "distance_km": round(data.get('distance', 0) / 1000, 1) or None,
+        "duration_min": round(data.get('duration', 0) / 60) or None,
+    }
+    ROUTE_CACHE.set(key, route)
+    return route
+
+def tolerance_for_zoom(zoom):
+    """Plus grande tolérance précalculée inférieure à ~1 pixel au niveau de zoom donné."""
+    deg_per_pixel = 360 / (256 * 2 ** zoom)
+    return max(t for t in SIMPLIFY_TOLERANCES if t <= deg_per_pixel)
+
+def fit_zoom(start_coords, end_coords, map_px=500):
+    """Niveau de zoom approximatif pour que les deux points tiennent dans la carte."""
+    span = max(abs(start_coords[0] - end_coords[0]), abs(start_coords[1] - end_coords[1]), 1e-3)
+    zoom = int(np.floor(np.log2(360 * map_px / (256 * span * 1.5))))
+    return int(np.clip(zoom, 3, 15))
+
+def get_route_osrm(start_coords, end_coords, profile="driving", tolerance=0.0):
+    """
+    Récupère le tracé via OSRM (cache + simplification).
+    profile : 'driving' (voiture) ou 'cycling' (vélo)
+    Renvoie une liste de (lat, lon) pour Folium, ou None.
+    """
+    route = get_route(start_coords, end_coords, profile)
+    if not route: return None
+    return polyline.decode(route["levels"][str(tolerance)], 5)
+
+@telemetry.traced("map")
+def create_trip_map(start_coords, end_coords, start_name, end_name, selected_mode="Route", zoom=None):
+    """
+    Génère une carte adaptée au mode de transport choisi (Route/Train/Avion).
+    zoom : niveau de zoom initial (par défaut : ajusté au trajet) ; le tracé
+    routier n'est envoyé qu'avec le niveau de détail utile à ce zoom.
+    """
+    import folium # Import paresseux : chargé au premier affichage de l'onglet Carte
+    zoom = zoom if zoom is not None else fit_zoom(start_coords, end_coords)
     
     # Centrage
     center_lat = (start_coords[0] + end_coords[0]) / 2
     center_lon = (start_coords[1] + end_coords[1]) / 2
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=6, tiles="CartoDB positron")
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=zoom, tiles="CartoDB positron")
     
     # Marqueurs
     folium.Marker(start_coords, popup=f"Départ: {start_name}", icon=folium.Icon(color="green", icon="play")).add_to(m)
@@ -44,17 +129,28 @@ def create_trip_map(start_coords, end_coords, start_name, end_name, selected_mod
     # 1. Mode ROUTE (Voiture, Bus, Covoiturage)
     # On checke "Route" ou les anciens noms pour compatibilité
     if selected_mode == "Route" or "Voiture" in selected_mode or "Autocar" in selected_mode:
-        route_coords = get_route_osrm(start_coords, end_coords, profile="driving")
+        route = get_route(start_coords, end_coords, profile="driving")
+        if route:
+            route_coords = polyline.decode(route["levels"][str(tolerance_for_zoom(zoom))], 5)
         color = "orange" # Orange pour la route
         tooltip = "Itinéraire Routier (OSRM)"
+        if route and route["distance_km"]:
+            h, mn = divmod(int(route["duration_min"] or 0), 60)
+            tooltip += f" — {route['distance_km']:.0f} km, {h} h {mn:02d}"
         
     # 2. Mode TRAIN
     elif selected_mode == "Train" or "Train" in selected_mode:
-        # Ligne droite pour le train (Pas d'API rail publique simple)
-        route_coords = None 
+        from utils.rail import get_rail_route
+        # Tracé réel si un réseau ferré local est chargé (utils/rail.py), sinon ligne droite
+        rail = get_rail_route(start_coords, end_coords)
         color = "blue" # Bleu SNCF
-        dash_array = '5, 10' # Pointillés
-        tooltip = "Ligne Ferroviaire (Vol d'oiseau)"
+        if rail:
+            route_coords = polyline.decode(rail["levels"][str(tolerance_for_zoom(zoom))], 5)
+            tooltip = f"Ligne Ferroviaire (réseau local) — {rail['distance_km']:.0f} km"
+        else:
+            route_coords = None
+            dash_array = '5, 10' # Pointillés
+            tooltip = "Ligne Ferroviaire (Vol d'oiseau)"
 
     # 3. Mode AVION
     elif selected_mode == "Avion" or "Avion" in selected_mode:
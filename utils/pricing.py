@@ -1,8 +1,11 @@
 """
 utils/pricing.py
 Module de calcul détaillé des coûts.
+Les tarifs de tous les modes sont regroupés dans une table (array structuré NumPy) :
+les prix de vecteurs entiers de distances × modes se calculent en une seule passe.
 """
-from typing import Dict
+from typing import Dict, Sequence
+import numpy as np
 
 # Constantes 2025
 FUEL_PRICES = {
@@ -14,44 +17,121 @@ AVG_CONSUMPTION = {
 }
 # Péage France (~0.12€/km sur autoroute, on suppose 80% du trajet sur autoroute)
 TOLL_RATE = 0.12 
+TOLL_SHARE = 0.8
+
+# Type de tarif
+KIND_CAR, KIND_TICKET, KIND_FREE = 0, 1, 2
+KIND_LABELS = {KIND_CAR: "voiture", KIND_TICKET: "ticket", KIND_FREE: "free"}
+# Distance servant au prix : vol d'oiseau, route (+20%), rail (+10%)
+BASIS_BIRD, BASIS_ROAD, BASIS_RAIL = 0, 1, 2
+
+TARIFF_DTYPE = np.dtype([
+    ("mode", "U32"),
+    ("kind", "i1"),
+    ("basis", "i1"),
+    ("rate", "f8"),        # €/km (billets)
+    ("base", "f8"),        # Part fixe (ex : taxes aéroport)
+    ("fuel_price", "f8"),  # €/L ou €/kWh
+    ("consumption", "f8"), # L ou kWh /100 km
+    ("toll_share", "f8"),  # Part du trajet sur autoroute payante
+    ("toll_rate", "f8"),   # €/km d'autoroute
+    ("min_mult", "f8"),    # Min = min_mult × (hors péage) + min_toll × péage
+    ("min_toll", "f8"),
+    ("max_mult", "f8"),    # Max = max_mult × total
+])
+
+def _car(mode, engine):
+    # Min : sans péage ; Max : bouchons (+15%)
+    return (mode, KIND_CAR, BASIS_ROAD, 0.0, 0.0, FUEL_PRICES[engine], AVG_CONSUMPTION[engine],
+            TOLL_SHARE, TOLL_RATE, 1.0, 0.0, 1.15)
+
+def _ticket(mode, basis, rate, base=0.0):
+    # Min : Prem's / Low cost ; Max : Dernière minute
+    return (mode, KIND_TICKET, basis, rate, base, 0.0, 0.0, 0.0, 0.0, 0.6, 0.0, 1.8)
+
+TARIFFS = np.array([
+    _car("Voiture (Thermique)", "Essence"),
+    _car("Voiture (Diesel)", "Diesel"),
+    _car("Voiture (Électrique)", "Électrique"),
+    _ticket("Train (TGV)", BASIS_RAIL, 0.15),
+    _ticket("Train (Intercités)", BASIS_RAIL, 0.10),
+    _ticket("Avion (Court courrier)", BASIS_BIRD, 0.12, base=50), # Base fixe aéroport
+    _ticket("Autocar", BASIS_ROAD, 0.06),
+    ("Vélo / Marche", KIND_FREE, BASIS_ROAD, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+], dtype=TARIFF_DTYPE)
+
+_TARIFF_INDEX = {m: i for i, m in enumerate(TARIFFS["mode"])}
+ENGINE_MODES = {"Essence": "Voiture (Thermique)", "Diesel": "Voiture (Diesel)", "Électrique": "Voiture (Électrique)"}
+
+def tariff_index(mode: str) -> int:
+    """Ligne de TARIFFS pour un mode (nom exact, sinon par mot-clé comme l'ancien calcul)."""
+    if mode in _TARIFF_INDEX: return _TARIFF_INDEX[mode]
+    for keyword, name in (("TGV", "Train (TGV)"), ("Intercités", "Train (Intercités)"),
+                          ("Avion", "Avion (Court courrier)"), ("Autocar", "Autocar")):
+        if keyword in mode: return _TARIFF_INDEX[name]
+    return _TARIFF_INDEX["Vélo / Marche"] # Mode inconnu : gratuit
+
+def tariffs_for(modes: Sequence[str]) -> np.ndarray:
+    """Sous-table des tarifs, une ligne par mode (dans l'ordre de `modes`)."""
+    return TARIFFS[[tariff_index(m) for m in modes]]
+
+def round_exact(values, decimals: int = 2):
+    """
+    Arrondi vectorisé identique à round(x, decimals) de Python (arrondi exact du binaire).
+    np.round passe par x*10^n et diffère parfois d'une unité sur les cas limites :
+    ceux-là (rares) sont recalculés avec round().
+    """
+    x = np.asarray(values, dtype=float)
+    out = np.round(x, decimals)
+    scaled = x * 10 ** decimals
+    suspect = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if suspect.any():
+        out = np.array(out, copy=True)
+        out[suspect] = [round(float(v), decimals) for v in x[suspect]]
+    return out[()] if out.ndim == 0 else out
+
+def compute_prices(distances, tariffs: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Prix de toutes les distances × modes en une passe.
+    distances : array (..., K) des distances de prix (km), diffusable contre `tariffs` (K,).
+    Renvoie total / min / max / carburant / péage, arrondis au centime.
+    """
+    d = np.asarray(distances, dtype=float)
+    t = tariffs
+    fuel = (d * t["consumption"] / 100) * t["fuel_price"]
+    toll = (d * t["toll_share"]) * t["toll_rate"]
+    fare = t["base"] + (d * t["rate"])
+    total = fare + fuel + toll
+    return {
+        "total": round_exact(total),
+        "min": round_exact(t["min_mult"] * (fare + fuel) + t["min_toll"] * toll),
+        "max": round_exact(total * t["max_mult"]),
+        "carburant": round_exact(fuel),
+        "peage": round_exact(toll),
+    }
 
 class PriceCalculator:
+    """Calcul des coûts pour une distance (float ou array NumPy). Adossé à TARIFFS."""
     def __init__(self, distance_km: float):
         self.distance = distance_km
 
+    def _details(self, row: np.void) -> Dict:
+        prices = compute_prices(self.distance, row)
+        kind = int(row["kind"])
+        details = {"type": KIND_LABELS[kind], "total": prices["total"]}
+        if kind == KIND_CAR:
+            details.update(carburant=prices["carburant"], peage=prices["peage"])
+        details.update(min=prices["min"], max=prices["max"])
+        return details
+
     def get_car_details(self, engine_type: str) -> Dict:
         """Détail pour voiture : Carburant + Péage"""
-        conso = AVG_CONSUMPTION.get(engine_type, 7.0)
-        price_unit = FUEL_PRICES.get(engine_type, 1.85)
-        
-        # Calculs
-        fuel_cost = (self.distance * conso / 100) * price_unit
-        toll_cost = (self.distance * 0.8) * TOLL_RATE
-        total = fuel_cost + toll_cost
-        
-        return {
-            "type": "voiture",
-            "total": round(total, 2),
-            "carburant": round(fuel_cost, 2),
-            "peage": round(toll_cost, 2),
-            "min": round(fuel_cost, 2), # Sans péage
-            "max": round(total * 1.15, 2) # Bouchons
-        }
+        return self._details(TARIFFS[_TARIFF_INDEX[ENGINE_MODES.get(engine_type, "Voiture (Thermique)")]])
 
     def get_ticket_details(self, mode: str) -> Dict:
         """Détail pour Billets (Train/Avion/Bus)"""
-        # Prix au km approximatif
-        if "TGV" in mode: rate = 0.15
-        elif "Intercités" in mode: rate = 0.10
-        elif "Avion" in mode: rate = 0.12; base = 50 # Base fixe aéroport
-        elif "Autocar" in mode: rate = 0.06; base = 0
-        else: rate = 0; base = 0
-        
-        base_price = base + (self.distance * rate) if "Avion" in mode else (self.distance * rate)
-        
-        return {
-            "type": "ticket",
-            "total": round(base_price, 2),
-            "min": round(base_price * 0.6, 2),  # Prem's / Low cost
-            "max": round(base_price * 1.8, 2)   # Dernière minute
-        }
\ No newline at end of file
+        row = TARIFFS[tariff_index(mode)]
+        if row["kind"] != KIND_TICKET: row = TARIFFS[_TARIFF_INDEX["Vélo / Marche"]] # Pas un billet : 0 €, comme avant
+        row = row.copy()
+        row["kind"] = KIND_TICKET
+        return self._details(row)
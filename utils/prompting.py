@@ -0,0 +1,122 @@
+"""
+utils/prompting.py
+Construction des prompts de l'EcoAssistant sous budget de tokens.
+- Tableau de résultats compact : seulement les champs utiles au modèle, une ligne par mode.
+- Compteur de tokens approximatif (sans tokenizer : litellm / tiktoken sont lourds à charger).
+- Budget d'entrée par modèle : la chaîne de repli entière doit tenir dans le plus petit.
+- Mémoire de chat bornée : fenêtre des derniers échanges + résumé glissant des plus anciens.
+"""
+import math
+from collections import deque
+from typing import Dict, List, Sequence
+
+# Budget de tokens d'entrée par modèle (prompt complet, historique compris).
+# Bien en dessous des fenêtres de contexte : latence et quotas (tokens/min) des offres gratuites.
+MODEL_BUDGETS = {
+    "groq/llama-3.1-8b-instant": 3000,
+    "gemini/gemini-2.5-flash-lite": 6000,
+    "huggingface/HuggingFaceH4/zephyr-7b-beta": 1500,
+}
+DEFAULT_BUDGET = 2000
+MESSAGE_OVERHEAD = 4     # Balises de rôle / séparateurs par message
+CHARS_PER_TOKEN = 3.5    # Texte français + chiffres, estimation prudente
+
+def count_tokens(text: str) -> int:
+    """Estimation (par excès) du nombre de tokens d'un texte."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+def count_message_tokens(messages: Sequence[Dict[str, str]]) -> int:
+    return sum(count_tokens(str(m["content"])) + MESSAGE_OVERHEAD for m in messages)
+
+def budget_for(models: Sequence[str]) -> int:
+    """Budget applicable à une chaîne de repli : celui du modèle le plus contraint."""
+    return min((MODEL_BUDGETS.get(m, DEFAULT_BUDGET) for m in models), default=DEFAULT_BUDGET)
+
+def truncate_to_tokens(text: str, max_tokens: int, keep: str = "start") -> str:
+    """Coupe `text` pour tenir dans `max_tokens` (garde le début ou la fin)."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars: return text
+    if max_chars <= 1: return ""
+    return text[:max_chars - 1] + "…" if keep == "start" else "…" + text[-(max_chars - 1):]
+
+def _fmt(value: float, decimals: int = 0) -> str:
+    return f"{value:.{decimals}f}"
+
+def compact_results(results) -> str:
+    """
+    Tableau dense (séparateur |) des résultats d'un trajet, pour le prompt.
+    `results` : TripResult ou DataFrame (colonnes de utils.results.FRAME_COLUMNS).
+    """
+    if hasattr(results, "rows"):
+        rows = [(r.mode, r.distance_km, r.co2_kg, r.price_avg, r.price_min, r.price_max) for r in results.rows()]
+    else:
+        cols = ["Mode", "Distance (km)", "CO2 (kg)", "Prix Moyen (€)", "Prix Min (€)", "Prix Max (€)"]
+        rows = list(results[cols].itertuples(index=False, name=None))
+    lines = ["mode|km|kgCO2|prix moy €|prix min-max €"]
+    for mode, km, co2, avg, lo, hi in rows:
+        lines.append(f"{mode}|{_fmt(km)}|{_fmt(co2, 1)}|{_fmt(avg)}|{_fmt(lo)}-{_fmt(hi)}")
+    return "\n".join(lines)
+
+def fit_messages(system: str, history: Sequence[Dict[str, str]], user: str, budget: int,
+                 reply_reserve: int = 0) -> List[Dict[str, str]]:
+    """
+    Assemble [système, historique..., question] dans `budget` tokens :
+    on retire d'abord les plus anciens échanges, puis on tronque le système, puis la question.
+    """
+    budget -= reply_reserve
+    user_msg = {"role": "user", "content": user}
+    history = list(history)
+    fixed = count_tokens(system) + count_tokens(user) + 2 * MESSAGE_OVERHEAD
+    while history and fixed + count_message_tokens(history) > budget:
+        history.pop(0)
+    if fixed > budget:
+        # Pas d'historique possible : système d'abord, puis la question si elle est démesurée
+        room = max(budget - 2 * MESSAGE_OVERHEAD - count_tokens(user), budget // 2)
+        system = truncate_to_tokens(system, room)
+        room = budget - 2 * MESSAGE_OVERHEAD - count_tokens(system)
+        user_msg["content"] = truncate_to_tokens(user, max(room, 1), keep="end")
+    return [{"role": "system", "content": system}, *history, user_msg]
+
+class ChatMemory:
+    """
+    Historique de chat borné (à garder dans st.session_state).
+    Les `window` derniers messages sont envoyés tels quels ; les plus anciens sont
+    repliés dans un résumé extractif (début de chaque message), lui-même borné.
+    """
+    def __init__(self, window: int = 6, summary_tokens: int = 300, snippet_chars: int = 160):
+        self.window = window
+        self.summary_tokens = summary_tokens
+        self.snippet_chars = snippet_chars
+        self.recent = deque()
+        self.summary = ""
+        self.folded = 0 # Nombre de messages repliés dans le résumé
+
+    def add(self, role: str, content: str):
+        self.recent.append({"role": role, "content": content})
+        while len(self.recent) > self.window:
+            self._fold(self.recent.popleft())
+
+    def _fold(self, message: Dict[str, str]):
+        who = "Utilisateur" if message["role"] == "user" else "EcoBot"
+        text = " ".join(str(message["content"]).split())
+        if len(text) > self.snippet_chars:
+            cut = text.rfind(". ", 0, self.snippet_chars)
+            text = text[:cut + 1] if cut > 40 else text[:self.snippet_chars - 1] + "…"
+        # Résumé glissant : les éléments les plus anciens sortent en premier
+        self.summary = truncate_to_tokens(f"{self.summary}\n- {who} : {text}".strip(), self.summary_tokens, keep="end")
+        self.folded += 1
+
+    def history(self) -> List[Dict[str, str]]:
+        return list(self.recent)
+
+    def system_suffix(self) -> str:
+        """Texte à ajouter au message système (vide tant que rien n'a été replié)."""
+        return f"\nRésumé des échanges précédents :\n{self.summary}" if self.summary else ""
+
+    def clear(self):
+        self.recent.clear()
+        self.summary = ""
+        self.folded = 0
+
+    def __len__(self) -> int:
+        return self.folded + len(self.recent)
@@ -0,0 +1,436 @@
+"""
+utils/rail.py
+Réseau ferré hors-ligne (optionnel) : distances et tracés réels pour les modes Train.
+- Chargé depuis un fichier local : GeoJSON des lignes (ex : "Formes des lignes du RFN", SNCF Réseau)
+  ou GTFS shapes.txt.
+- Précalcul : les sommets intermédiaires (degré 2) sont contractés, seul le graphe des
+  jonctions est parcouru ; adjacence compacte CSR (NumPy), mise en cache disque (.npz).
+- Les villes sont projetées sur le segment de voie le plus proche (pas seulement sur une jonction).
+- Plus court chemin A* (heuristique : distance orthodromique), résultats en cache SQLite.
+Si le fichier est absent, get_rail_network() renvoie None et on garde l'estimation vol d'oiseau × 1,1.
+"""
+import csv
+import hashlib
+import heapq
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from utils import telemetry
+from utils.cache import CACHE_DIR, MISSING, DiskCache
+
+# Ex : https://ressources.data.sncf.com/explore/dataset/formes-des-lignes-du-rfn/
+RAIL_PATH = Path(os.environ.get("ECOROUTE_RAIL", Path(__file__).resolve().parent.parent / "data" / "rail_network.geojson"))
+
+EARTH_RADIUS_KM = 6371.0088
+SNAP_DECIMALS = 5     # Sommets fusionnés à ~1 m près (raccords entre lignes)
+MAX_SNAP_KM = 25.0    # Au-delà, la ville n'est pas desservie par le réseau chargé
+RAIL_ROUTE_CACHE = DiskCache("rail_routes", max_entries=5000, default_ttl=3600*24*30)
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+# --- LECTURE DES FICHIERS ---
+def _geojson_lines(path: Path) -> List[np.ndarray]:
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    features = data.get("features", [data]) if isinstance(data, dict) else data
+    lines = []
+    for feat in features:
+        geom = feat.get("geometry", feat) or {}
+        parts = {"LineString": [geom.get("coordinates")], "MultiLineString": geom.get("coordinates")}.get(geom.get("type"), [])
+        for part in parts or ():
+            if part and len(part) >= 2:
+                lines.append(np.asarray(part, dtype=float)[:, [1, 0]]) # GeoJSON : (lon, lat)
+    return lines
+
+def _gtfs_shapes(path: Path) -> List[np.ndarray]:
+    shapes: Dict[str, list] = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            shapes.setdefault(row["shape_id"], []).append(
+                (int(row["shape_pt_sequence"]), float(row["shape_pt_lat"]), float(row["shape_pt_lon"])))
+    return [np.array([(lat, lon) for _, lat, lon in sorted(pts)]) for pts in shapes.values() if len(pts) >= 2]
+
+def read_lines(path: Path) -> List[np.ndarray]:
+    """Polylignes (lat, lon) du fichier : GeoJSON ou GTFS shapes.txt."""
+    return _gtfs_shapes(path) if path.suffix in (".txt", ".csv") else _geojson_lines(path)
+
+# --- GRAPHE ---
+class RailNetwork:
+    """
+    Graphe des jonctions (sommets de degré ≠ 2) en CSR.
+    Chaque arc orienté référence la suite de sommets intermédiaires qu'il contracte,
+    pour restituer le tracé complet.
+    """
+    def __init__(self, node_coords, junctions, indptr, indices, weights, geom_ptr, geom_nodes):
+        self.node_coords = np.asarray(node_coords, dtype=np.float64) # (N, 2) tous les sommets
+        self.junctions = np.asarray(junctions, dtype=np.int32)       # jonction -> sommet
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float64)         # km
+        self.geom_ptr = np.asarray(geom_ptr, dtype=np.int64)         # arc -> tranche de geom_nodes
+        self.geom_nodes = np.asarray(geom_nodes, dtype=np.int32)
+        self._jcoords = self.node_coords[self.junctions].reshape(-1, 2)
+        self._isolated = np.diff(self.indptr) == 0 # Jonctions sans arc : jamais choisies
+        self._index_segments()
+        self.signature = ""
+
+    def _index_segments(self):
+        """
+        Segments de voie (une seule orientation par arc) pour la projection des villes :
+        sommets, arc porteur, rang dans l'arc et distance depuis le début de l'arc.
+        """
+        n_arcs = len(self.indices)
+        self._arc_source = np.repeat(np.arange(len(self.junctions)), np.diff(self.indptr))
+        g, ptr = self.geom_nodes, self.geom_ptr
+        # Arc inverse : même chaîne parcourue à l'envers ; (premier, deuxième sommet) identifie un arc
+        first = {(int(g[ptr[e]]), int(g[ptr[e] + 1])): e for e in range(n_arcs)}
+        self._reverse = np.array([first[(int(g[ptr[e + 1] - 1]), int(g[ptr[e + 1] - 2]))] for e in range(n_arcs)], dtype=np.int64)
+        canonical = np.arange(n_arcs) <= self._reverse
+        pos = np.arange(int(ptr[-1]))
+        arc_of = np.repeat(np.arange(n_arcs), np.diff(ptr))
+        keep = (pos != ptr[arc_of + 1] - 1) & canonical[arc_of] if n_arcs else np.zeros(0, dtype=bool)
+        pos, arc_of = pos[keep], arc_of[keep]
+        a, b = self.node_coords[g[pos]], self.node_coords[g[pos + 1]]
+        self._seg_a, self._seg_b, self._seg_arc, self._seg_rank = a, b, arc_of, pos - ptr[arc_of]
+        seg_km = _haversine(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+        before = np.cumsum(seg_km) - seg_km
+        starts = np.flatnonzero(self._seg_rank == 0)
+        self._seg_km = seg_km
+        self._seg_offset = before - np.repeat(before[starts], np.diff(np.append(starts, len(seg_km))))
+
+    def __len__(self) -> int:
+        return len(self.junctions)
+
+    @classmethod
+    def from_lines(cls, lines: List[np.ndarray]) -> "RailNetwork":
+        # 1. Sommets fusionnés, arêtes non orientées dédoublonnées
+        ids: Dict[tuple, int] = {}
+        coords = []
+        edges = set()
+        for line in lines:
+            prev = None
+            for lat, lon in np.round(line, SNAP_DECIMALS):
+                key = (float(lat), float(lon))
+                node = ids.get(key)
+                if node is None:
+                    node = ids[key] = len(coords)
+                    coords.append(key)
+                if prev is not None and prev != node:
+                    edges.add((min(prev, node), max(prev, node)))
+                prev = node
+        coords = np.array(coords, dtype=np.float64).reshape(-1, 2)
+        n = len(coords)
+        adj: List[List[int]] = [[] for _ in range(n)]
+        for a, b in edges:
+            adj[a].append(b)
+            adj[b].append(a)
+
+        # 2. Contraction des chaînes de degré 2 (les boucles isolées reçoivent une jonction arbitraire)
+        is_junction = np.array([len(nb) != 2 for nb in adj], dtype=bool)
+        arcs = []  # (jonction départ, jonction arrivée, km, [sommets])
+        seen = set()
+
+        def walk(start, first):
+            chain, prev, cur = [start], start, first
+            while not is_junction[cur]:
+                chain.append(cur)
+                nxt = adj[cur][0] if adj[cur][0] != prev else adj[cur][1]
+                prev, cur = cur, nxt
+            chain.append(cur)
+            return chain
+
+        def contract(j):
+            for nb in adj[j]:
+                if (j, nb) in seen: continue
+                chain = walk(j, nb)
+                for a, b in zip(chain, chain[1:]):
+                    seen.add((a, b)); seen.add((b, a))
+                pts = coords[chain]
+                km = float(_haversine(pts[:-1, 0], pts[:-1, 1], pts[1:, 0], pts[1:, 1]).sum())
+                arcs.append((chain[0], chain[-1], km, chain))
+                arcs.append((chain[-1], chain[0], km, chain[::-1]))
+
+        for j in np.flatnonzero(is_junction):
+            contract(int(j))
+        for v in range(n):
+            if adj[v] and (v, adj[v][0]) not in seen: # Boucle sans jonction
+                is_junction[v] = True
+                contract(v)
+
+        # 3. CSR des jonctions
+        junctions = np.flatnonzero(is_junction).astype(np.int32)
+        jid = np.full(n, -1, dtype=np.int64)
+        jid[junctions] = np.arange(len(junctions))
+        arcs.sort(key=lambda a: jid[a[0]])
+        counts = np.bincount([jid[a[0]] for a in arcs], minlength=len(junctions))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        geom_ptr = np.concatenate([[0], np.cumsum([len(a[3]) for a in arcs])]).astype(np.int64)
+        geom_nodes = np.fromiter((v for a in arcs for v in a[3]), dtype=np.int32, count=int(geom_ptr[-1]))
+        return cls(coords, junctions, indptr, [jid[a[1]] for a in arcs], [a[2] for a in arcs], geom_ptr, geom_nodes)
+
+    # --- Cache disque du graphe précalculé ---
+    _ARRAYS = ("node_coords", "junctions", "indptr", "indices", "weights", "geom_ptr", "geom_nodes")
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(tmp, **{name: getattr(self, name) for name in self._ARRAYS})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "RailNetwork":
+        with np.load(path) as data:
+            return cls(*(data[name] for name in cls._ARRAYS))
+
+    # --- Requêtes ---
+    def nearest_junction(self, coords):
+        """(jonction la plus proche, distance en km), ou (-1, inf) sans jonction reliée."""
+        if self._isolated.all(): return -1, float("inf")
+        d = _haversine(coords[0], coords[1], self._jcoords[:, 0], self._jcoords[:, 1])
+        d[self._isolated] = np.inf
+        i = int(np.argmin(d))
+        return i, float(d[i])
+
+    def nearest_arc(self, coords) -> Optional[dict]:
+        """
+        Projection du point sur le segment de voie le plus proche (à MAX_SNAP_KM près) :
+        {"arc", "rank" (segment dans l'arc), "offset_km" (depuis le début de l'arc), "point", "snap_km"}.
+        """
+        if not len(self._seg_km): return None
+        lat0, lon0 = coords
+        # Filtre grossier (boîte de MAX_SNAP_KM), puis projection plane locale (quelques dizaines de km)
+        ky = 2 * np.pi * EARTH_RADIUS_KM / 360
+        kx = ky * np.cos(np.radians(lat0))
+        a, b = self._seg_a, self._seg_b
+        dlat, dlon = MAX_SNAP_KM / ky, MAX_SNAP_KM / max(kx, 1e-6)
+        near = np.flatnonzero((np.minimum(a[:, 0], b[:, 0]) <= lat0 + dlat) & (np.maximum(a[:, 0], b[:, 0]) >= lat0 - dlat)
+                              & (np.minimum(a[:, 1], b[:, 1]) <= lon0 + dlon) & (np.maximum(a[:, 1], b[:, 1]) >= lon0 - dlon))
+        if not len(near): return None
+        ax, ay = (a[near, 1] - lon0) * kx, (a[near, 0] - lat0) * ky
+        bx, by = (b[near, 1] - lon0) * kx, (b[near, 0] - lat0) * ky
+        vx, vy = bx - ax, by - ay
+        t = np.clip(-(ax * vx + ay * vy) / np.maximum(vx * vx + vy * vy, 1e-12), 0.0, 1.0)
+        d = np.hypot(ax + t * vx, ay + t * vy)
+        i = int(np.argmin(d))
+        if d[i] > MAX_SNAP_KM: return None
+        seg = near[i]
+        point = a[seg] + t[i] * (b[seg] - a[seg])
+        return {"arc": int(self._seg_arc[seg]), "rank": int(self._seg_rank[seg]),
+                "offset_km": float(self._seg_offset[seg] + t[i] * self._seg_km[seg]),
+                "point": point, "snap_km": float(d[i])}
+
+    def _arc_nodes(self, arc: int) -> np.ndarray:
+        return self.geom_nodes[self.geom_ptr[arc]:self.geom_ptr[arc + 1]]
+
+    def _ends(self, snap: dict, outbound: bool) -> Dict[int, tuple]:
+        """
+        Jonctions aux deux bouts de l'arc d'une projection : {jonction: (km, tracé)}.
+        Tracé du point projeté vers la jonction (`outbound`), ou de la jonction vers le point.
+        """
+        arc, rank, off = snap["arc"], snap["rank"], snap["offset_km"]
+        nodes = self.node_coords[self._arc_nodes(arc)]
+        p = snap["point"][None]
+        to_start = np.vstack([p, nodes[rank::-1]])   # point -> début de l'arc
+        to_end = np.vstack([p, nodes[rank + 1:]])    # point -> fin de l'arc
+        ends: Dict[int, tuple] = {}
+        for j, km, pts in ((int(self._arc_source[arc]), off, to_start),
+                           (int(self.indices[arc]), float(self.weights[arc]) - off, to_end)):
+            if j not in ends or km < ends[j][0]: # Boucle : même jonction aux deux bouts
+                ends[j] = (km, pts if outbound else pts[::-1])
+        return ends
+
+    def shortest_path(self, source: int, target: int):
+        """A* entre deux jonctions : (km, liste des arcs) ou None si non connectées."""
+        if source == target: return 0.0, []
+        found = self._search({source: 0.0}, {target: 0.0}, self._jcoords[target])
+        return None if found is None else (found[0], found[2])
+
+    def _search(self, sources: Dict[int, float], targets: Dict[int, float], goal):
+        """
+        A* multi-sources : départ depuis `sources` (jonction -> km déjà parcourus), arrivée sur une
+        des `targets` (jonction -> km restant jusqu'au but). Heuristique : distance au point `goal`.
+        Renvoie (km, jonction de départ, arcs, jonction d'arrivée) ou None.
+        """
+        h_all = _haversine(self._jcoords[:, 0], self._jcoords[:, 1], goal[0], goal[1]) # Heuristique admissible
+        dist = dict(sources)
+        via = {}
+        heap = [(g + h_all[u], g, u) for u, g in sources.items()]
+        heapq.heapify(heap)
+        best, best_end = np.inf, None
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        while heap:
+            f, g, u = heapq.heappop(heap)
+            if f >= best: break
+            if g > dist.get(u, np.inf): continue
+            if u in targets and g + targets[u] < best:
+                best, best_end = g + targets[u], u
+            for e in range(indptr[u], indptr[u + 1]):
+                v = int(indices[e])
+                ng = g + weights[e]
+                if ng < dist.get(v, np.inf):
+                    dist[v] = ng
+                    via[v] = e
+                    heapq.heappush(heap, (ng + h_all[v], ng, v))
+        if best_end is None: return None
+        path, v = [], best_end
+        while v in via:
+            e = via[v]
+            path.append(e)
+            v = int(self._arc_source[e]) # Jonction de départ de l'arc
+        return float(best), v, path[::-1], best_end
+
+    def _settle(self, sources: Dict[int, float], targets) -> Dict[int, float]:
+        """Dijkstra multi-sources, arrêté dès que toutes les `targets` sont atteintes : {jonction: km}."""
+        dist = dict(sources)
+        heap = [(g, u) for u, g in sources.items()]
+        heapq.heapify(heap)
+        settled: Dict[int, float] = {}
+        remaining = set(targets)
+        indptr, indices, weights = self.indptr, self.indices, self.weights
+        while heap and remaining:
+            g, u = heapq.heappop(heap)
+            if u in settled: continue
+            settled[u] = g
+            remaining.discard(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = int(indices[e])
+                ng = g + weights[e]
+                if ng < dist.get(v, np.inf):
+                    dist[v] = ng
+                    heapq.heappush(heap, (ng, v))
+        return settled
+
+    def distances(self, origins, destinations) -> np.ndarray:
+        """
+        Distances ferrées (km, rabattements compris, arrondies comme get_rail_route) des paires
+        origins[i] -> destinations[i] ; NaN si non desservi. Mêmes valeurs que route(), sans tracé :
+        chaque point distinct est projeté une fois, un seul parcours du graphe par départ distinct.
+        """
+        o = np.asarray(origins, dtype=float).reshape(-1, 2)
+        d = np.asarray(destinations, dtype=float).reshape(-1, 2)
+        points, inverse = np.unique(np.vstack([o, d]), axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        oi, di = inverse[:len(o)], inverse[len(o):]
+        snaps = [self.nearest_arc(p) for p in points]
+        out = np.full(len(o), np.nan)
+        order = np.argsort(oi, kind="stable")
+        bounds = np.flatnonzero(np.diff(oi[order])) + 1
+        for group in np.split(order, bounds):
+            s = snaps[oi[group[0]]]
+            if s is None: continue
+            group = [p for p in group if snaps[di[p]] is not None]
+            tails = {k: self._ends(snaps[k], outbound=False) for k in dict.fromkeys(di[p] for p in group)}
+            heads = {j: km for j, (km, _) in self._ends(s, outbound=True).items()}
+            settled = self._settle(heads, {j for ends in tails.values() for j in ends})
+            for p in group:
+                t = snaps[di[p]]
+                best = abs(s["offset_km"] - t["offset_km"]) if s["arc"] == t["arc"] else np.inf
+                for j, (km, _) in tails[di[p]].items():
+                    if j in settled: best = min(best, settled[j] + km)
+                if best < np.inf: out[p] = round(best + s["snap_km"] + t["snap_km"], 1)
+        return out
+
+    def geometry(self, arcs) -> np.ndarray:
+        """Tracé complet (lat, lon) d'une suite d'arcs."""
+        if not arcs: return np.empty((0, 2))
+        nodes = [self.geom_nodes[self.geom_ptr[arcs[0]]:self.geom_ptr[arcs[0] + 1]]]
+        nodes += [self.geom_nodes[self.geom_ptr[e] + 1:self.geom_ptr[e + 1]] for e in arcs[1:]]
+        return self.node_coords[np.concatenate(nodes)]
+
+    def route(self, start_coords, end_coords) -> Optional[dict]:
+        """
+        Itinéraire ferré entre deux points, projetés sur la voie la plus proche :
+        {"distance_km" (sur voie), "snap_km" (rabattements), "points"} ou None si une extrémité
+        est trop loin du réseau ou si les voies ne sont pas reliées.
+        """
+        s, t = self.nearest_arc(start_coords), self.nearest_arc(end_coords)
+        if s is None or t is None: return None
+        snap_km = s["snap_km"] + t["snap_km"]
+        best = None
+        if s["arc"] == t["arc"]: # Même tronçon de voie : trajet direct le long de l'arc
+            nodes = self.node_coords[self._arc_nodes(s["arc"])]
+            lo, hi = sorted((s, t), key=lambda x: x["offset_km"])
+            between = nodes[lo["rank"] + 1:hi["rank"] + 1]
+            if lo is t: between = between[::-1]
+            best = (abs(s["offset_km"] - t["offset_km"]), np.vstack([s["point"][None], between, t["point"][None]]))
+        heads, tails = self._ends(s, outbound=True), self._ends(t, outbound=False)
+        found = self._search({j: km for j, (km, _) in heads.items()}, {j: km for j, (km, _) in tails.items()}, t["point"])
+        if found is not None and (best is None or found[0] < best[0]):
+            km, first, arcs, last = found
+            best = (km, np.vstack([heads[first][1], self.geometry(arcs), tails[last][1]]))
+        if best is None: return None
+        return {"distance_km": float(best[0]), "snap_km": snap_km, "points": best[1]}
+
+def _signature(path: Path) -> str:
+    st = path.stat()
+    return hashlib.sha1(f"{path.resolve()}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:12]
+
+_network = None
+_network_loaded = False
+_network_lock = threading.Lock()
+
+def get_rail_network() -> Optional[RailNetwork]:
+    """Graphe partagé (précalculé une fois, puis relu depuis le cache disque), ou None sans fichier local."""
+    global _network, _network_loaded
+    if not _network_loaded:
+        with _network_lock:
+            if not _network_loaded:
+                if RAIL_PATH.exists():
+                    try:
+                        sig = _signature(RAIL_PATH)
+                        cached = CACHE_DIR / f"rail_graph-{sig}.npz"
+                        if cached.exists():
+                            _network = RailNetwork.load(cached)
+                        else:
+                            with telemetry.span("rail.build"):
+                                _network = RailNetwork.from_lines(read_lines(RAIL_PATH))
+                            _network.save(cached)
+                        _network.signature = sig
+                        if not len(_network) or _network._isolated.all():
+                            _network = None # Fichier sans voie exploitable : estimation vol d'oiseau
+                    except Exception as e:
+                        telemetry.record_error("rail.load", e)
+                _network_loaded = True
+    return _network
+
+def get_rail_distances(origins, destinations) -> Optional[np.ndarray]:
+    """Distances ferrées par paire (NaN = non desservi), ou None sans réseau local. Voir RailNetwork.distances."""
+    network = get_rail_network()
+    if network is None: return None
+    with telemetry.span("rail.distances"): # Mesuré seulement quand un réseau est chargé
+        return network.distances(origins, destinations)
+
+@telemetry.traced("rail.route")
+def get_rail_route(start_coords, end_coords) -> Optional[dict]:
+    """
+    Itinéraire ferré mis en cache :
+    {"distance_km": float, "levels": {tolérance: polyline encodée}} ou None (pas de réseau / non desservi).
+    """
+    network = get_rail_network()
+    if network is None: return None
+    from utils.map_viz import SIMPLIFY_TOLERANCES, simplify_route
+    import polyline
+    key = (f"{network.signature}:arc:{round(start_coords[0], 3)},{round(start_coords[1], 3)}"
+           f";{round(end_coords[0], 3)},{round(end_coords[1], 3)}")
+    cached = RAIL_ROUTE_CACHE.get(key)
+    if cached is not MISSING: return cached
+    found = network.route(start_coords, end_coords)
+    route = None
+    if found is not None:
+        # Distance sur voie + rabattement vers la voie la plus proche
+        points = np.vstack([[start_coords], found["points"], [end_coords]])
+        route = {
+            "distance_km": round(found["distance_km"] + found["snap_km"], 1),
+            "levels": {str(tol): polyline.encode([tuple(p) for p in simplify_route(points, tol)], 5)
+                       for tol in SIMPLIFY_TOLERANCES},
+        }
+    RAIL_ROUTE_CACHE.set(key, route)
+    return route
@@ -0,0 +1,120 @@
+"""
+utils/results.py
+Résultat compact d'un trajet : colonnes typées (arrays NumPy) au lieu d'un DataFrame de dicts.
+- Meilleurs modes (CO2 / prix) précalculés.
+- Itération par enregistrements légers (ModeResult) pour l'affichage.
+- DataFrame reconstruit à la demande (graphiques, export).
+- Empreinte stable du résultat : clé des caches d'affichage (graphiques, carte, analyse).
+"""
+import hashlib
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+# Colonnes du tableau de résultats (noms affichés)
+FRAME_COLUMNS = {
+    "Mode": "modes",
+    "Distance (km)": "distance_km",
+    "CO2 (kg)": "co2_kg",
+    "Facteur (kgCO2/km)": "factor",
+    "Prix Moyen (€)": "price_avg",
+    "Prix Min (€)": "price_min",
+    "Prix Max (€)": "price_max",
+    "Carburant (€)": "fuel_cost",
+    "Péage (€)": "toll_cost",
+    "Type Prix": "price_type",
+}
+
+class ModeResult(NamedTuple):
+    mode: str
+    distance_km: float
+    co2_kg: float
+    factor: float
+    price_avg: float
+    price_min: float
+    price_max: float
+    fuel_cost: float
+    toll_cost: float
+    price_type: str
+
+class TripResult:
+    __slots__ = ("modes", "distance_km", "co2_kg", "factor", "price_avg", "price_min", "price_max",
+                 "fuel_cost", "toll_cost", "price_type", "best_co2_idx", "best_price_idx",
+                 "dist_road", "start_coords", "end_coords", "factor_version")
+
+    def __init__(self, modes, distance_km, co2_kg, factor, price_avg, price_min, price_max,
+                 fuel_cost, toll_cost, price_type, dist_road=None, start_coords=None, end_coords=None,
+                 factor_version=None):
+        self.modes: Tuple[str, ...] = tuple(modes)
+        self.distance_km = np.asarray(distance_km, dtype=np.float64)
+        self.co2_kg = np.asarray(co2_kg, dtype=np.float64)
+        self.factor = np.asarray(factor, dtype=np.float64)
+        self.price_avg = np.asarray(price_avg, dtype=np.float64)
+        self.price_min = np.asarray(price_min, dtype=np.float64)
+        self.price_max = np.asarray(price_max, dtype=np.float64)
+        self.fuel_cost = np.asarray(fuel_cost, dtype=np.float64)
+        self.toll_cost = np.asarray(toll_cost, dtype=np.float64)
+        self.price_type: Tuple[str, ...] = tuple(price_type)
+        self.best_co2_idx = int(np.argmin(self.co2_kg)) if len(self.modes) else -1
+        self.best_price_idx = int(np.argmin(self.price_avg)) if len(self.modes) else -1
+        self.dist_road = dist_road
+        self.start_coords = start_coords
+        self.end_coords = end_coords
+        self.factor_version = factor_version # Version des facteurs CO2 (utils/factors.py)
+
+    @classmethod
+    def from_frame(cls, df, **kwargs) -> "TripResult":
+        """Construit le résultat depuis les lignes d'une paire de calculate_trips()."""
+        return cls(**{attr: df[col].to_numpy() for col, attr in FRAME_COLUMNS.items()}, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.modes)
+
+    def row(self, i: int) -> ModeResult:
+        return ModeResult(*(getattr(self, attr)[i] if attr in ("modes", "price_type")
+                            else float(getattr(self, attr)[i]) for attr in FRAME_COLUMNS.values()))
+
+    def rows(self, keywords: Optional[Tuple[str, ...]] = None) -> Iterator[ModeResult]:
+        """Enregistrements par mode ; `keywords` filtre sur le nom (ex : ("Train",))."""
+        for i, mode in enumerate(self.modes):
+            if keywords is None or any(k in mode for k in keywords):
+                yield self.row(i)
+
+    @property
+    def best_co2(self) -> ModeResult:
+        return self.row(self.best_co2_idx)
+
+    @property
+    def best_price(self) -> ModeResult:
+        return self.row(self.best_price_idx)
+
+    @property
+    def fingerprint(self) -> str:
+        """Empreinte du trajet (modes, valeurs, extrémités, version des facteurs)."""
+        h = hashlib.sha1(repr((self.modes, self.price_type, self.start_coords, self.end_coords,
+                               self.factor_version)).encode())
+        for attr in FRAME_COLUMNS.values():
+            if attr not in ("modes", "price_type"): h.update(getattr(self, attr).tobytes())
+        return h.hexdigest()[:16]
+
+    @property
+    def nbytes(self) -> int:
+        """Taille approximative des colonnes numériques (octets)."""
+        return sum(getattr(self, a).nbytes for a in FRAME_COLUMNS.values() if a not in ("modes", "price_type"))
+
+    def to_dict(self) -> dict:
+        """Représentation JSON (API HTTP)."""
+        return {
+            "modes": [r._asdict() for r in self.rows()],
+            "best_co2": self.modes[self.best_co2_idx] if len(self) else None,
+            "best_price": self.modes[self.best_price_idx] if len(self) else None,
+            "dist_road_km": self.dist_road,
+            "start_coords": self.start_coords,
+            "end_coords": self.end_coords,
+            "factor_version": self.factor_version,
+        }
+
+    def to_frame(self):
+        """DataFrame (noms de colonnes historiques) pour les graphiques et l'export."""
+        import pandas as pd
+        return pd.DataFrame({col: getattr(self, attr) for col, attr in FRAME_COLUMNS.items()})
@@ -0,0 +1,248 @@
+"""
+utils/road_matrix.py
+Matrice routière précalculée entre villes "hubs" (optionnelle) : distances et durées réelles
+pour la voiture, l'autocar et le vélo, sans appel OSRM à chaque calcul.
+- Construite hors-ligne via le service /table d'un OSRM (local de préférence, cf. ECOROUTE_OSRM_URL).
+- Stockée en float32 brut sur disque, ouverte en mémoire mappée (np.memmap) : partagée entre workers.
+- Arbre k-d (coordonnées 3D sur la sphère) pour rattacher un point quelconque aux hubs proches ;
+  les trajets d'accès (point -> hub) sont estimés à vol d'oiseau × ROAD_DETOUR.
+Si la matrice est absente, get_road_matrix() renvoie None et on garde vol d'oiseau × 1,2.
+
+Construction :
+    python -m utils.road_matrix build --hubs data/communes.csv --top 400
+"""
+import argparse
+import heapq
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from utils import telemetry
+
+MATRIX_DIR = Path(os.environ.get("ECOROUTE_ROAD_MATRIX", Path(__file__).resolve().parent.parent / "data" / "road_matrix"))
+
+EARTH_RADIUS_KM = 6371.0088
+ROAD_DETOUR = 1.2        # Trajets d'accès au hub (même hypothèse que utils.data)
+ACCESS_SPEED_KMH = 50.0  # Vitesse moyenne des trajets d'accès
+MAX_ACCESS_KM = 40.0     # Au-delà, le point n'est pas couvert par la matrice
+K_HUBS = 3               # Hubs candidats à chaque extrémité
+TABLE_BLOCK = 100        # Taille des blocs sources × destinations demandés à OSRM
+
+def to_unit_xyz(coords) -> np.ndarray:
+    """(lat, lon) en degrés -> vecteurs unitaires 3D (la corde croît avec la distance orthodromique)."""
+    c = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    cos_lat = np.cos(c[:, 0])
+    return np.column_stack([cos_lat * np.cos(c[:, 1]), cos_lat * np.sin(c[:, 1]), np.sin(c[:, 0])])
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0))
+
+class KDTree:
+    """Arbre k-d statique (tableaux NumPy), requêtes des k plus proches voisins."""
+    def __init__(self, points, leaf_size: int = 16):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.leaf_size = leaf_size
+        self.perm = np.arange(len(self.points))
+        nodes = [] # [début, fin, dimension, seuil, gauche, droite]
+        if len(self.points): self._build(nodes, 0, len(self.points))
+        self.nodes = nodes
+
+    def _build(self, nodes, start, end) -> int:
+        node = len(nodes)
+        nodes.append([start, end, -1, 0.0, -1, -1])
+        if end - start > self.leaf_size:
+            pts = self.points[self.perm[start:end]]
+            dim = int(np.argmax(pts.max(axis=0) - pts.min(axis=0)))
+            mid = (start + end) // 2
+            self.perm[start:end] = self.perm[start:end][np.argpartition(pts[:, dim], mid - start)]
+            nodes[node][2] = dim
+            nodes[node][3] = float(self.points[self.perm[mid], dim])
+            nodes[node][4] = self._build(nodes, start, mid)
+            nodes[node][5] = self._build(nodes, mid, end)
+        return node
+
+    def query(self, x, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, distances euclidiennes) des k points les plus proches de x, du plus proche au plus loin."""
+        x = np.asarray(x, dtype=np.float64)
+        k = min(k, len(self.points))
+        best = [] # Tas max : (-d², indice)
+        stack = [0] if self.nodes else []
+        while stack:
+            node = stack.pop()
+            if node < 0: # Sous-arbre "lointain" : le revisiter seulement s'il peut encore améliorer
+                node, gap = ~node, stack.pop()
+                if len(best) == k and gap >= -best[0][0]: continue
+            start, end, dim, split, left, right = self.nodes[node]
+            if left < 0:
+                idx = self.perm[start:end]
+                d2 = ((self.points[idx] - x) ** 2).sum(axis=1)
+                for d, i in zip(d2.tolist(), idx.tolist()):
+                    if len(best) < k: heapq.heappush(best, (-d, i))
+                    elif d < -best[0][0]: heapq.heapreplace(best, (-d, i))
+                continue
+            diff = x[dim] - split
+            near, far = (left, right) if diff <= 0 else (right, left)
+            stack += [diff * diff, ~far, near] # Le proche d'abord (dépilé en premier)
+        best.sort(key=lambda b: -b[0])
+        return np.array([i for _, i in best], dtype=np.int64), np.sqrt([-d for d, _ in best])
+
+class RoadMatrix:
+    def __init__(self, names, coords, distance_km, duration_min, meta=None):
+        self.names = list(names)
+        self.coords = np.asarray(coords, dtype=np.float64)
+        self.distance_km = distance_km   # (N, N) float32, mémoire mappée
+        self.duration_min = duration_min
+        self.meta = meta or {}
+        self.tree = KDTree(to_unit_xyz(self.coords))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def load(cls, directory: Path) -> "RoadMatrix":
+        with open(directory / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        n = len(meta["hubs"])
+        dist = np.memmap(directory / "distance_km.f32", dtype=np.float32, mode="r", shape=(n, n))
+        dur = np.memmap(directory / "duration_min.f32", dtype=np.float32, mode="r", shape=(n, n))
+        return cls([h["name"] for h in meta["hubs"]], [(h["lat"], h["lon"]) for h in meta["hubs"]], dist, dur, meta)
+
+    def nearest_hubs(self, coords, k: int = K_HUBS):
+        """Pour chaque point : (indices (P, k), distances d'accès en km (P, k)) ; points répétés traités une fois."""
+        xyz = to_unit_xyz(coords)
+        uniq, inverse = np.unique(xyz, axis=0, return_inverse=True)
+        k = min(k, len(self))
+        idx = np.zeros((len(uniq), k), dtype=np.int64)
+        chord = np.full((len(uniq), k), np.inf)
+        for u, point in enumerate(uniq):
+            i, d = self.tree.query(point, k)
+            idx[u, :len(i)], chord[u, :len(d)] = i, d
+        inverse = inverse.ravel()
+        return idx[inverse], chord_to_km(chord)[inverse]
+
+    def lookup(self, origins, destinations):
+        """
+        Distances (km) et durées (min) routières, paire par paire (origins[i] -> destinations[i]).
+        NaN quand une extrémité est à plus de MAX_ACCESS_KM de tout hub.
+        Meilleure combinaison des K_HUBS hubs de chaque côté : accès + matrice + accès.
+        """
+        hs, acc_s = self.nearest_hubs(origins)
+        ht, acc_t = self.nearest_hubs(destinations)
+        access_s, access_t = acc_s * ROAD_DETOUR, acc_t * ROAD_DETOUR
+        core = np.asarray(self.distance_km[hs[:, :, None], ht[:, None, :]], dtype=np.float64) # (P, k, k)
+        core[~np.isfinite(core) | (core < 0)] = np.inf # Paires non routables
+        total = access_s[:, :, None] + core + access_t[:, None, :]
+        flat = total.reshape(len(total), -1).argmin(axis=1)
+        i, j = np.unravel_index(flat, total.shape[1:])
+        rows = np.arange(len(total))
+        km = total[rows, i, j]
+        minutes = (np.asarray(self.duration_min[hs[rows, i], ht[rows, j]], dtype=np.float64)
+                   + (access_s[rows, i] + access_t[rows, j]) / ACCESS_SPEED_KMH * 60)
+        uncovered = (acc_s[:, 0] > MAX_ACCESS_KM) | (acc_t[:, 0] > MAX_ACCESS_KM) | ~np.isfinite(km)
+        km[uncovered] = np.nan
+        minutes[uncovered] = np.nan
+        return km, minutes
+
+_matrix = None
+_matrix_loaded = False
+_matrix_lock = threading.Lock()
+
+def get_road_matrix() -> Optional[RoadMatrix]:
+    """Matrice partagée (ouverte une fois par processus), ou None si elle n'a pas été construite."""
+    global _matrix, _matrix_loaded
+    if not _matrix_loaded:
+        with _matrix_lock:
+            if not _matrix_loaded:
+                if (MATRIX_DIR / "meta.json").exists():
+                    try:
+                        _matrix = RoadMatrix.load(MATRIX_DIR)
+                    except Exception as e:
+                        telemetry.record_error("road_matrix.load", e)
+                _matrix_loaded = True
+    return _matrix
+
+def road_estimates(origins, destinations, fallback_km):
+    """
+    Distances (km) et durées (min) routières par paire ; `fallback_km` (vol d'oiseau × détour)
+    là où la matrice ne couvre pas la paire ou n'existe pas (durée NaN).
+    Trajets courts : si l'estimation directe est plus courte que le passage par les hubs, on la garde.
+    """
+    fallback_km = np.asarray(fallback_km, dtype=float)
+    matrix = get_road_matrix()
+    if matrix is None or not len(fallback_km):
+        return fallback_km, np.full(fallback_km.shape, np.nan)
+    with telemetry.span("road_matrix.lookup"):
+        km, minutes = matrix.lookup(origins, destinations)
+    use = ~np.isnan(km) & (km < fallback_km * 2) & (km > fallback_km / ROAD_DETOUR * 0.999)
+    return np.where(use, km, fallback_km), np.where(use, minutes, np.nan)
+
+# --- CONSTRUCTION HORS-LIGNE ---
+def _osrm_table(base_url, coords, sources, destinations, profile):
+    from utils import http_client
+    points = ";".join(f"{lon},{lat}" for lat, lon in coords)
+    r = http_client.get(f"{base_url}/table/v1/{profile}/{points}", timeout=120, params={
+        "sources": ";".join(map(str, sources)),
+        "destinations": ";".join(map(str, destinations)),
+        "annotations": "distance,duration",
+    })
+    r.raise_for_status()
+    data = r.json()
+    if data.get("code") != "Ok": raise RuntimeError(f"OSRM : {data.get('code')} {data.get('message', '')}")
+    nan = float("nan")
+    dist = np.array([[nan if v is None else v for v in row] for row in data["distances"]], dtype=np.float64)
+    dur = np.array([[nan if v is None else v for v in row] for row in data["durations"]], dtype=np.float64)
+    return dist / 1000, dur / 60
+
+def build(hubs_path: Path, out_dir: Path, top: Optional[int] = None, osrm_url: Optional[str] = None,
+          profile: str = "driving", block: int = TABLE_BLOCK):
+    """Interroge OSRM par blocs et écrit meta.json + distance_km.f32 + duration_min.f32."""
+    from utils.gazetteer import Gazetteer
+    from utils.map_viz import OSRM_URL
+    osrm_url = osrm_url or OSRM_URL
+    gz = Gazetteer.from_csv(hubs_path) # Mêmes alias de colonnes que le répertoire des communes
+    order = np.argsort(-gz.population, kind="stable")[:top] if top else np.arange(len(gz))
+    hubs = [{"name": gz.names[i], "lat": round(float(gz.lat[i]), 5), "lon": round(float(gz.lon[i]), 5)} for i in order]
+    n = len(hubs)
+    coords = [(h["lat"], h["lon"]) for h in hubs]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    dist = np.memmap(out_dir / "distance_km.f32.tmp", dtype=np.float32, mode="w+", shape=(n, n))
+    dur = np.memmap(out_dir / "duration_min.f32.tmp", dtype=np.float32, mode="w+", shape=(n, n))
+    t0 = time.time()
+    for s0 in range(0, n, block):
+        for d0 in range(0, n, block):
+            src, dst = range(s0, min(s0 + block, n)), range(d0, min(d0 + block, n))
+            # Seules les coordonnées du bloc sont envoyées
+            pts = [coords[i] for i in src] + [coords[j] for j in dst]
+            dk, dm = _osrm_table(osrm_url, pts, range(len(src)), range(len(src), len(pts)), profile)
+            dist[s0:src.stop, d0:dst.stop] = dk
+            dur[s0:src.stop, d0:dst.stop] = dm
+        print(f"✅ Lignes {s0}-{min(s0 + block, n) - 1} / {n}")
+    dist.flush(); dur.flush()
+    del dist, dur
+    os.replace(out_dir / "distance_km.f32.tmp", out_dir / "distance_km.f32")
+    os.replace(out_dir / "duration_min.f32.tmp", out_dir / "duration_min.f32")
+    meta = {"hubs": hubs, "profile": profile, "osrm_url": osrm_url,
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "build_seconds": round(time.time() - t0, 1)}
+    with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    print(f"🏁 Matrice {n}×{n} écrite dans {out_dir}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoRoute — matrice routière des hubs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Construit la matrice via OSRM /table")
+    b.add_argument("--hubs", type=Path, required=True, help="CSV des villes (nom, lat, lon, population)")
+    b.add_argument("--top", type=int, default=None, help="Garder les N villes les plus peuplées")
+    b.add_argument("-o", "--out", type=Path, default=MATRIX_DIR)
+    b.add_argument("--osrm", default=None, help="URL OSRM (défaut : ECOROUTE_OSRM_URL)")
+    b.add_argument("--block", type=int, default=TABLE_BLOCK)
+    args = parser.parse_args(argv)
+    build(args.hubs, args.out, top=args.top, osrm_url=args.osrm, block=args.block)
+
+if __name__ == "__main__":
+    main()
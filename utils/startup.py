@@ -0,0 +1,98 @@
+"""
+utils/startup.py
+Démarrage de l'application : pré-chargement et mesure du coût des imports.
+- warmup() : importe les dépendances lourdes (à appeler avant le fork des workers,
+  ou en tâche de fond via ECOROUTE_WARMUP=1).
+- import_report() : coût d'import par module, mesuré dans un interpréteur neuf.
+Usage : python -m utils.startup [--budget-ms 800]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, Iterable
+
+from utils import telemetry
+
+# Dépendances lourdes, chargées paresseusement par les modules utils
+HEAVY_MODULES = (
+    "numpy",
+    "pandas",
+    "requests",
+    "plotly.express",
+    "folium",
+    "streamlit_folium",
+    "litellm",
+)
+# Chemin de démarrage de app.py (doit rester léger)
+STARTUP_MODULES = ("utils.data", "utils.charts", "utils.chatbot", "utils.map_viz")
+
+def warmup(modules: Iterable[str] = HEAVY_MODULES) -> Dict[str, float]:
+    """Importe `modules` dans le processus courant ; renvoie la durée (s) de chacun."""
+    timings = {}
+    for name in modules:
+        t0 = time.perf_counter()
+        try:
+            __import__(name)
+        except Exception as e:
+            telemetry.record_error(f"warmup.{name}", e)
+            continue
+        timings[name] = time.perf_counter() - t0
+    return timings
+
+_warmup_started = False
+
+def start_background_warmup():
+    """Lance warmup() une seule fois, en tâche de fond, si ECOROUTE_WARMUP est activé."""
+    global _warmup_started
+    if _warmup_started or os.environ.get("ECOROUTE_WARMUP", "") not in ("1", "true", "yes"):
+        return
+    _warmup_started = True
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+
+def _import_cost_ms(module: str) -> float:
+    """Coût cumulé (ms) de `import module` dans un interpréteur neuf (python -X importtime)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    if proc.returncode != 0:
+        raise ImportError(proc.stderr.strip().splitlines()[-1] if proc.stderr else module)
+    # Lignes : "import time: self [us] | cumulative | imported package"
+    for line in reversed(proc.stderr.splitlines()):
+        m = re.match(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)", line)
+        if m and m.group(2) == module:
+            return int(m.group(1)) / 1000
+    return 0.0
+
+def import_report(modules: Iterable[str] = STARTUP_MODULES + HEAVY_MODULES) -> Dict[str, float]:
+    """Coût d'import (ms) de chaque module, None si le module est indisponible."""
+    report = {}
+    for name in modules:
+        try:
+            report[name] = round(_import_cost_ms(name), 1)
+        except ImportError:
+            report[name] = None
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Coût d'import des modules EcoRoute")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Échec si le chemin de démarrage (modules utils) dépasse ce budget")
+    args = parser.parse_args(argv)
+
+    report = import_report()
+    for name, ms in report.items():
+        print(f"{name:<20} {'indisponible' if ms is None else f'{ms:8.1f} ms'}")
+    startup_ms = sum(report[m] or 0 for m in STARTUP_MODULES)
+    print(f"{'démarrage (utils)':<20} {startup_ms:8.1f} ms")
+    if args.budget_ms is not None and startup_ms > args.budget_ms:
+        print(f"❌ Budget dépassé ({startup_ms:.0f} ms > {args.budget_ms:.0f} ms)")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
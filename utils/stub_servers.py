@@ -0,0 +1,260 @@
+"""
+utils/stub_servers.py
+Bouchons locaux des services tiers, pour mesurer EcoRoute sans dépendre du réseau :
+Nominatim (/search), Impact CO2 (/api/v1/transport), OSRM (/route, /table)
+et un serveur compatible OpenAI (/v1/chat/completions, streaming SSE compris) pour LiteLLM.
+- Latence configurable par service (moyenne + gigue) et injection d'erreurs (HTTP 503).
+- Réponses déterministes (coordonnées dérivées du nom de ville, distances = orthodromie × 1,25).
+- Chaque service écoute sur son propre port (les limites par hôte de utils/http_client.py s'appliquent).
+
+Usage autonome : python -m utils.stub_servers --latency nominatim=40,llm=300 --fail llm=0.1
+(affiche les variables d'environnement à exporter avant de lancer l'application).
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from aiohttp import web
+
+SERVICES = ("nominatim", "impactco2", "osrm", "llm")
+# Variable d'environnement lue par EcoRoute pour chaque service
+ENV_VARS = {
+    "nominatim": "ECOROUTE_NOMINATIM_URL",
+    "impactco2": "ECOROUTE_IMPACTCO2_URL",
+    "osrm": "ECOROUTE_OSRM_URL",
+    "llm": "ECOROUTE_LLM_API_BASE",
+}
+EARTH_RADIUS_KM = 6371.0088
+FRANCE_BBOX = (42.5, 50.8, -4.5, 7.8) # lat min, lat max, lon min, lon max
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0.0    # Latence moyenne par requête
+    jitter_ms: float = 0.0     # Gigue uniforme ± autour de la moyenne
+    failure_rate: float = 0.0  # Part des requêtes en erreur 503
+    token_ms: float = 5.0      # LLM : délai entre deux morceaux du flux
+    tokens: int = 60           # LLM : longueur de la réponse (morceaux)
+    requests: int = field(default=0, init=False)
+    failures: int = field(default=0, init=False)
+
+def _coords_for(name: str):
+    """Coordonnées stables (en France) pour un nom de lieu quelconque."""
+    h = hashlib.sha1(name.lower().encode()).digest()
+    u, v = int.from_bytes(h[:4], "big") / 2**32, int.from_bytes(h[4:8], "big") / 2**32
+    lat0, lat1, lon0, lon1 = FRANCE_BBOX
+    return lat0 + u * (lat1 - lat0), lon0 + v * (lon1 - lon0)
+
+def _haversine(a, b):
+    la1, lo1, la2, lo2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    x = math.sin((la2 - la1) / 2) ** 2 + math.cos(la1) * math.cos(la2) * math.sin((lo2 - lo1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, x)))
+
+def _parse_points(segment: str):
+    # OSRM : lon,lat;lon,lat...
+    return [(float(p.split(",")[1]), float(p.split(",")[0])) for p in segment.split(";")]
+
+class StubServers:
+    """Les quatre bouchons, servis par une boucle asyncio dans un thread de fond."""
+    def __init__(self, configs: Optional[Dict[str, StubConfig]] = None, host: str = "127.0.0.1", seed: int = 0):
+        self.configs = {name: StubConfig() for name in SERVICES}
+        self.configs.update(configs or {})
+        self.host = host
+        self.ports: Dict[str, int] = {}
+        self._rng = random.Random(seed)
+        self._loop = None
+        self._runners = []
+        self._thread = None
+
+    # --- Injection de latence / d'erreurs ---
+    async def _delay(self, service: str) -> bool:
+        """Applique la latence configurée ; False si la requête doit échouer."""
+        cfg = self.configs[service]
+        cfg.requests += 1
+        delay = cfg.latency_ms + (self._rng.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+        if delay > 0: await asyncio.sleep(delay / 1000)
+        if cfg.failure_rate and self._rng.random() < cfg.failure_rate:
+            cfg.failures += 1
+            return False
+        return True
+
+    @staticmethod
+    def _unavailable():
+        return web.json_response({"error": "injected failure"}, status=503)
+
+    # --- Nominatim ---
+    async def nominatim_search(self, request):
+        if not await self._delay("nominatim"): return self._unavailable()
+        query = request.query.get("q", "").split(",")[0].strip()
+        if not query or query.lower().startswith("introuvable"): return web.json_response([])
+        lat, lon = _coords_for(query)
+        return web.json_response([{"lat": f"{lat:.6f}", "lon": f"{lon:.6f}", "display_name": query}])
+
+    # --- Impact CO2 ---
+    async def impactco2_transport(self, request):
+        if not await self._delay("impactco2"): return self._unavailable()
+        data = [{"id": 4, "value": 0.218}, {"id": 5, "value": 0.0198}, {"id": 2, "value": 0.00293},
+                {"id": 3, "value": 0.00898}, {"id": 1, "value": 0.259}, {"id": 8, "value": 0.0295}]
+        return web.json_response({"data": data}, headers={"ETag": '"stub-v1"'})
+
+    # --- OSRM ---
+    async def osrm_route(self, request):
+        if not await self._delay("osrm"): return self._unavailable()
+        import polyline
+        (a, b) = _parse_points(request.match_info["points"])[:2]
+        km = _haversine(a, b) * 1.25
+        n = max(2, min(2000, int(km * 2))) # ~1 point / 500 m, comme une géométrie "full"
+        pts = [(a[0] + (b[0] - a[0]) * t + 0.02 * math.sin(t * 40), a[1] + (b[1] - a[1]) * t)
+               for t in (i / (n - 1) for i in range(n))]
+        return web.json_response({"code": "Ok", "routes": [{
+            "geometry": polyline.encode(pts, 5), "distance": km * 1000, "duration": km / 85 * 3600,
+        }]})
+
+    async def osrm_table(self, request):
+        if not await self._delay("osrm"): return self._unavailable()
+        pts = _parse_points(request.match_info["points"])
+        src = [int(i) for i in request.query.get("sources", "").split(";") if i] or range(len(pts))
+        dst = [int(i) for i in request.query.get("destinations", "").split(";") if i] or range(len(pts))
+        dist = [[_haversine(pts[s], pts[d]) * 1250 for d in dst] for s in src]
+        return web.json_response({"code": "Ok", "distances": dist,
+                                  "durations": [[m / 1000 / 85 * 3600 for m in row] for row in dist]})
+
+    # --- LLM (API OpenAI) ---
+    async def chat_completions(self, request):
+        body = await request.json()
+        if not await self._delay("llm"): return self._unavailable()
+        cfg = self.configs["llm"]
+        model = body.get("model", "stub")
+        words = [f"mot{i} " for i in range(cfg.tokens)]
+        created = int(time.time())
+        if not body.get("stream"):
+            await asyncio.sleep(cfg.token_ms * cfg.tokens / 1000)
+            return web.json_response({
+                "id": "stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": cfg.tokens, "total_tokens": cfg.tokens},
+            })
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for i, w in enumerate(words):
+            await asyncio.sleep(cfg.token_ms / 1000)
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": w} if i else {"role": "assistant", "content": w},
+                                  "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        end = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+               "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        await resp.write(f"data: {json.dumps(end)}\n\ndata: [DONE]\n\n".encode())
+        await resp.write_eof()
+        return resp
+
+    def _apps(self):
+        nominatim = web.Application()
+        nominatim.add_routes([web.get("/search", self.nominatim_search)])
+        impactco2 = web.Application()
+        impactco2.add_routes([web.get("/api/v1/transport", self.impactco2_transport)])
+        osrm = web.Application()
+        osrm.add_routes([web.get("/route/v1/{profile}/{points}", self.osrm_route),
+                         web.get("/table/v1/{profile}/{points}", self.osrm_table)])
+        llm = web.Application()
+        llm.add_routes([web.post("/v1/chat/completions", self.chat_completions),
+                        web.post("/chat/completions", self.chat_completions)])
+        return {"nominatim": nominatim, "impactco2": impactco2, "osrm": osrm, "llm": llm}
+
+    # --- Cycle de vie ---
+    def start(self) -> "StubServers":
+        ready = threading.Event()
+
+        async def _serve():
+            for name, app in self._apps().items():
+                runner = web.AppRunner(app, access_log=None)
+                await runner.setup()
+                site = web.TCPSite(runner, self.host, 0)
+                await site.start()
+                self.ports[name] = site._server.sockets[0].getsockname()[1]
+                self._runners.append(runner)
+            ready.set()
+
+        def _run():
+            self._loop = asyncio.new_event_loop()
+            self._loop.run_until_complete(_serve())
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=_run, name="stub-servers", daemon=True)
+        self._thread.start()
+        if not ready.wait(10): raise RuntimeError("Bouchons : démarrage impossible")
+        return self
+
+    def stop(self):
+        if self._loop is None: return
+        async def _cleanup():
+            for runner in self._runners: await runner.cleanup()
+        asyncio.run_coroutine_threadsafe(_cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._loop = None
+
+    def url(self, service: str) -> str:
+        base = f"http://{self.host}:{self.ports[service]}"
+        return f"{base}/v1" if service == "llm" else base
+
+    def env(self) -> Dict[str, str]:
+        """Variables d'environnement qui redirigent EcoRoute vers les bouchons."""
+        return {ENV_VARS[name]: self.url(name) for name in SERVICES}
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {name: {"requests": c.requests, "failures": c.failures} for name, c in self.configs.items()}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def parse_service_values(spec: Optional[str]) -> Dict[str, float]:
+    """'nominatim=40,llm=300' -> {"nominatim": 40.0, "llm": 300.0} ; 'all=20' s'applique à tous."""
+    values = {}
+    for part in filter(None, (spec or "").split(",")):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name != "all" and name not in SERVICES:
+            raise ValueError(f"Service inconnu : {name} (attendu : {', '.join(SERVICES)} ou all)")
+        for target in (SERVICES if name == "all" else (name,)):
+            values[target] = float(value)
+    return values
+
+def build_configs(latency=None, jitter=None, fail=None, token_ms=5.0, tokens=60) -> Dict[str, StubConfig]:
+    latency, jitter, fail = (parse_service_values(s) for s in (latency, jitter, fail))
+    return {name: StubConfig(latency.get(name, 0.0), jitter.get(name, 0.0), fail.get(name, 0.0),
+                             token_ms=token_ms, tokens=tokens) for name in SERVICES}
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", default="nominatim=40,impactco2=80,osrm=60,llm=250",
+                        help="Latence moyenne par service en ms (ex : nominatim=40,llm=300 ou all=20)")
+    parser.add_argument("--jitter", default="all=10", help="Gigue ± par service en ms")
+    parser.add_argument("--fail", default="", help="Taux d'erreurs 503 par service (ex : llm=0.1)")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="LLM : délai entre deux morceaux du flux")
+    parser.add_argument("--tokens", type=int, default=60, help="LLM : nombre de morceaux par réponse")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoRoute — bouchons locaux des services tiers")
+    add_stub_arguments(parser)
+    args = parser.parse_args(argv)
+    servers = StubServers(build_configs(args.latency, args.jitter, args.fail, args.token_ms, args.tokens)).start()
+    for key, value in servers.env().items():
+        print(f"export {key}={value}")
+    print("export ECOROUTE_NOMINATIM_RPS=1000")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servers.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+utils/telemetry.py
+Traçage léger des étapes d'un calcul (géocodage, facteurs CO2, OSRM, graphiques, LLM).
+- `span("etape")` (contexte) ou `@traced("etape")` (décorateur) : durée et erreurs par étape.
+- Compteurs étiquetés (hits / misses des caches, erreurs).
+- Dernières traces gardées en mémoire pour le panneau de debug de l'app.
+- Export au format texte Prometheus : `prometheus_text()`, GET /metrics de l'API,
+  ou serveur dédié pour Streamlit (ECOROUTE_METRICS_PORT=9108).
+Uniquement la bibliothèque standard : importable partout sans coût.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("ecoroute")
+
+# Bornes des histogrammes (s) : de la lecture de cache à l'appel LLM lent
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.9, 0.99)
+
+class _Stage:
+    """Histogramme cumulatif (export) + réservoir des dernières mesures (percentiles locaux)."""
+    __slots__ = ("buckets", "count", "total", "errors", "recent")
+
+    def __init__(self, window: int):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float, error: bool):
+        self.count += 1
+        self.total += seconds
+        if error: self.errors += 1
+        self.recent.append(seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q: float) -> Optional[float]:
+        samples = sorted(self.recent)
+        if not samples: return None
+        return samples[min(len(samples) - 1, int(round(q * (len(samples) - 1))))]
+
+class Telemetry:
+    def __init__(self, window: int = 1024, max_traces: int = 20):
+        self._window = window
+        self._stages: Dict[str, _Stage] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self._traces = deque(maxlen=max_traces)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    # --- Mesures ---
+    def observe(self, stage: str, seconds: float, error: bool = False):
+        """Enregistre une durée pour `stage` (utile quand un span ne convient pas, ex : générateurs)."""
+        with self._lock:
+            s = self._stages.get(stage)
+            if s is None:
+                s = self._stages[stage] = _Stage(self._window)
+            s.observe(seconds, error)
+
+    def count(self, name: str, value: int = 1, **labels):
+        """Incrémente le compteur `name` pour ces étiquettes."""
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def cache_result(self, cache: str, hit: bool):
+        self.count("ecoroute_cache_requests_total", cache=cache, result="hit" if hit else "miss")
+
+    def record_error(self, stage: str, exc: BaseException):
+        """Erreur rattrapée (repli, valeur par défaut) : journalisée et comptée, pas relancée."""
+        self.count("ecoroute_handled_errors_total", stage=stage, type=type(exc).__name__)
+        log.warning("%s : %s", stage, exc)
+
+    @contextmanager
+    def span(self, stage: str):
+        """Mesure le bloc ; les spans imbriqués d'un même thread forment une trace."""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        record = {"stage": stage, "depth": len(stack), "start": time.time(), "ms": None, "error": None}
+        if stack:
+            stack[0]["children"].append(record)
+        else:
+            record["children"] = []
+        stack.append(record)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            yield record
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - t0
+            stack.pop()
+            record["ms"] = round(elapsed * 1000, 2)
+            if error is not None: record["error"] = f"{type(error).__name__}: {error}"
+            self.observe(stage, elapsed, error is not None)
+            if not stack:
+                children = record.pop("children")
+                with self._lock:
+                    self._traces.append([record, *children])
+
+    def traced(self, stage: str):
+        """Décorateur : chaque appel de la fonction est un span `stage`."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # --- Lecture ---
+    def stage_summary(self) -> List[dict]:
+        """Une ligne par étape : nombre d'appels, erreurs, p50 / p99 (ms) sur les dernières mesures."""
+        with self._lock:
+            stages = [(name, s.count, s.errors, s.total, s.quantile(0.5), s.quantile(0.99))
+                      for name, s in self._stages.items()]
+        return [{
+            "stage": name,
+            "calls": count,
+            "errors": errors,
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "p99_ms": round(p99 * 1000, 1) if p99 is not None else None,
+            "mean_ms": round(total / count * 1000, 1) if count else None,
+        } for name, count, errors, total, p50, p99 in sorted(stages)]
+
+    def cache_summary(self) -> List[dict]:
+        """Hits / misses par cache."""
+        caches: Dict[str, Dict[str, int]] = {}
+        with self._lock:
+            for (name, labels), value in self._counters.items():
+                if name != "ecoroute_cache_requests_total": continue
+                lab = dict(labels)
+                caches.setdefault(lab["cache"], {"hit": 0, "miss": 0})[lab["result"]] += value
+        return [{"cache": name, "hits": c["hit"], "misses": c["miss"],
+                 "hit_rate": round(c["hit"] / (c["hit"] + c["miss"]), 3) if c["hit"] + c["miss"] else 0.0}
+                for name, c in sorted(caches.items())]
+
+    def recent_traces(self) -> List[List[dict]]:
+        """Dernières traces (la plus récente d'abord) : liste plate de spans avec leur profondeur."""
+        with self._lock:
+            return list(reversed(self._traces))
+
+    def prometheus_text(self) -> str:
+        """Export au format d'exposition texte Prometheus."""
+        with self._lock:
+            stages = {name: (list(s.buckets), s.count, s.total, s.errors,
+                             [s.quantile(q) for q in QUANTILES]) for name, s in self._stages.items()}
+            counters = dict(self._counters)
+        lines = [
+            "# HELP ecoroute_stage_duration_seconds Durée des étapes de calcul.",
+            "# TYPE ecoroute_stage_duration_seconds histogram",
+        ]
+        for name, (buckets, count, total, _, _) in sorted(stages.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f'ecoroute_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'ecoroute_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {count}')
+            lines.append(f'ecoroute_stage_duration_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'ecoroute_stage_duration_seconds_count{{stage="{name}"}} {count}')
+        lines += [
+            "# HELP ecoroute_stage_latency_seconds Percentiles des dernières mesures (fenêtre glissante).",
+            "# TYPE ecoroute_stage_latency_seconds gauge",
+        ]
+        for name, (_, _, _, _, quantiles) in sorted(stages.items()):
+            for q, value in zip(QUANTILES, quantiles):
+                if value is not None:
+                    lines.append(f'ecoroute_stage_latency_seconds{{stage="{name}",quantile="{q}"}} {value:.6f}')
+        lines += [
+            "# HELP ecoroute_stage_errors_total Étapes terminées sur une exception.",
+            "# TYPE ecoroute_stage_errors_total counter",
+        ]
+        for name, (_, _, _, errors, _) in sorted(stages.items()):
+            lines.append(f'ecoroute_stage_errors_total{{stage="{name}"}} {errors}')
+        typed = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lab = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            lines.append(f"{name}{{{lab}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._traces.clear()
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Instance partagée par tout le processus
+TELEMETRY = Telemetry()
+span = TELEMETRY.span
+traced = TELEMETRY.traced
+observe = TELEMETRY.observe
+count = TELEMETRY.count
+cache_result = TELEMETRY.cache_result
+record_error = TELEMETRY.record_error
+prometheus_text = TELEMETRY.prometheus_text
+
+# --- Export pour Streamlit (pas de route HTTP propre) ---
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port: Optional[int] = None):
+    """
+    Sert /metrics sur un port dédié (thread daemon), une seule fois par processus.
+    Port : argument, sinon ECOROUTE_METRICS_PORT ; rien n'est lancé si aucun n'est défini.
+    """
+    global _server
+    port = port or int(os.environ.get("ECOROUTE_METRICS_PORT", 0) or 0)
+    if not port: return None
+    with _server_lock:
+        if _server is not None: return _server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = prometheus_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): pass # Pas de bruit à chaque scrape
+
+        host = os.environ.get("ECOROUTE_METRICS_HOST", "127.0.0.1")
+        _server = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
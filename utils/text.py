@@ -0,0 +1,18 @@
+"""
+utils/text.py
+Normalisation des noms de lieux (clés de cache, recherche).
+"""
+import re
+import unicodedata
+
+def strip_accents(text: str) -> str:
+    """'Évry-Courcouronnes' -> 'Evry-Courcouronnes'."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+def normalize_city(name: str) -> str:
+    """Forme canonique d'un nom de ville : minuscules, sans accents, tirets/espaces unifiés."""
+    name = strip_accents(str(name)).casefold()
+    name = re.sub(r"[\s\-'’]+", " ", name).strip()
+    # Abréviations courantes : "St-Malo" -> "saint malo"
+    return re.sub(r"\b(st|ste)\b", lambda m: "saint" if m.group(1) == "st" else "sainte", name)
@@ -0,0 +1,156 @@
+"""
+utils/trip_cache.py
+Cache des trajets partagé par toutes les sessions du processus.
+- Clé : (départ normalisé, arrivée normalisée, version des facteurs CO2 du résultat gardé).
+- Borné en mémoire (octets estimés) avec éviction LRU, et en durée (TTL).
+- Requêtes identiques simultanées fusionnées : une seule calcule, les autres attendent son résultat.
+- Les sessions gardent la clé (quelques octets) ; le TripResult partagé ne doit pas être modifié.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils import telemetry
+from utils.text import normalize_city
+
+TRIP_CACHE_MB = float(os.environ.get("ECOROUTE_TRIP_CACHE_MB", "32"))
+ENTRY_OVERHEAD = 2048 # Octets : noms des modes, tuples, objets Python autour des arrays
+
+class TripCache:
+    def __init__(self, max_bytes: int = int(TRIP_CACHE_MB * 1024 * 1024), ttl: float = 3600 * 6):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple, Tuple[float, int, Any]]" = OrderedDict() # clé -> (expiration, taille, valeur)
+        self._inflight: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def key(start: str, end: str, factor_version: str) -> Tuple[str, str, str]:
+        return (normalize_city(start), normalize_city(end), factor_version)
+
+    def _evict(self):
+        while self._entries and self.bytes > self.max_bytes:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            telemetry.count("ecoroute_trip_cache_evictions_total")
+
+    def get(self, key) -> Optional[Any]:
+        """Valeur en cache (sans calcul), ou None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None: return None
+            if entry[0] < now:
+                del self._entries[key]
+                self.bytes -= entry[1]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def get_or_compute(self, key, compute: Callable[[], Any], size: Callable[[Any], int],
+                       rekey: Optional[Callable[[Any], Tuple]] = None) -> Any:
+        """
+        Valeur en cache, sinon calculée une seule fois même si plusieurs threads la demandent.
+        Les valeurs None (ex : ville introuvable) ne sont pas gardées.
+        rekey : clé sous laquelle garder la valeur calculée, si elle peut différer de `key`
+        (ex : facteurs CO2 rafraîchis entre la demande et le calcul).
+        """
+        value = self.get(key)
+        if value is not None:
+            with self._lock: self.hits += 1
+            telemetry.cache_result("trips", True)
+            return value
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        telemetry.cache_result("trips", not owner) # Une requête fusionnée ne recalcule rien
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock: self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        if value is not None:
+            nbytes = size(value) + ENTRY_OVERHEAD
+            stored = rekey(value) if rekey else key
+            with self._lock:
+                old = self._entries.pop(stored, None)
+                if old: self.bytes -= old[1]
+                self._entries[stored] = (time.time() + self.ttl, nbytes, value)
+                self.bytes += nbytes
+                self._evict()
+        with self._lock: self._inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses + self.coalesced
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.coalesced) / total, 3) if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "inflight": len(self._inflight),
+            }
+
+TRIP_CACHE = TripCache()
+
+def trip_key(start_city: str, end_city: str, factor_version: Optional[str] = None) -> Tuple[str, str, str]:
+    """
+    Référence légère d'un trajet (à garder en session).
+    factor_version : celle du TripResult obtenu ; à défaut, la version des facteurs courante.
+    """
+    if factor_version is None:
+        from utils.data import get_factor_version
+        factor_version = get_factor_version()
+    return TRIP_CACHE.key(start_city, end_city, factor_version)
+
+def shared_calculate_trip(start_city: str, end_city: str, key: Optional[Tuple] = None):
+    """
+    calculate_trip via le cache partagé : même retour (TripResult, distance route, coords départ, coords arrivée),
+    ou (None, None, None, None) si une ville est introuvable.
+    `key` : référence déjà obtenue par trip_key() (ex : relue depuis la session).
+    Le résultat est gardé sous la version des facteurs avec laquelle il a été calculé : après un
+    rafraîchissement, relire trip_key(départ, arrivée, result.factor_version) pour le retrouver.
+    """
+    from utils.data import calculate_trip
+    key = key or trip_key(start_city, end_city)
+    value = TRIP_CACHE.get_or_compute(
+        key,
+        lambda: (lambda r: r if r[0] is not None else None)(calculate_trip(start_city, end_city)),
+        size=lambda v: v[0].nbytes,
+        rekey=lambda v: TRIP_CACHE.key(start_city, end_city, v[0].factor_version),
+    )
+    return value if value is not None else (None, None, None, None)
@@ -0,0 +1,146 @@
+"""
+utils/uncertainty.py
+Mode scénarios (Monte Carlo) : au lieu des multiplicateurs fixes min / max de utils/pricing.py,
+on tire des milliers de scénarios et on renvoie des percentiles de prix et de CO2 par mode,
+ainsi que la probabilité que chaque mode soit le moins cher.
+- Variables tirées : prix du carburant / de l'électricité, consommation, occupation de la voiture,
+  part d'autoroute payante, anticipation de la réservation (billets), détour route / rail.
+- Mêmes scénarios pour tous les modes et toutes les paires (nombres aléatoires communs) :
+  les comparaisons entre modes ne sont pas bruitées par le tirage.
+- Tout est vectorisé (paires × tirages × modes), par blocs de paires pour borner la mémoire.
+- Même base que le tableau principal (par véhicule pour la voiture, par billet sinon) ;
+  l'occupation de la voiture ne sert qu'à la colonne séparée du prix médian par voyageur.
+"""
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+from utils import telemetry
+from utils.pricing import BASIS_BIRD, BASIS_RAIL, BASIS_ROAD, KIND_CAR, KIND_FREE, KIND_TICKET, TOLL_SHARE
+
+INTERACTIVE_DRAWS = 4000   # Tirages dans l'interface (quelques ms pour un trajet)
+MAX_DRAWS = 20000
+QUANTILES = (5, 50, 95)
+SEED = 2025                # Tirages reproductibles : même trajet, mêmes percentiles
+BLOCK_ELEMENTS = 4_000_000 # Paires × tirages × modes par bloc (~32 Mo en float64)
+
+# Hypothèses des scénarios
+FUEL_SIGMA = 0.10          # Prix essence / diesel (log-normal)
+ELECTRICITY_SIGMA = 0.25   # Recharge à domicile ... borne rapide
+CONSUMPTION_SIGMA = 0.12   # Conduite, relief, bouchons
+OCCUPANCY = (1, 2, 3, 4)
+OCCUPANCY_P = (0.55, 0.25, 0.12, 0.08)
+TOLL_CONCENTRATION = 10    # Beta centrée sur TOLL_SHARE
+LEAD_MEAN_DAYS = 21        # Anticipation moyenne de la réservation
+LEAD_DECAY_DAYS = 14       # Billet au prix min après quelques semaines, au prix max le jour même
+YIELD_SIGMA = 0.10         # Bruit du yield management, par mode
+DETOUR_SIGMA = {BASIS_BIRD: 0.0, BASIS_ROAD: 0.06, BASIS_RAIL: 0.04}
+
+def sample_scenarios(draws: int, n_modes: int, seed: int = SEED) -> Dict[str, np.ndarray]:
+    """Tirages communs à toutes les paires : arrays (N,) ou (N, K)."""
+    rng = np.random.default_rng(seed)
+    lead = rng.exponential(LEAD_MEAN_DAYS, draws)
+    return {
+        "fuel": rng.lognormal(0.0, FUEL_SIGMA, draws),
+        "electricity": rng.lognormal(0.0, ELECTRICITY_SIGMA, draws),
+        "consumption": np.clip(rng.lognormal(0.0, CONSUMPTION_SIGMA, draws), 0.7, 1.8),
+        "occupancy": rng.choice(np.array(OCCUPANCY, dtype=float), draws, p=OCCUPANCY_P),
+        "toll_share": rng.beta(TOLL_CONCENTRATION * TOLL_SHARE, TOLL_CONCENTRATION * (1 - TOLL_SHARE), draws),
+        "lead": np.exp(-lead / LEAD_DECAY_DAYS), # 1 le jour même, -> 0 longtemps à l'avance
+        "yield": rng.lognormal(0.0, YIELD_SIGMA, (draws, n_modes)),
+        "detour": np.stack([rng.lognormal(0.0, DETOUR_SIGMA[b], draws) for b in (BASIS_BIRD, BASIS_ROAD, BASIS_RAIL)], axis=1),
+    }
+
+def _draw_multipliers(s: Dict[str, np.ndarray], modes: Sequence[str], tariffs: np.ndarray) -> Dict[str, np.ndarray]:
+    """Multiplicateurs (K, N) par mode, dérivés des tirages et de la table des tarifs."""
+    kind = tariffs["kind"][:, None]
+    is_car, is_ticket = kind == KIND_CAR, kind == KIND_TICKET
+    is_electric = np.array(["Électrique" in m for m in modes])[:, None]
+    lead = tariffs["min_mult"][:, None] + (tariffs["max_mult"] - tariffs["min_mult"])[:, None] * s["lead"]
+    return {
+        "distance": s["detour"][:, tariffs["basis"]].T,
+        "fuel": np.where(is_electric, s["electricity"], s["fuel"]) * s["consumption"],
+        "toll_share": np.where(tariffs["toll_share"][:, None] > 0, s["toll_share"], 0.0),
+        "fare": np.where(is_ticket, lead * s["yield"].T, 1.0),
+        "per_traveller": np.where(is_car, 1.0 / s["occupancy"], 1.0),
+    }
+
+def _percentiles(x: np.ndarray, quantiles: Sequence[float]) -> np.ndarray:
+    """
+    Percentiles sur le dernier axe (interpolation linéaire, comme np.percentile).
+    Un tri du dernier axe (contigu) est bien plus rapide que np.percentile sur l'axe des tirages.
+    """
+    x = np.sort(x, axis=-1)
+    pos = np.asarray(quantiles, dtype=float) / 100 * (x.shape[-1] - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, x.shape[-1] - 1)
+    frac = pos - lo
+    return x[..., lo] * (1 - frac) + x[..., hi] * frac
+
+@telemetry.traced("uncertainty")
+def simulate(by_basis: np.ndarray, co2_dist: np.ndarray, tariffs: np.ndarray, factors: np.ndarray,
+             modes: Sequence[str], draws: int = INTERACTIVE_DRAWS, quantiles: Sequence[float] = QUANTILES, seed: int = SEED) -> Dict[str, np.ndarray]:
+    """
+    Monte Carlo prix / CO2 pour P paires × K modes.
+    by_basis : (P, 3) distances vol d'oiseau / route / rail servant au prix (comme dans calculate_trips).
+    co2_dist : (P, K) distances servant au CO2 (la matrice `dist` de calculate_trips).
+    tariffs : sous-table TARIFFS des K modes ; factors : (K,) kgCO2/km.
+    Renvoie quantiles : (Q,) ; price / co2 : (P, K, Q) percentiles ; price_per_traveller : (P, K) médiane du prix
+    par voyageur (voiture partagée) ; p_cheapest : (P, K) probabilité d'être le mode le moins cher
+    (modes payants uniquement, 0 pour les modes gratuits).
+    """
+    draws = int(min(max(draws, 1), MAX_DRAWS))
+    by_basis = np.asarray(by_basis, dtype=float).reshape(-1, 3)
+    co2_dist = np.asarray(co2_dist, dtype=float).reshape(len(by_basis), -1)
+    n_pairs, n_modes = len(by_basis), len(tariffs)
+    m = _draw_multipliers(sample_scenarios(draws, n_modes, seed), modes, tariffs)
+    paid = (tariffs["kind"] != KIND_FREE)[:, None]
+    # Constantes par mode en colonne (K, 1) : diffusées sur les tirages
+    col = lambda v: np.asarray(v, dtype=float)[:, None]
+    fuel_per_km = col(tariffs["consumption"] / 100 * tariffs["fuel_price"])
+    toll_rate, rate, base, factors = col(tariffs["toll_rate"]), col(tariffs["rate"]), col(tariffs["base"]), col(factors)
+    out = {
+        "quantiles": np.asarray(quantiles, dtype=float),
+        "price": np.empty((n_pairs, n_modes, len(quantiles))),
+        "co2": np.empty((n_pairs, n_modes, len(quantiles))),
+        "price_per_traveller": np.empty((n_pairs, n_modes)),
+        "p_cheapest": np.zeros((n_pairs, n_modes)),
+    }
+    block = max(1, BLOCK_ELEMENTS // (draws * n_modes))
+    for a in range(0, n_pairs, block):
+        # (C, K, N) : distance de chaque mode dans chaque scénario
+        d = by_basis[a:a + block, tariffs["basis"], None] * m["distance"]
+        price = (base + d * rate) * m["fare"] + d * fuel_per_km * m["fuel"] + d * m["toll_share"] * toll_rate
+        out["price"][a:a + block] = _percentiles(price, quantiles)
+        out["price_per_traveller"][a:a + block] = _percentiles(price * m["per_traveller"], (50,))[..., 0]
+        out["co2"][a:a + block] = _percentiles(co2_dist[a:a + block, :, None] * m["distance"] * factors, quantiles)
+        if paid.any():
+            cheapest = np.argmin(np.where(paid, price, np.inf), axis=1) # (C, N)
+            n = len(cheapest)
+            counts = np.bincount((cheapest + n_modes * np.arange(n)[:, None]).ravel(), minlength=n * n_modes)
+            out["p_cheapest"][a:a + block] = counts.reshape(n, n_modes) / draws
+    return out
+
+def uncertainty_column_names(quantiles: Sequence[float] = QUANTILES) -> Tuple[str, ...]:
+    """Colonnes ajoutées au tableau de calculate_trips(draws=...), pour ces percentiles."""
+    labels = ["Médian" if q == 50 else f"P{q:g}" for q in quantiles]
+    return (*(f"Prix {l} (€)" for l in labels), *(f"CO2 {l} (kg)" for l in labels),
+            "P(moins cher)", "Prix Médian / voyageur (€)")
+
+UNCERTAINTY_COLUMNS = uncertainty_column_names()
+
+def uncertainty_columns(sim: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Colonnes à plat (une ligne par paire × mode), dans l'ordre du tableau long."""
+    from utils.pricing import round_exact
+    n_q = len(sim["quantiles"])
+    price, co2 = sim["price"].reshape(-1, n_q), sim["co2"].reshape(-1, n_q)
+    values = [round_exact(price[:, q]) for q in range(n_q)] + [round_exact(co2[:, q]) for q in range(n_q)]
+    values.append(round_exact(sim["p_cheapest"].ravel(), 3))
+    values.append(round_exact(sim["price_per_traveller"].ravel()))
+    return dict(zip(uncertainty_column_names(sim["quantiles"]), values))
+
+def trip_uncertainty(result, draws: int = INTERACTIVE_DRAWS):
+    """Tableau Mode + percentiles pour un TripResult (coordonnées déjà connues : pas de géocodage)."""
+    from utils.data import calculate_trips
+    df = calculate_trips([result.start_coords], [result.end_coords], draws=draws)
+    return df[["Mode", "Prix Moyen (€)", "CO2 (kg)", *UNCERTAINTY_COLUMNS]].reset_index(drop=True)